@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from django.core.management import BaseCommand, CommandError
+
+from common.const import SensorType
+from common.storage.sensor_rollup import (
+    ROLLUP_RESOLUTIONS,
+    ensure_rollup_indexes,
+    replace_rollups,
+)
+from common.storage.sensor_store import floor_datetime, sensor_store
+
+
+class Command(BaseCommand):
+    help = "rebuild the 1m/1h/1d rollups of the sensor readings in a date range"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", required=True, help="start date, YYYY-mm-dd")
+        parser.add_argument("--end", help="end date(excluded), YYYY-mm-dd, default now")
+        parser.add_argument(
+            "--sensor-types",
+            nargs="*",
+            default=SensorType.values(),
+            help=f"default: {' '.join(SensorType.values())}",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start_date = datetime.strptime(options["start"], "%Y-%m-%d")
+            end_date = (
+                datetime.strptime(options["end"], "%Y-%m-%d")
+                if options["end"]
+                else datetime.now()
+            )
+        except ValueError as e:
+            raise CommandError(f"invalid date: {e}")
+        if not SensorType.is_sup_list(options["sensor_types"]):
+            raise CommandError(f"invalid sensor types: {options['sensor_types']}")
+        ensure_rollup_indexes()
+        # a chunk is the coarsest period, so every period is rebuilt from all its readings
+        chunk_seconds = max(ROLLUP_RESOLUTIONS.values())
+        start_date = floor_datetime(start_date, chunk_seconds)
+        for sensor_type in options["sensor_types"]:
+            sensor_ids = sensor_store.collection(sensor_type).distinct("sensor_id")
+            self.stdout.write(f"backfill {sensor_type} for {len(sensor_ids)} sensors")
+            for sensor_id in sensor_ids:
+                readings_count = 0
+                chunk_start = start_date
+                while chunk_start < end_date:
+                    chunk_end = chunk_start + timedelta(seconds=chunk_seconds)
+                    readings = sensor_store.find_readings(
+                        sensor_type,
+                        sensor_id,
+                        chunk_start,
+                        chunk_end,
+                        include_end=False,
+                    )
+                    if readings:
+                        replace_rollups(sensor_type, readings)
+                        readings_count += len(readings)
+                    chunk_start = chunk_end
+                self.stdout.write(f"{sensor_type} {sensor_id}: {readings_count} readings")
+        self.stdout.write("backfill succeed!")
@@ -0,0 +1,147 @@
+import json
+import os
+from datetime import datetime
+
+from cloud.settings import ALARM_CONFIG
+from cloud_alarm.models.alarm_rule import AlarmRule
+from cloud_alarm.services.alarm_backtest import run_backtest
+from django.core.management import BaseCommand, CommandError
+from file_management.models.electrical_equipment import ElectricalEquipment
+from file_management.models.measure_point import MeasurePoint
+
+RULE_FIELDS = ("sensor_type", "param", "kind", "threshold", "n", "m", "level")
+
+
+class Command(BaseCommand):
+    help = (
+        "count the alarms which candidate rules would have raised on the stored "
+        "readings of some points in a date range"
+    )
+
+    def add_arguments(self, parser):
+        points = parser.add_mutually_exclusive_group(required=True)
+        points.add_argument("--point-ids", nargs="+")
+        points.add_argument("--equipment-id")
+        points.add_argument("--site-id")
+        parser.add_argument("--start", required=True, help="start date, YYYY-mm-dd")
+        parser.add_argument("--end", help="end date(excluded), YYYY-mm-dd, default now")
+        parser.add_argument(
+            "--rules",
+            help=(
+                "json list of rules in the shape of ALARM_CONFIG['default_rules'], "
+                "or @<json file>; default the configured rules of every point"
+            ),
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument(
+            "--chunk-days", type=float, default=1.0, help="readings read at a time"
+        )
+        parser.add_argument(
+            "--samples", type=int, default=10, help="events returned per rule"
+        )
+        parser.add_argument("--output", help="write the results into a json file")
+
+    def handle(self, *args, **options):
+        try:
+            start_date = datetime.strptime(options["start"], "%Y-%m-%d")
+            end_date = (
+                datetime.strptime(options["end"], "%Y-%m-%d")
+                if options["end"]
+                else datetime.now()
+            )
+        except ValueError as e:
+            raise CommandError(f"invalid date: {e}")
+        points = self.get_points(options)
+        if not points:
+            raise CommandError("no points found")
+        if options["rules"]:
+            rules, point_rules = self.load_rules(options["rules"]), None
+        else:
+            rules, point_rules = [], self.get_configured_rules(points)
+        self.stdout.write(
+            f"backtest {len(points)} points from {start_date} to {end_date}"
+        )
+        results = run_backtest(
+            [
+                {
+                    "point_id": str(point.pk),
+                    "point_name": point.measure_name,
+                    "sensor_id": point.sensor_number,
+                    "sensor_type": point.measure_type,
+                }
+                for point in points
+            ],
+            rules,
+            start_date,
+            end_date,
+            options["workers"],
+            options["chunk_days"],
+            options["samples"],
+            point_rules,
+        )
+        for result in results:
+            for rule_result in result["rules"]:
+                rule = rule_result["rule"]
+                self.stdout.write(
+                    f"{result['point_name']}({result['sensor_id']}) "
+                    f"{rule['sensor_type']}.{rule['param']} {rule['kind']} "
+                    f"{rule['threshold']}: {rule_result['fire_count']} alarms, "
+                    f"first {rule_result['first_fire']}, last {rule_result['last_fire']}"
+                )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+            self.stdout.write(f"results are written to {options['output']}")
+        self.stdout.write("backtest succeed!")
+
+    @staticmethod
+    def get_points(options: dict) -> list:
+        if options["point_ids"]:
+            points = MeasurePoint.objects(id__in=options["point_ids"])
+        elif options["equipment_id"]:
+            points = MeasurePoint.objects(equipment_id=options["equipment_id"])
+        else:
+            equipment_ids = ElectricalEquipment.objects(
+                site_id=options["site_id"]
+            ).values_list("id")
+            points = MeasurePoint.objects(equipment_id__in=equipment_ids)
+        return list(points.only("measure_name", "measure_type", "sensor_number", "id"))
+
+    @staticmethod
+    def load_rules(rules: str) -> list:
+        try:
+            if rules.startswith("@"):
+                with open(rules[1:]) as f:
+                    rules = json.load(f)
+            else:
+                rules = json.loads(rules)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"invalid rules: {e}")
+        if not isinstance(rules, list) or not all(
+            isinstance(rule, dict)
+            and {"sensor_type", "param", "kind", "threshold"} <= set(rule)
+            for rule in rules
+        ):
+            raise CommandError("rules should be a list of rules")
+        return rules
+
+    @staticmethod
+    def get_configured_rules(points: list) -> dict:
+        """point_id -> own rules and the default rules not replaced, like RuleSet"""
+        own_rules = {}
+        for alarm_rule in AlarmRule.objects(
+            point_id__in=[point.pk for point in points], enabled=True
+        ):
+            own_rules.setdefault(str(alarm_rule.point_id), []).append(
+                {field: alarm_rule[field] for field in RULE_FIELDS}
+            )
+        point_rules = {}
+        for point in points:
+            rules = own_rules.get(str(point.pk), [])
+            replaced = {(rule["param"], rule["kind"]) for rule in rules}
+            point_rules[str(point.pk)] = rules + [
+                rule
+                for rule in ALARM_CONFIG["default_rules"]
+                if (rule["param"], rule["kind"]) not in replaced
+            ]
+        return point_rules
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from django.core.management import BaseCommand, CommandError
+
+from common.const import SensorType
+from common.storage.sensor_indexes import ensure_sensor_indexes
+from common.storage.sensor_latest import sensor_latest_col
+from common.storage.sensor_store import sensor_store
+
+
+def get_plan_stages(plan: dict) -> list:
+    """collect all stage names of a explain() winningPlan"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(get_plan_stages(plan[key]))
+    for key in ("inputStages", "shards"):
+        for sub_plan in plan.get(key, []):
+            stages.extend(get_plan_stages(sub_plan.get("winningPlan", sub_plan)))
+    return stages
+
+
+class Command(BaseCommand):
+    help = (
+        "create the indexes of the raw sensor collections and verify that "
+        "the queries of PointsTrendService and BaseService use them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check-only",
+            action="store_true",
+            help="only run the explain() verification, don't create indexes",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check_only"]:
+            for collection, index_names in ensure_sensor_indexes().items():
+                self.stdout.write(f"{collection}: {', '.join(index_names)}")
+        collscans = []
+        for name, cursor in self.get_query_shapes():
+            stages = get_plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            self.stdout.write(f"{name}: {' <- '.join(stages)}")
+            if "COLLSCAN" in stages:
+                collscans.append(name)
+        if collscans:
+            raise CommandError(f"COLLSCAN found in: {', '.join(collscans)}")
+        self.stdout.write("all sensor queries use indexes!")
+
+    @staticmethod
+    def get_query_shapes() -> list:
+        """
+        the same query shapes as PointsTrendService and BaseService use
+        with the configured storage engine
+        """
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=1)
+        shapes = []
+        for sensor_type in SensorType.values():
+            mongo_col = sensor_store.collection(sensor_type)
+            sample = mongo_col.find_one() or {}
+            sensor_id = sample.get("sensor_id", "")
+            client_id = sample.get("client_id", "")
+            shapes += [
+                (
+                    f"{sensor_type} points trend",
+                    mongo_col.find(
+                        sensor_store.get_time_range_query(
+                            sensor_id, start_date, end_date
+                        )
+                    ).sort([(sensor_store.time_field, 1)]),
+                ),
+                (
+                    f"{sensor_type} points graph",
+                    mongo_col.find(
+                        sensor_store.get_time_range_query(
+                            sensor_id, start_date, end_date, include_end=False
+                        )
+                    )
+                    .sort([(sensor_store.time_field, 1)])
+                    .limit(1),
+                ),
+                (
+                    f"{sensor_type} delete sensor data",
+                    mongo_col.find({"sensor_id": {"$in": [sensor_id]}}),
+                ),
+                (
+                    f"{sensor_type} delete sensor data from gateway",
+                    mongo_col.find({"client_id": client_id}),
+                ),
+                (
+                    f"{sensor_type} latest sensor info",
+                    sensor_latest_col.find(
+                        {"sensor_id": sensor_id, "sensor_type": sensor_type}
+                    ).limit(1),
+                ),
+            ]
+        return shapes
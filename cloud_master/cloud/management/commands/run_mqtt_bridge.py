@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from cloud_mqtt.bridge import run_bridge
+
+
+class Command(BaseCommand):
+    help = "run the mqtt bridge, the only mqtt connection of the web workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--socket-path", default="", help="default MQTT_BRIDGE_CONFIG socket_path"
+        )
+
+    def handle(self, *args, **options):
+        run_bridge(options["socket_path"])
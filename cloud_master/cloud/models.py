@@ -9,7 +9,10 @@ from mongoengine.document import Document, EmbeddedDocument
 from mongoengine.fields import BooleanField, DateTimeField, EmailField, StringField
 
 from common.framework.db_operate_counter import increase_db_operate_count
-from common.framework.queryset import CloudDocumentMetaclass
+from common.framework.queryset import (
+    CloudDocumentMetaclass,
+    notify_document_changed,
+)
 from common.utils.datetime_utils import date_to_timestamp
 
 logger = logging.getLogger(__name__)
@@ -68,7 +71,9 @@ class CloudDocument(Document, DocumentMixin, metaclass=CloudDocumentMetaclass):
             and "update_date" not in changed_fields
         ):
             self.update_date = self._default_update_date
-        return super(CloudDocument, self).save(*args, **kwargs)
+        document = super(CloudDocument, self).save(*args, **kwargs)
+        notify_document_changed(self.__class__)
+        return document
 
     def update(self, auto_update_update_date=True, **kwargs):
         if auto_update_update_date and kwargs:
@@ -214,10 +214,142 @@ MQTT_CLIENT_CONFIG = {
     "pw": "xyjf321",
     # "subscribe_client_id": "8E001302000001A5"
     "subscribe_client_id": str(ObjectId()),
+    "connect_timeout": 5.0,  # second, the first publish waits for the connection
+}
+# the process owning the mqtt connection of the web workers, see cloud_mqtt.bridge
+MQTT_BRIDGE_CONFIG = {
+    "socket_path": "/tmp/cloud_mqtt_bridge.sock",  # "" to connect in every worker
+    "request_timeout": 5.0,  # second, wait for the reply of a gateway
+}
+# buffered writer of subscribe_message.DataLoader
+DATA_LOADER_CONFIG = {
+    "flush_size": 500,  # flush when so many readings are buffered
+    "flush_interval": 1.0,  # second, flush when the oldest buffered reading is so old
+    "max_queue_size": 100000,  # readings are dropped when the queue is full
+    # the readings are appended to a local spool before they are written,
+    # and replayed from it after mongodb failures, see cloud_ingest.spool
+    "spool": {
+        "directory": os.path.join(BASE_DIR, "ingest_spool"),  # "" to disable
+        "segment_bytes": 64 * 1024 * 1024,
+        "max_bytes": 2 * 1024 * 1024 * 1024,  # put() blocks when the spool is full
+        "fsync": False,  # fsync every append, survives power loss but slower
+    },
+}
+# ingestion workers started by cloud_ingest.supervisor
+INGEST_SUPERVISOR_CONFIG = {
+    "workers": os.cpu_count() or 1,  # number of DataLoader processes
+    # "": every worker receives all messages and loads the gateways hashed to it,
+    # else the workers subscribe with `$share/<share_group>/` and the broker
+    # balances the messages between them, only with ALARM_CONFIG, BASELINE_CONFIG
+    # and HEARTBEAT_CONFIG disabled, they keep the state of a sensor per worker
+    "share_group": "",
+    "stats_interval": 60,  # second, log the throughput of every worker
+}
+# duplicate suppression of the redelivered readings, see cloud_ingest.dedup
+INGEST_DEDUP_CONFIG = {
+    "recent_keys": 100000,  # reading keys remembered by every DataLoader
+}
+# /metrics endpoint of the ingestion, see cloud_ingest.metrics
+INGEST_METRICS_CONFIG = {
+    "host": "127.0.0.1",
+    # 0 to disable, the supervisor's worker i listens on port + i
+    "port": 9464,
+    "log_sample_interval": 10,  # second, an ingest event is logged once in it
+}
+# storage engine of the sensor readings, see common.storage.sensor_store
+SENSOR_STORAGE_CONFIG = {
+    "mode": "raw",  # raw: one document per reading, bucket: time-bucketed documents
+    "bucket_seconds": 3600,  # time span of one bucket document
+}
+# 1m/1h/1d rollups of the numeric params, see common.storage.sensor_rollup
+SENSOR_ROLLUP_CONFIG = {
+    "enabled": True,  # maintain the rollups at ingest
+    # trend with max_points uses the coarsest rollup which still gives so many points
+    "min_points": 300,
+}
+# per-site redis streams of the live readings, see common.storage.reading_stream
+READING_STREAM_CONFIG = {
+    "enabled": True,  # append the written readings at ingest
+    "maxlen": 10000,  # approximate length of every site stream
+    "gateway_refresh_interval": 60,  # second, reload the client_id -> site_id map
+}
+# offline detection of the sensors at ingest, see cloud_ingest.heartbeat
+HEARTBEAT_CONFIG = {
+    "enabled": True,
+    "missed_uploads": 3,  # offline after so many upload_interval without a reading
+    "default_upload_interval": 600,  # second, of the sensors without upload_interval
+    "refresh_interval": 300,  # second, reload the upload intervals and the sites
+    "tick_interval": 1.0,  # second
+    "online_retention": 7 * 24 * 3600,  # second, offline sensors kept in the counts
+}
+# rolling baseline and z-score of the params at ingest, see cloud_ingest.baseline
+BASELINE_CONFIG = {
+    "enabled": True,
+    "params": {
+        "TEV": ["amp"],
+        "AE": ["ampmax", "ampmean"],
+        "UHF": ["ampmax", "ampmean"],
+    },
+    "alpha": 0.01,  # weight of a new reading, about the last 100 readings count
+    "warmup": 30,  # readings of a sensor before its z-scores are given
+    "range_sigmas": 3.0,  # normal range: mean +- range_sigmas * std
+    "persist_interval": 60,  # second, write the baselines into sensor_latest
+}
+# phase resolved partial discharge histograms, see common.storage.sensor_prpd
+PRPD_CONFIG = {
+    # param of the phase resolved pulse sequence(cycles x phases) of every sensor type
+    "fields": {"UHF": "prps", "AE": "prps"},
+    "phase_bins": 64,
+    "amplitude_bins": 64,
+    # pulses are the amplitudes above the low end, the ones above the high end are
+    # counted into the last bin
+    "amplitude_range": {"UHF": [0, 80], "AE": [0, 80]},
+    "batch_size": 500,  # readings stacked into one np.bincount
+    "cache_delay": 3600,  # second, a day is cached so long after its end
+}
+# alarm rules evaluated at ingest, see cloud_alarm.services.alarm_algorithm
+ALARM_CONFIG = {
+    "enabled": True,
+    "rule_refresh_interval": 60,  # second, reload the rules of the alarm_rule
+    "flush_size": 200,  # alarm events written in one insert
+    "flush_interval": 1.0,  # second
+    "max_pending": 100000,  # events kept while mongodb is down
+    # the rules of every sensor without its own rule of the same param and kind,
+    # threshold of "rate" is the rise per minute
+    "default_rules": [
+        {"sensor_type": "Temp", "param": "temp", "kind": "threshold", "threshold": 80},
+        {"sensor_type": "Temp", "param": "temp", "kind": "rate", "threshold": 5},
+        {
+            "sensor_type": "TEV",
+            "param": "amp",
+            "kind": "threshold",
+            "threshold": 40,
+            "n": 3,
+            "m": 5,
+        },
+        {
+            "sensor_type": "AE",
+            "param": "ampmax",
+            "kind": "threshold",
+            "threshold": 30,
+            "n": 3,
+            "m": 5,
+        },
+        {
+            "sensor_type": "UHF",
+            "param": "ampmax",
+            "kind": "threshold",
+            "threshold": 60,
+            "n": 3,
+            "m": 5,
+        },
+    ],
 }
 REDIS_HOST = "81.69.56.189"
 REDIS_PORT = 7086
 CLIENT_IDS = "client_ids"  # It's a key which stored enabled client ids in redis(set)
+# the changes of CLIENT_IDS are published here, see common.storage.client_id_cache
+CLIENT_IDS_CHANNEL = "client_ids:changed"
 
 MG_HOST = "81.69.56.189"
 MG_PORT = 7085
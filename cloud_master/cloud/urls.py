@@ -28,4 +28,5 @@ urlpatterns += [
     path("rest/v1/", include("equipment_management.urls")),
     path("rest/v1/", include("file_management.urls")),
     path("rest/v1/", include("navigation.urls")),
+    path("rest/v1/", include("cloud_alarm.urls")),
 ]
@@ -0,0 +1,84 @@
+import logging
+
+from cloud_alarm.services.alarm_rule_service import AlarmRuleService
+from cloud_alarm.validators.alarm_rule_serializers import CreateAlarmRuleSerializer
+from mongoengine import DoesNotExist
+from rest_framework.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND
+
+from common.const import RoleLevel
+from common.framework.permissions import PermissionFactory
+from common.framework.response import BaseResponse
+from common.framework.serializer import PageLimitSerializer
+from common.framework.view import BaseView
+
+logger = logging.getLogger(__name__)
+
+
+class AlarmRuleListView(BaseView):
+    permission_classes = (
+        PermissionFactory(
+            RoleLevel.CLIENT_SUPER_ADMIN.value,
+            RoleLevel.CLOUD_SUPER_ADMIN.value,
+            method_list=("POST",),
+        ),
+    )
+
+    def get(self, request, point_id):
+        """alarm rules of the point, the default rules are in ALARM_CONFIG"""
+        return BaseResponse(data=AlarmRuleService(point_id).get_alarm_rules())
+
+    def post(self, request, point_id):
+        """
+        create an alarm rule for the point
+        :param : {
+                    "param": "ampmax",
+                    "kind": "threshold",  # or "rate", the rise per minute
+                    "threshold": 60,
+                    "n": 3,  # optional, violated when n of the last m readings are
+                    "m": 5,  # optional
+                    "level": "warning"  # optional
+        }
+        """
+        user = request.user
+        data, context = self.get_validated_data(
+            CreateAlarmRuleSerializer, point_id=point_id
+        )
+        logger.info(f"{user.username} request create alarm rule with {data=}")
+        alarm_rule = AlarmRuleService(point_id).create_alarm_rule(
+            context["point"], data
+        )
+        return BaseResponse(data=alarm_rule.to_dict(), status_code=HTTP_201_CREATED)
+
+
+class AlarmRuleView(BaseView):
+    permission_classes = (
+        PermissionFactory(
+            RoleLevel.CLIENT_SUPER_ADMIN.value,
+            RoleLevel.CLOUD_SUPER_ADMIN.value,
+            method_list=("DELETE",),
+        ),
+    )
+
+    def delete(self, request, point_id, rule_id):
+        user = request.user
+        logger.info(f"{user.username} request delete alarm rule {rule_id=}")
+        if not AlarmRuleService(point_id).delete_alarm_rule(rule_id):
+            return BaseResponse(status_code=HTTP_404_NOT_FOUND)
+        return BaseResponse()
+
+
+class AlarmEventListView(BaseView):
+    def get(self, request, point_id):
+        """alarms raised and cleared on the point"""
+        data, _ = self.get_validated_data(PageLimitSerializer)
+        try:
+            events, total, next_token = AlarmRuleService(point_id).get_alarm_events(
+                data.get("page", 1),
+                data.get("limit", 10),
+                data.get("after"),
+                data["with_total"],
+            )
+        except DoesNotExist:
+            logger.info(f"invalid {point_id=}")
+            return BaseResponse(status_code=HTTP_404_NOT_FOUND)
+        return BaseResponse(data={"events": events, "total": total, "next": next_token})
@@ -0,0 +1,40 @@
+from cloud.models import CloudDocument
+from cloud_alarm.services.alarm_algorithm import ALARM_EVENT_COLLECTION
+from mongoengine import DateTimeField, FloatField, IntField, ObjectIdField, StringField
+
+
+class AlarmEvent(CloudDocument):
+    """
+    an alarm raised or cleared, inserted in batches by the AlarmEngine of the
+    ingestion without the fields of CloudDocument
+    """
+
+    rule_id = StringField()  # "default:<sensor_type>.<param>:<kind>" of the defaults
+    point_id = ObjectIdField()  # None for the default rules
+    client_id = StringField()
+    sensor_id = StringField()
+    sensor_type = StringField()
+    param = StringField()
+    kind = StringField()
+    threshold = FloatField()
+    n = IntField()
+    m = IntField()
+    level = StringField()
+    status = StringField()  # raised/cleared
+    value = FloatField()
+    reading_id = ObjectIdField()
+    create_time = DateTimeField()  # of the reading
+
+    meta = {
+        "indexes": [("sensor_id", "-create_time"), ("point_id", "-create_time")],
+        "index_background": True,
+        "collection": ALARM_EVENT_COLLECTION,
+    }
+
+    def __str__(self):
+        return "AlarmEvent: {} {}.{} {}".format(
+            self.sensor_id, self.sensor_type, self.param, self.status
+        )
+
+    def __repr__(self):
+        return self.__str__()
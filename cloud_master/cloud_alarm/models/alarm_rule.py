@@ -0,0 +1,41 @@
+from cloud.models import CloudDocument
+from cloud_alarm.services.alarm_algorithm import (
+    ALARM_RULE_COLLECTION,
+    MAX_WINDOW,
+    RULE_KINDS,
+)
+from mongoengine import BooleanField, FloatField, IntField, ObjectIdField, StringField
+
+
+class AlarmRule(CloudDocument):
+    """
+    rule of one point(sensor), evaluated at ingest by
+    cloud_alarm.services.alarm_algorithm.AlarmEngine
+    """
+
+    point_id = ObjectIdField(required=True)
+    sensor_id = StringField(required=True)  # sensor_number of the point
+    sensor_type = StringField(required=True)
+    param = StringField(required=True)  # such as temp, amp, ampmax
+    kind = StringField(required=True, choices=RULE_KINDS)
+    # threshold: the value is above it; rate: the value rises more per minute
+    threshold = FloatField(required=True)
+    # violated when n of the last m readings are
+    n = IntField(min_value=1, max_value=MAX_WINDOW, default=1)
+    m = IntField(min_value=1, max_value=MAX_WINDOW, default=1)
+    level = StringField(default="warning")
+    enabled = BooleanField(default=True)
+
+    meta = {
+        "indexes": ["point_id", ("sensor_id", "sensor_type")],
+        "index_background": True,
+        "collection": ALARM_RULE_COLLECTION,
+    }
+
+    def __str__(self):
+        return "AlarmRule: {}.{} {} {}".format(
+            self.sensor_type, self.param, self.kind, self.threshold
+        )
+
+    def __repr__(self):
+        return self.__str__()
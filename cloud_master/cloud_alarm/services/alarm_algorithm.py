@@ -0,0 +1,399 @@
+"""
+alarm engine of the ingestion: every reading loaded by the DataLoader is evaluated
+against the rules of its sensor in memory, and the alarm events are written into
+mongodb in batches by a background thread, so the mqtt network thread never waits
+for the database.
+a rule checks one scalar param of a sensor type, such as Temp.temp, TEV.amp,
+AE.ampmax or UHF.ampmax:
+    threshold: the value is above `threshold`
+    rate: the value rises faster than `threshold` per minute since the last reading
+and it's violated when n of the last m evaluations are(n = m = 1 by default).
+an alarm is raised on the reading which violates the rule, and cleared on the first
+reading when none of the last m evaluations violate it; only these transitions are
+events, a sensor staying in alarm doesn't write anything.
+the rules of the alarm_rule collection(see cloud_alarm.models.alarm_rule) are per
+sensor, a rule replaces the ALARM_CONFIG["default_rules"] of the same param and
+kind; they are reloaded by the background thread every `rule_refresh_interval`.
+the state of the rules is kept per process: with the client_id partitioning of the
+DataLoaders, all readings of a sensor are evaluated by one process, a share_group is
+refused while the engine is enabled(see cloud_ingest.supervisor.check_share_group).
+it doesn't depend on django, the database is given by the caller.
+"""
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from cloud_ingest.metrics import INGEST_METRICS
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+ALARM_RULE_COLLECTION = "alarm_rule"
+ALARM_EVENT_COLLECTION = "alarm_event"
+
+THRESHOLD = "threshold"
+RATE = "rate"
+RULE_KINDS = (THRESHOLD, RATE)
+# the n-of-m window is a bitmask in an int
+MAX_WINDOW = 64
+
+DUPLICATE_KEY_ERROR = 11000
+
+RAISED = "raised"
+CLEARED = "cleared"
+
+ALARM_EVENTS_TOTAL = INGEST_METRICS.counter(
+    "ingest_alarm_events_total", "alarms raised or cleared", ["level", "status"]
+)
+
+
+class Rule(object):
+    __slots__ = (
+        "rule_id",
+        "point_id",
+        "sensor_type",
+        "param",
+        "kind",
+        "threshold",
+        "n",
+        "m",
+        "level",
+    )
+
+    def __init__(
+        self,
+        rule_id: str,
+        sensor_type: str,
+        param: str,
+        kind: str,
+        threshold: float,
+        n: int = 1,
+        m: int = 1,
+        level: str = "warning",
+        point_id: Optional[ObjectId] = None,
+    ):
+        if kind not in RULE_KINDS:
+            raise ValueError(f"unknown rule {kind=}")
+        if not 1 <= n <= m <= MAX_WINDOW:
+            raise ValueError(f"invalid window {n=}, {m=}")
+        self.rule_id = rule_id
+        self.point_id = point_id
+        self.sensor_type = sensor_type
+        self.param = param
+        self.kind = kind
+        self.threshold = float(threshold)
+        self.n = n
+        self.m = m
+        self.level = level
+
+    def __repr__(self):
+        return (
+            f"Rule({self.rule_id}: {self.sensor_type}.{self.param} {self.kind} "
+            f"{self.threshold}, {self.n} of {self.m})"
+        )
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Rule":
+        """:param document: of the alarm_rule collection"""
+        return cls(
+            str(document["_id"]),
+            document["sensor_type"],
+            document["param"],
+            document["kind"],
+            document["threshold"],
+            document.get("n") or 1,
+            document.get("m") or 1,
+            document.get("level") or "warning",
+            document.get("point_id"),
+        )
+
+    @classmethod
+    def from_default(cls, config: dict) -> "Rule":
+        """:param config: one of ALARM_CONFIG["default_rules"]"""
+        rule_id = f"default:{config['sensor_type']}.{config['param']}:{config['kind']}"
+        return cls(
+            rule_id,
+            config["sensor_type"],
+            config["param"],
+            config["kind"],
+            config["threshold"],
+            config.get("n", 1),
+            config.get("m", 1),
+            config.get("level", "warning"),
+        )
+
+    def get_value(self, params: dict) -> Optional[float]:
+        value = params.get(self.sensor_type, {}).get(self.param)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        return None
+
+
+class RuleSet(object):
+    """the rules of every sensor, looked up in O(1)"""
+
+    def __init__(self, sensor_rules: Dict[tuple, List[Rule]], default_rules: list):
+        # (sensor_id, sensor_type) -> rules
+        self.sensor_rules = sensor_rules
+        # sensor_type -> rules
+        self.default_rules = {}
+        for rule in default_rules:
+            self.default_rules.setdefault(rule.sensor_type, []).append(rule)
+        # (sensor_id, sensor_type) -> own rules and the defaults not replaced
+        self.merged_rules = {}
+
+    def get_rules(self, sensor_id: str, sensor_type: str) -> List[Rule]:
+        key = (sensor_id, sensor_type)
+        if (rules := self.merged_rules.get(key)) is None:
+            own_rules = self.sensor_rules.get(key, [])
+            replaced = {(rule.param, rule.kind) for rule in own_rules}
+            rules = own_rules + [
+                rule
+                for rule in self.default_rules.get(sensor_type, [])
+                if (rule.param, rule.kind) not in replaced
+            ]
+            self.merged_rules[key] = rules
+        return rules
+
+
+def load_rule_set(database, default_rules: list) -> RuleSet:
+    """:param default_rules: ALARM_CONFIG["default_rules"]"""
+    sensor_rules = {}
+    for document in database[ALARM_RULE_COLLECTION].find({"enabled": {"$ne": False}}):
+        try:
+            rule = Rule.from_document(document)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"invalid alarm rule {document.get('_id')} with {e=}")
+            continue
+        key = (document["sensor_id"], rule.sensor_type)
+        sensor_rules.setdefault(key, []).append(rule)
+    return RuleSet(sensor_rules, [Rule.from_default(rule) for rule in default_rules])
+
+
+class RuleState(object):
+    """state of a rule for one sensor"""
+
+    __slots__ = ("bits", "count", "last_value", "last_time", "active")
+
+    def __init__(self):
+        # the last m violations, the newest in the lowest bit
+        self.bits = 0
+        self.count = 0
+        self.last_value = None
+        self.last_time = None
+        self.active = False
+
+
+def is_violated(
+    rule: Rule, state: RuleState, value: float, reading_time: datetime.datetime
+) -> Optional[bool]:
+    """
+    :return: None if the rule can't be evaluated yet, i.e. the first reading of a
+             rate rule
+    """
+    if rule.kind == THRESHOLD:
+        return value > rule.threshold
+    last_value, last_time = state.last_value, state.last_time
+    state.last_value, state.last_time = value, reading_time
+    if last_value is None:
+        return None
+    minutes = (reading_time - last_time).total_seconds() / 60
+    if minutes <= 0:
+        return None
+    return (value - last_value) / minutes > rule.threshold
+
+
+def update_state(rule: Rule, state: RuleState, violated: bool) -> Optional[str]:
+    """
+    slide the n-of-m window
+    :return: RAISED/CLEARED if the alarm changes, else None
+    """
+    dropped = (state.bits >> (rule.m - 1)) & 1
+    state.bits = ((state.bits << 1) | violated) & ((1 << rule.m) - 1)
+    state.count += violated - dropped
+    if not state.active and state.count >= rule.n:
+        state.active = True
+        return RAISED
+    if state.active and state.count == 0:
+        state.active = False
+        return CLEARED
+    return None
+
+
+class AlarmEngine(object):
+    def __init__(
+        self,
+        database,
+        default_rules: list = (),
+        rule_refresh_interval: float = 60.0,
+        flush_size: int = 200,
+        flush_interval: float = 1.0,
+        max_pending: int = 100000,
+    ):
+        """
+        :param database: pymongo database of the alarm_rule and alarm_event
+        :param max_pending: events kept while mongodb is down, the oldest are
+                            dropped beyond it
+        """
+        self.database = database
+        self.default_rules = list(default_rules)
+        self.rule_refresh_interval = rule_refresh_interval
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rule_set = RuleSet({}, [Rule.from_default(rule) for rule in default_rules])
+        # (rule_id, sensor_id) -> RuleState
+        self.states: Dict[Tuple[str, str], RuleState] = {}
+        self.max_pending = max_pending
+        self.pending = []
+        self.dropped_count = 0
+        self._pending_lock = threading.Lock()
+        self.evaluated_count = 0
+        self.event_count = 0
+        self.written_count = 0
+        self.last_refresh = 0.0
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.refresh_rules()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="alarm-engine", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        """stop the background thread after the pending events have been written"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def refresh_rules(self):
+        try:
+            rule_set = load_rule_set(self.database, self.default_rules)
+        except Exception as e:
+            logger.error(f"load alarm rules failed with {e=}, keep the old rules")
+        else:
+            # replace the whole rule set, the states of the removed rules stay
+            # until restart, they are small
+            self.rule_set = rule_set
+        self.last_refresh = time.monotonic()
+
+    def evaluate(
+        self,
+        client_id: str,
+        sensor_id: str,
+        sensor_type: str,
+        params: dict,
+        reading_id: Optional[ObjectId] = None,
+        reading_time: Optional[datetime.datetime] = None,
+    ) -> list:
+        """
+        O(rules of the sensor), no i/o
+        :param params: decoded params of the reading, such as {"Temp": {"temp": 35}}
+        :return: the events, they are written in the background
+        """
+        reading_time = reading_time or datetime.datetime.now()
+        events = []
+        for rule in self.rule_set.get_rules(sensor_id, sensor_type):
+            if (value := rule.get_value(params)) is None:
+                continue
+            key = (rule.rule_id, sensor_id)
+            if (state := self.states.get(key)) is None:
+                state = self.states[key] = RuleState()
+            violated = is_violated(rule, state, value, reading_time)
+            if violated is None:
+                continue
+            if status := update_state(rule, state, violated):
+                events.append(
+                    {
+                        "_id": ObjectId(),
+                        "rule_id": rule.rule_id,
+                        "point_id": rule.point_id,
+                        "client_id": client_id,
+                        "sensor_id": sensor_id,
+                        "sensor_type": sensor_type,
+                        "param": rule.param,
+                        "kind": rule.kind,
+                        "threshold": rule.threshold,
+                        "n": rule.n,
+                        "m": rule.m,
+                        "level": rule.level,
+                        "status": status,
+                        "value": value,
+                        "reading_id": reading_id,
+                        "create_time": reading_time,
+                    }
+                )
+                ALARM_EVENTS_TOTAL.inc(level=rule.level, status=status)
+        self.evaluated_count += 1
+        if events:
+            self.event_count += len(events)
+            with self._pending_lock:
+                self.pending.extend(events)
+                pending_count = len(self.pending)
+            if pending_count >= self.flush_size:
+                self._wakeup.set()
+        return events
+
+    def get_stats(self) -> dict:
+        return {
+            "evaluated": self.evaluated_count,
+            "events": self.event_count,
+            "written": self.written_count,
+            "pending": len(self.pending),
+            "dropped": self.dropped_count,
+            "sensor_rule_states": len(self.states),
+        }
+
+    def flush(self) -> int:
+        """:return: number of the events written, they stay pending if failed"""
+        written = 0
+        while True:
+            with self._pending_lock:
+                batch = self.pending[: self.flush_size]
+                del self.pending[: self.flush_size]
+            if not batch:
+                break
+            try:
+                self.database[ALARM_EVENT_COLLECTION].insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # written by a retried insert which failed after reaching mongodb
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                    logger.error(f"write {len(batch)} alarm events failed with {e=}")
+                    self.restore_pending(batch)
+                    break
+            except Exception as e:
+                logger.error(f"write {len(batch)} alarm events failed with {e=}")
+                self.restore_pending(batch)
+                break
+            written += len(batch)
+        self.written_count += written
+        return written
+
+    def restore_pending(self, batch: list):
+        """put the failed batch back in front, and drop the oldest beyond max_pending"""
+        with self._pending_lock:
+            self.pending[:0] = batch
+            if (overflow := len(self.pending) - self.max_pending) > 0:
+                del self.pending[:overflow]
+                self.dropped_count += overflow
+                logger.warning(f"drop {overflow} alarm events, mongodb is down")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self.last_refresh >= self.rule_refresh_interval:
+                self.refresh_rules()
+        self.flush()
@@ -0,0 +1,244 @@
+"""
+backtest of alarm rules over the stored readings: how many alarms a rule would
+have raised in a past time range, with the same semantics as the AlarmEngine.
+the readings of every point are read in time chunks of `chunk_days` with only the
+params of the rules, and every chunk is evaluated with numpy:
+    threshold/rate violations are element-wise, the n-of-m counts are a difference
+    of the cumulative sum, and the raised/cleared hysteresis is a forward fill of
+    the last decisive reading(count >= n raises, count == 0 clears);
+the state between two chunks(last value, the last m - 1 violations, in alarm or
+not) is carried over, so the result doesn't depend on the chunk size.
+the points are spread over a pool of spawned processes, each with its own
+mongodb connection:
+    cd cloud_master && python manage.py backtest_alarms --site-id <id> \\
+        --start 2021-11-01 --end 2021-12-01 --rules '[{"sensor_type": "UHF", ...}]'
+it doesn't depend on django, the points and rules are given by the caller.
+"""
+import datetime
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from cloud_alarm.services.alarm_algorithm import CLEARED, RAISED, THRESHOLD, Rule
+from common.storage.sensor_store import sensor_store
+
+logger = logging.getLogger(__name__)
+
+
+class BacktestState(object):
+    """state of a rule carried from one chunk to the next"""
+
+    def __init__(self):
+        self.last_value = None
+        self.last_second = None
+        # violations of the last m - 1 evaluated readings
+        self.tail = np.zeros(0, dtype=np.int64)
+        self.active = False
+
+
+def get_violations(
+    rule: Rule, state: BacktestState, values: np.ndarray, seconds: np.ndarray
+) -> tuple:
+    """
+    :return: (indices of the evaluated readings, their violations), the first
+             reading of a rate rule isn't evaluated, like is_violated
+    """
+    if rule.kind == THRESHOLD:
+        return np.arange(len(values)), values > rule.threshold
+    # nan for the first reading ever, it's never evaluated
+    last_value = np.nan if state.last_value is None else state.last_value
+    last_second = np.nan if state.last_second is None else state.last_second
+    previous_values = np.concatenate(([last_value], values[:-1]))
+    previous_seconds = np.concatenate(([last_second], seconds[:-1]))
+    state.last_value, state.last_second = values[-1], seconds[-1]
+    minutes = (seconds - previous_seconds) / 60
+    evaluated = np.flatnonzero(minutes > 0)
+    rates = (values[evaluated] - previous_values[evaluated]) / minutes[evaluated]
+    return evaluated, rates > rule.threshold
+
+
+def get_transitions(rule: Rule, state: BacktestState, violations: np.ndarray) -> tuple:
+    """
+    slide the n-of-m window over the chunk, like update_state
+    :return: (positions in violations where the alarm changed, new active states)
+    """
+    window = np.concatenate((state.tail, violations.astype(np.int64)))
+    cumulative = np.concatenate(([0], np.cumsum(window)))
+    # violations in the m readings ending at every reading of this chunk
+    ends = np.arange(len(state.tail), len(window)) + 1
+    counts = cumulative[ends] - cumulative[np.maximum(ends - rule.m, 0)]
+    state.tail = window[max(len(window) - (rule.m - 1), 0) :]
+    # 1: raises if not in alarm, 0: clears if in alarm, -1: keeps the state
+    decisions = np.where(counts >= rule.n, 1, np.where(counts == 0, 0, -1))
+    positions = np.arange(len(decisions))
+    last_decisive = np.maximum.accumulate(np.where(decisions >= 0, positions, -1))
+    active = np.where(
+        last_decisive >= 0, decisions[np.maximum(last_decisive, 0)] == 1, state.active
+    )
+    previous = np.concatenate(([state.active], active[:-1]))
+    changed = np.flatnonzero(active != previous)
+    if len(active):
+        state.active = bool(active[-1])
+    return changed, active[changed]
+
+
+def iter_chunks(
+    sensor_type: str,
+    sensor_id: str,
+    fields: list,
+    start_date: datetime.datetime,
+    end_date: datetime.datetime,
+    chunk_days: float,
+):
+    """:return: readings of every time chunk in [start_date, end_date)"""
+    chunk = datetime.timedelta(days=chunk_days)
+    chunk_start = start_date
+    while chunk_start < end_date:
+        chunk_end = min(chunk_start + chunk, end_date)
+        yield sensor_store.find_readings(
+            sensor_type,
+            sensor_id,
+            chunk_start,
+            chunk_end,
+            include_end=False,
+            fields=fields,
+        )
+        chunk_start = chunk_end
+
+
+def get_param_values(readings: list, rule: Rule) -> tuple:
+    """:return: (values, seconds, times) of the readings which have the param"""
+    times, values = [], []
+    for reading in readings:
+        if (value := rule.get_value(reading.get("params", {}))) is not None:
+            times.append(reading["create_time"])
+            values.append(value)
+    seconds = np.array(times, dtype="datetime64[ms]").astype(np.int64) / 1000
+    return np.array(values, dtype=np.float64), seconds, times
+
+
+def backtest_point(
+    point: dict,
+    rules: List[dict],
+    start_date: datetime.datetime,
+    end_date: datetime.datetime,
+    chunk_days: float = 1.0,
+    sample_size: int = 10,
+) -> dict:
+    """
+    :param point: {"point_id", "sensor_id", "sensor_type", ...}
+    :param rules: in the shape of ALARM_CONFIG["default_rules"], the ones of other
+                  sensor types are ignored
+    :return: {**point, "readings": int, "rules": [{"rule", "fire_count",
+              "first_fire", "last_fire", "samples": [event]}]}
+    """
+    sensor_type = point["sensor_type"]
+    point_rules = [
+        Rule.from_default(rule) for rule in rules if rule["sensor_type"] == sensor_type
+    ]
+    results = [
+        {
+            "rule": rule_config,
+            "fire_count": 0,
+            "clear_count": 0,
+            "first_fire": None,
+            "last_fire": None,
+            "samples": [],
+        }
+        for rule_config in rules
+        if rule_config["sensor_type"] == sensor_type
+    ]
+    states = [BacktestState() for _ in point_rules]
+    fields = sorted({f"params.{rule.sensor_type}.{rule.param}" for rule in point_rules})
+    reading_count = 0
+    if point_rules:
+        for readings in iter_chunks(
+            sensor_type, point["sensor_id"], fields, start_date, end_date, chunk_days
+        ):
+            reading_count += len(readings)
+            for rule, state, result in zip(point_rules, states, results):
+                values, seconds, times = get_param_values(readings, rule)
+                if not len(values):
+                    continue
+                evaluated, violations = get_violations(rule, state, values, seconds)
+                changed, active = get_transitions(rule, state, violations)
+                add_events(
+                    result, rule, evaluated[changed], active, values, times, sample_size
+                )
+    return {**point, "readings": reading_count, "rules": results}
+
+
+def add_events(
+    result: dict,
+    rule: Rule,
+    indices: np.ndarray,
+    active: np.ndarray,
+    values: np.ndarray,
+    times: list,
+    sample_size: int,
+):
+    raised = indices[active]
+    if len(raised):
+        result["fire_count"] += len(raised)
+        result["first_fire"] = result["first_fire"] or times[raised[0]]
+        result["last_fire"] = times[raised[-1]]
+    result["clear_count"] += len(indices) - len(raised)
+    room = max(sample_size - len(result["samples"]), 0)
+    for index, is_raised in zip(indices[:room].tolist(), active[:room].tolist()):
+        result["samples"].append(
+            {
+                "status": RAISED if is_raised else CLEARED,
+                "value": float(values[index]),
+                "threshold": rule.threshold,
+                "create_time": times[index],
+            }
+        )
+
+
+def run_backtest(
+    points: List[dict],
+    rules: List[dict],
+    start_date: datetime.datetime,
+    end_date: datetime.datetime,
+    workers: int = 1,
+    chunk_days: float = 1.0,
+    sample_size: int = 10,
+    point_rules: Optional[Dict[str, List[dict]]] = None,
+) -> List[dict]:
+    """
+    :param point_rules: point_id -> rules replacing `rules` for the point
+    :return: result of every point, see backtest_point, in the order of points
+    """
+    jobs = [
+        (point, (point_rules or {}).get(point["point_id"], rules)) for point in points
+    ]
+    if workers <= 1 or len(points) <= 1:
+        return [
+            backtest_point(
+                point, job_rules, start_date, end_date, chunk_days, sample_size
+            )
+            for point, job_rules in jobs
+        ]
+    results = [None] * len(points)
+    # spawned, a forked process would share the mongodb connections of the parent
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(
+                backtest_point,
+                point,
+                job_rules,
+                start_date,
+                end_date,
+                chunk_days,
+                sample_size,
+            ): index
+            for index, (point, job_rules) in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
@@ -0,0 +1,54 @@
+from typing import Optional
+
+from bson import ObjectId
+from cloud_alarm.models.alarm_event import AlarmEvent
+from cloud_alarm.models.alarm_rule import AlarmRule
+from file_management.models.measure_point import MeasurePoint
+
+from common.framework.service import BaseService
+from common.utils import paginate_objects
+
+
+class AlarmRuleService(BaseService):
+    def __init__(self, point_id: str):
+        self.point_id = point_id
+
+    def create_alarm_rule(self, point: MeasurePoint, data: dict) -> AlarmRule:
+        """the ingestion loads the rule within ALARM_CONFIG["rule_refresh_interval"]"""
+        alarm_rule = AlarmRule(
+            pk=ObjectId(),
+            point_id=point.pk,
+            sensor_id=point.sensor_number,
+            sensor_type=point.measure_type,
+            **data,
+        )
+        alarm_rule.save()
+        return alarm_rule
+
+    def get_alarm_rules(self) -> list:
+        return [rule.to_dict() for rule in AlarmRule.objects(point_id=self.point_id)]
+
+    def delete_alarm_rule(self, rule_id: str) -> int:
+        return AlarmRule.objects(point_id=self.point_id, id=rule_id).delete()
+
+    def get_alarm_events(
+        self,
+        page: int,
+        limit: int,
+        after: Optional[str] = None,
+        with_total: bool = True,
+    ) -> tuple:
+        """
+        the events of the point, the events of the default rules are found by the
+        sensor of the point
+        """
+        point = MeasurePoint.objects.only("sensor_number", "measure_type").get(
+            id=self.point_id
+        )
+        events = AlarmEvent.objects(
+            sensor_id=point.sensor_number, sensor_type=point.measure_type
+        )
+        events_by_page, total, next_token = paginate_objects(
+            events, page, limit, after, with_total
+        )
+        return [event.to_dict() for event in events_by_page], total, next_token
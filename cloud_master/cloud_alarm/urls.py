@@ -0,0 +1,24 @@
+from cloud_alarm.apis.alarm_rule_apis import (
+    AlarmEventListView,
+    AlarmRuleListView,
+    AlarmRuleView,
+)
+from django.urls import re_path
+
+urlpatterns = [
+    re_path(
+        r"^points/(?P<point_id>[a-zA-Z0-9]+)/alarm-rules/$",
+        AlarmRuleListView.as_view(),
+        name="alarm_rules_actions",
+    ),
+    re_path(
+        r"^points/(?P<point_id>[a-zA-Z0-9]+)/alarm-rules/(?P<rule_id>[a-zA-Z0-9]+)/$",
+        AlarmRuleView.as_view(),
+        name="alarm_rule_actions",
+    ),
+    re_path(
+        r"^points/(?P<point_id>[a-zA-Z0-9]+)/alarm-events/$",
+        AlarmEventListView.as_view(),
+        name="alarm_events_in_point",
+    ),
+]
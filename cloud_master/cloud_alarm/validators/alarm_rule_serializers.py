@@ -0,0 +1,34 @@
+from cloud_alarm.services.alarm_algorithm import MAX_WINDOW, RULE_KINDS
+from file_management.models.measure_point import MeasurePoint
+from mongoengine import DoesNotExist
+from rest_framework.fields import (
+    BooleanField,
+    CharField,
+    ChoiceField,
+    FloatField,
+    IntegerField,
+)
+
+from common.framework.exception import InvalidException
+from common.framework.serializer import BaseSerializer
+
+
+class CreateAlarmRuleSerializer(BaseSerializer):
+    param = CharField(required=True)
+    kind = ChoiceField(choices=RULE_KINDS, required=True)
+    threshold = FloatField(required=True)
+    n = IntegerField(required=False, min_value=1, max_value=MAX_WINDOW, default=1)
+    m = IntegerField(required=False, min_value=1, max_value=MAX_WINDOW, default=1)
+    level = CharField(required=False, default="warning")
+    enabled = BooleanField(required=False, default=True)
+
+    def validate(self, data: dict) -> dict:
+        point_id = self.context["point_id"]
+        try:
+            point = MeasurePoint.objects.get(id=point_id)
+        except DoesNotExist:
+            raise InvalidException(f"invalid {point_id=}")
+        if data["n"] > data["m"]:
+            raise InvalidException("n should not be greater than m")
+        self.context["point"] = point
+        return data
@@ -0,0 +1,199 @@
+"""
+rolling baseline of the partial discharge levels of every sensor: an exponentially
+weighted mean and variance of every configured param(such as TEV.amp, AE.ampmax,
+UHF.ampmax), updated in O(1) per reading:
+    diff = x - mean, mean += alpha * diff,
+    variance = (1 - alpha) * (variance + alpha * diff ** 2)
+every reading gets the z-score of its params against the baseline before it
+    "zscore": {"ampmax": 4.2}
+once the sensor has `warmup` readings, stored with the raw reading and the
+sensor_latest. the baseline is only updated with the readings the writer has
+accepted, score() doesn't change it, update() does. the baselines are written into
+sensor_latest every `persist_interval` by a background thread, with the normal
+range mean +- range_sigmas * std for the ui, and loaded from it at start.
+streaming quantiles(t-digest) are not kept, the mean/std range covers the ui.
+"""
+import logging
+import math
+import threading
+from typing import Dict, Optional, Tuple
+
+from cloud_ingest.metrics import INGEST_METRICS
+
+from common.storage.sensor_latest import get_sensor_baselines, update_sensor_baselines
+
+logger = logging.getLogger(__name__)
+
+ANOMALIES_TOTAL = INGEST_METRICS.counter(
+    "ingest_anomalies_total",
+    "readings with a param beyond range_sigmas of its baseline",
+    ["sensor_type"],
+)
+
+
+class Ewma(object):
+    __slots__ = ("mean", "variance", "count")
+
+    def __init__(self, mean: float = 0.0, variance: float = 0.0, count: int = 0):
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+
+    def get_zscore(self, value: float, warmup: int) -> Optional[float]:
+        """:return: None while warming up"""
+        if self.count >= warmup and self.variance > 0:
+            return (value - self.mean) / math.sqrt(self.variance)
+        return None
+
+    def update(self, value: float, alpha: float, warmup: int) -> Optional[float]:
+        """:return: z-score of value before the update, None while warming up"""
+        zscore = self.get_zscore(value, warmup)
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            self.mean += alpha * diff
+            self.variance = (1 - alpha) * (self.variance + alpha * diff * diff)
+        self.count += 1
+        return zscore
+
+
+class BaselineTracker(object):
+    def __init__(
+        self,
+        params: Dict[str, list],
+        alpha: float = 0.01,
+        warmup: int = 30,
+        range_sigmas: float = 3.0,
+        persist_interval: float = 60.0,
+    ):
+        """
+        :param params: sensor_type -> params with a baseline
+        :param alpha: weight of a new reading, about the last 1 / alpha readings count
+        :param warmup: readings before the z-scores are given
+        """
+        self.params = params
+        self.alpha = alpha
+        self.warmup = warmup
+        self.range_sigmas = range_sigmas
+        self.persist_interval = persist_interval
+        # (sensor_id, sensor_type) -> {param: Ewma}
+        self.baselines: Dict[Tuple[str, str], Dict[str, Ewma]] = {}
+        self.dirty = set()
+        self.anomaly_count = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.load()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="baseline-tracker", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        """stop the background thread after the baselines have been written"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def load(self):
+        try:
+            stored = get_sensor_baselines(list(self.params))
+        except Exception as e:
+            logger.error(f"load sensor baselines failed with {e=}, start from scratch")
+            return
+        with self._lock:
+            for key, baseline in stored.items():
+                self.baselines[key] = {
+                    param: Ewma(state["mean"], state["std"] ** 2, state["count"])
+                    for param, state in baseline.items()
+                    if param in self.params.get(key[1], ())
+                }
+
+    def iter_values(self, sensor_type: str, params: dict):
+        """:return: (name, value) of the numeric params with a baseline"""
+        values = params.get(sensor_type, {})
+        for name in self.params.get(sensor_type, ()):
+            value = values.get(name)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, value
+
+    def score(self, sensor_id: str, sensor_type: str, params: dict) -> dict:
+        """
+        the baselines are not changed, see update
+        :param params: decoded params of the reading
+        :return: {param: z-score} of the warmed up params
+        """
+        zscores = {}
+        with self._lock:
+            baseline = self.baselines.get((sensor_id, sensor_type), {})
+            for name, value in self.iter_values(sensor_type, params):
+                if (ewma := baseline.get(name)) is None:
+                    continue
+                if (zscore := ewma.get_zscore(value, self.warmup)) is not None:
+                    zscores[name] = round(zscore, 3)
+        return zscores
+
+    def update(self, sensor_id: str, sensor_type: str, params: dict):
+        """update the baselines of the sensor with a stored reading, O(params)"""
+        if sensor_type not in self.params:
+            return
+        key = (sensor_id, sensor_type)
+        anomaly = False
+        with self._lock:
+            if (baseline := self.baselines.get(key)) is None:
+                baseline = self.baselines[key] = {}
+            for name, value in self.iter_values(sensor_type, params):
+                if (ewma := baseline.get(name)) is None:
+                    ewma = baseline[name] = Ewma()
+                zscore = ewma.update(value, self.alpha, self.warmup)
+                if zscore is not None and abs(zscore) > self.range_sigmas:
+                    anomaly = True
+            self.dirty.add(key)
+        if anomaly:
+            self.anomaly_count += 1
+            ANOMALIES_TOTAL.inc(sensor_type=sensor_type)
+
+    def get_baseline(self, ewma: Ewma) -> dict:
+        std = math.sqrt(ewma.variance)
+        return {
+            "mean": ewma.mean,
+            "std": std,
+            "count": ewma.count,
+            "low": ewma.mean - self.range_sigmas * std,
+            "high": ewma.mean + self.range_sigmas * std,
+        }
+
+    def get_stats(self) -> dict:
+        return {"sensors": len(self.baselines), "anomalies": self.anomaly_count}
+
+    def persist(self) -> int:
+        """:return: number of the sensors written, they stay dirty if failed"""
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            baselines = {
+                key: {
+                    param: self.get_baseline(ewma)
+                    for param, ewma in self.baselines[key].items()
+                }
+                for key in dirty
+            }
+        try:
+            update_sensor_baselines(baselines)
+        except Exception as e:
+            logger.error(f"write {len(baselines)} sensor baselines failed with {e=}")
+            with self._lock:
+                self.dirty |= dirty
+            return 0
+        return len(baselines)
+
+    def _run(self):
+        while not self._stop_event.wait(self.persist_interval):
+            self.persist()
+        self.persist()
@@ -0,0 +1,388 @@
+"""
+benchmark of the ingestion: synthetic AE/TEV, UHF and Temp messages of
+N gateways x M sensors are given to DataLoader.on_message as paho MQTTMessages
+at a target rate, and written by the configured writer into an in-process fake
+mongodb or a local mongod:
+    cd cloud_master && python -m cloud_ingest.benchmark --gateways 20 --sensors 10 \\
+        --rate 2000 --duration 30 [--mongo-uri mongodb://127.0.0.1:27017/] [--spool]
+it reports the sustained messages/s, p50/p99 latency of on_message and of the batch
+writes, and the cpu time per message, and writes them into a json file under
+--output-dir so the runs can be compared.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import bson
+import numpy as np
+import pymongo
+from cloud.settings import BASE_DIR, DATA_LOADER_CONFIG
+from cloud_ingest.buffered_writer import create_buffered_writer
+from paho.mqtt.client import MQTTMessage
+from subscribe_message import DataLoader
+
+from common.storage import sensor_latest, sensor_rollup, sensor_store
+
+logger = logging.getLogger(__name__)
+
+SENSOR_KINDS = ("AE_TEV", "UHF", "Temp")
+PRPS_CYCLES, PRPS_PHASES = 50, 64
+# replaced by the acquisition time of every message, see build_message
+ACQTIME_PLACEHOLDER = "@acqtime@"
+BENCHMARK_EPOCH = 1609459200
+
+
+class FakeCollection(object):
+    """
+    accepts the writes of the ingestion and keeps only counters, the documents are
+    still encoded to BSON like the driver does, `latency` simulates the round-trip
+    """
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.document_count = 0
+        self.request_count = 0
+
+    def round_trip(self, documents: list):
+        for document in documents:
+            bson.encode(document)
+        self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        self.round_trip(documents)
+        self.document_count += len(documents)
+
+    def insert_one(self, document: dict):
+        self.insert_many([document])
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        self.round_trip([getattr(request, "_doc", {}) for request in requests])
+        self.document_count += len(requests)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.round_trip([update])
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False):
+        self.round_trip([update])
+
+    def create_index(self, keys, **kwargs) -> str:
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def find_one(self, *args, **kwargs):
+        return None
+
+    def find(self, *args, **kwargs) -> list:
+        return []
+
+
+class FakeDatabase(object):
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.latency)
+        return self.collections[name]
+
+
+@contextmanager
+def use_database(database):
+    """point the sensor storage modules to the given pymongo or fake database"""
+    saved = (
+        sensor_store.MONGO_CLIENT,
+        sensor_rollup.MONGO_CLIENT,
+        sensor_latest.sensor_latest_col,
+    )
+    sensor_store.MONGO_CLIENT = sensor_rollup.MONGO_CLIENT = database
+    sensor_latest.sensor_latest_col = database[sensor_latest.SENSOR_LATEST_COLLECTION]
+    try:
+        yield database
+    finally:
+        (
+            sensor_store.MONGO_CLIENT,
+            sensor_rollup.MONGO_CLIENT,
+            sensor_latest.sensor_latest_col,
+        ) = saved
+
+
+def build_params(kind: str, rng: random.Random) -> dict:
+    """params in the shape the gateways send"""
+    if kind == "Temp":
+        return {
+            "Temp": {
+                "temp": round(rng.gauss(35, 5), 2),
+                "acqtime": ACQTIME_PLACEHOLDER,
+            }
+        }
+    if kind == "AE_TEV":
+        return {
+            "AE": {
+                "ampmax": round(rng.uniform(0, 40), 2),
+                "ampmean": round(rng.uniform(0, 20), 2),
+                "freq50": round(rng.uniform(0, 5), 2),
+                "freq100": round(rng.uniform(0, 5), 2),
+                "acqtime": ACQTIME_PLACEHOLDER,
+            },
+            "TEV": {
+                "amp": round(rng.uniform(0, 60), 2),
+                "acqtime": ACQTIME_PLACEHOLDER,
+            },
+        }
+    # phase resolved pulse sequence, amplitudes of PRPS_CYCLES x PRPS_PHASES windows
+    prps = [
+        [rng.randint(0, 80) if rng.random() < 0.1 else 0 for _ in range(PRPS_PHASES)]
+        for _ in range(PRPS_CYCLES)
+    ]
+    amplitudes = [amp for cycle in prps for amp in cycle]
+    return {
+        "UHF": {
+            "ampmax": max(amplitudes),
+            "ampmean": round(sum(amplitudes) / len(amplitudes), 2),
+            "prps": prps,
+            "acqtime": ACQTIME_PLACEHOLDER,
+        }
+    }
+
+
+def build_templates(gateways: int, sensors: int, seed: int = 0) -> list:
+    """
+    one message template per sensor, the sensor kinds are mixed evenly
+    :return: [(topic, payload without the message id)], see build_message
+    """
+    rng = random.Random(seed)
+    templates = []
+    for gateway_index in range(gateways):
+        client_id = f"BENCHGW{gateway_index:04d}"
+        for sensor_index in range(sensors):
+            sensor_id = f"BENCHS{gateway_index:04d}{sensor_index:04d}"
+            kind = SENSOR_KINDS[sensor_index % len(SENSOR_KINDS)]
+            payload = json.dumps({"version": "1.0", "params": build_params(kind, rng)})
+            templates.append(
+                (
+                    f"/{client_id}/subnode/{sensor_id}/data_ctrl/property".encode(),
+                    payload[1:].encode("utf-8"),
+                )
+            )
+    return templates
+
+
+def build_message(template: tuple, msg_id: int) -> MQTTMessage:
+    """
+    every message has its own acquisition time, the ingestion drops the repeated
+    ones; the id is repeated like the gateways do
+    """
+    topic, payload = template
+    acqtime = datetime.datetime.fromtimestamp(BENCHMARK_EPOCH + msg_id)
+    message = MQTTMessage(topic=topic)
+    message.payload = b'{"id": "123", ' + payload.replace(
+        ACQTIME_PLACEHOLDER.encode(), acqtime.strftime("%Y-%m-%d %H:%M:%S").encode()
+    )
+    return message
+
+
+def get_percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {
+        "p50": round(float(p50), 6),
+        "p99": round(float(p99), 6),
+        "max": round(float(max(values)), 6),
+    }
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_benchmark(
+    gateways: int,
+    sensors: int,
+    rate: float,
+    duration: float,
+    spool_directory: str = "",
+    duplicate_ratio: float = 0.0,
+    drain_timeout: float = 60.0,
+) -> dict:
+    """
+    drive DataLoader.on_message for `duration` seconds, then wait for the writer
+    to write all buffered readings
+    :param rate: target messages/s, 0 for as fast as possible
+    :param duplicate_ratio: part of the messages sent again, like redeliveries
+    """
+    templates = build_templates(gateways, sensors)
+    rng = random.Random(1)
+    config = dict(DATA_LOADER_CONFIG)
+    config["spool"] = {**config.get("spool", {}), "directory": spool_directory}
+    writer = create_buffered_writer(config, "benchmark")
+    data_loader = DataLoader("benchmark", "", 0, metrics_port=0, buffered_writer=writer)
+    # the live reading streams need redis and the gateways
+    writer.written_listeners.clear()
+    alarm_engine = data_loader.alarm_engine
+    if alarm_engine is not None:
+        # the database given to use_database
+        alarm_engine.database = sensor_store.MONGO_CLIENT
+    # every gateway is enabled, without redis
+    data_loader.client_id_cache = {f"BENCHGW{index:04d}" for index in range(gateways)}
+
+    write_latencies = []
+    write = writer.write
+
+    def timed_write(sensor_type: str, docs: list) -> list:
+        start = time.perf_counter()
+        written = write(sensor_type, docs)
+        write_latencies.append(time.perf_counter() - start)
+        return written
+
+    writer.write = timed_write
+    writer.start()
+    if alarm_engine is not None:
+        alarm_engine.start()
+
+    message_latencies = []
+    sent = 0
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        while (now := time.perf_counter()) - start < duration:
+            if rate and sent >= (now - start) * rate:
+                time.sleep(min(1 / rate, 0.01))
+                continue
+            if sent and rng.random() < duplicate_ratio:
+                msg_id = rng.randrange(max(sent - len(templates), 0), sent)
+            else:
+                msg_id = sent
+            message = build_message(templates[msg_id % len(templates)], msg_id)
+            message_start = time.perf_counter()
+            data_loader.on_message(None, None, message)
+            message_latencies.append(time.perf_counter() - message_start)
+            sent += 1
+        send_elapsed = time.perf_counter() - start
+        deadline = time.monotonic() + drain_timeout
+        while (
+            writer.written_count + writer.duplicate_count < data_loader.loaded_count
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.01)
+        drain_elapsed = time.perf_counter() - start
+    finally:
+        writer.stop()
+        if alarm_engine is not None:
+            alarm_engine.stop()
+    cpu_seconds = time.process_time() - cpu_start
+    return {
+        "messages": sent,
+        "readings_loaded": data_loader.loaded_count,
+        "readings_written": writer.written_count,
+        "duplicates_dropped": data_loader.duplicate_count + writer.duplicate_count,
+        "send_seconds": round(send_elapsed, 3),
+        "drain_seconds": round(drain_elapsed, 3),
+        "offered_msgs_per_second": round(sent / send_elapsed, 1),
+        # until the last reading was written
+        "sustained_msgs_per_second": round(sent / drain_elapsed, 1),
+        "on_message_seconds": get_percentiles(message_latencies),
+        "write_batches": len(write_latencies),
+        "write_seconds": get_percentiles(write_latencies),
+        "cpu_microseconds_per_message": round(cpu_seconds / max(sent, 1) * 1e6, 1),
+        "writer_stats": writer.get_stats(),
+        "alarm_stats": alarm_engine.get_stats() if alarm_engine is not None else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the sensor data ingestion")
+    parser.add_argument("--gateways", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=10, help="per gateway")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="messages/s, 0 for as fast as possible"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="second")
+    parser.add_argument(
+        "--mongo-uri", default="", help="write into a local mongod instead of a fake"
+    )
+    parser.add_argument("--mongo-db", default="ingest_benchmark")
+    parser.add_argument(
+        "--fake-latency-ms",
+        type=float,
+        default=0.0,
+        help="round-trip time of every write of the fake mongodb",
+    )
+    parser.add_argument(
+        "--spool", action="store_true", help="write through a spool in a temp dir"
+    )
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.0,
+        help="part of the messages sent again, like the redeliveries of the broker",
+    )
+    parser.add_argument(
+        "--output-dir", default=os.path.join(BASE_DIR, "benchmark_results")
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.mongo_uri:
+        client = pymongo.MongoClient(args.mongo_uri)
+        client.drop_database(args.mongo_db)
+        database = client[args.mongo_db]
+    else:
+        database = FakeDatabase(args.fake_latency_ms / 1000)
+    with use_database(database), tempfile.TemporaryDirectory() as spool_directory:
+        results = run_benchmark(
+            args.gateways,
+            args.sensors,
+            args.rate,
+            args.duration,
+            spool_directory if args.spool else "",
+            args.duplicate_ratio,
+        )
+    report = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "config": {
+            **vars(args),
+            "mongo": "mongod" if args.mongo_uri else "fake",
+            "data_loader": {
+                key: value
+                for key, value in DATA_LOADER_CONFIG.items()
+                if key != "spool"
+            },
+        },
+        "results": results,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(
+        args.output_dir, f"ingest-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(json.dumps(results, indent=2, default=str))
+    print(f"results are written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+from cloud.settings import SENSOR_ROLLUP_CONFIG
+from cloud_ingest.metrics import INGEST_METRICS
+from cloud_ingest.spool import Spool
+
+from common.storage.sensor_latest import (
+    ensure_sensor_latest_indexes,
+    upsert_sensor_latest,
+)
+from common.storage.sensor_rollup import rebuild_rollups, upsert_rollups
+from common.storage.sensor_store import sensor_store
+
+logger = logging.getLogger(__name__)
+
+WRITE_SECONDS = INGEST_METRICS.histogram(
+    "ingest_write_seconds", "mongodb write of a batch of readings", ["sensor_type"]
+)
+# the payloads carry no send time of the gateway, the lag starts at the receipt
+READING_LAG_SECONDS = INGEST_METRICS.histogram(
+    "ingest_reading_lag_seconds", "from a reading received to it written"
+)
+WRITE_FAILED_TOTAL = INGEST_METRICS.counter(
+    "ingest_write_failed_total",
+    "readings lost with a failed batch, without a spool to retry them",
+    ["sensor_type"],
+)
+
+
+class BufferedWriter(object):
+    """
+    buffer sensor readings in memory and write them into mongodb in batches.
+    readings are put into a queue by the mqtt network thread, and a flusher thread
+    groups them by sensor collection and writes them when the buffer reaches
+    `flush_size` readings or the oldest buffered reading is `flush_interval` seconds old.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 100000,
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped_count = 0
+        self.failed_count = 0
+        self.written_count = 0
+        self.duplicate_count = 0
+        self.last_flush = {"size": 0, "latency": 0.0}
+        # called with (sensor_type, written readings) after every successful write
+        self.written_listeners = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        # the unique reading_key index suppresses the redelivered readings
+        sensor_store.ensure_indexes()
+        ensure_sensor_latest_indexes()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="buffered-writer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        """stop the flusher thread after the buffered readings have been written"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def put(self, sensor_type: str, data: dict) -> bool:
+        """never blocks, the reading is dropped if the queue is full"""
+        try:
+            self.queue.put_nowait((sensor_type, data))
+        except queue.Full:
+            self.dropped_count += 1
+            # the caller logs it sampled, and counts it in the metrics
+            logger.debug(
+                f"buffered writer queue is full, drop reading of {sensor_type=}, "
+                f"sensor_id={data.get('sensor_id')}, dropped: {self.dropped_count}"
+            )
+            return False
+        return True
+
+    def add_written_listener(self, listener: Callable[[str, list], None]):
+        self.written_listeners.append(listener)
+
+    def notify_written(self, sensor_type: str, docs: list):
+        """a failed listener doesn't fail the write, the readings are in mongodb"""
+        for listener in self.written_listeners:
+            try:
+                listener(sensor_type, docs)
+            except Exception as e:
+                logger.exception(f"written listener {listener} failed with {e=}")
+
+    def get_stats(self) -> dict:
+        return {
+            "dropped": self.dropped_count,
+            "failed": self.failed_count,
+            "written": self.written_count,
+            "duplicates": self.duplicate_count,
+            "queue_size": self.queue.qsize(),
+        }
+
+    def _run(self):
+        batch, deadline = [], None
+        while not (self._stop_event.is_set() and self.queue.empty() and not batch):
+            timeout = (
+                self.flush_interval
+                if deadline is None
+                else max(deadline - time.monotonic(), 0)
+            )
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if batch and (
+                len(batch) >= self.flush_size
+                or time.monotonic() >= deadline
+                or self._stop_event.is_set()
+            ):
+                # logged by flush, there is no spool to retry them
+                for sensor_type, _ in self.flush(batch):
+                    self.failed_count += 1
+                    WRITE_FAILED_TOTAL.inc(sensor_type=sensor_type)
+                batch, deadline = [], None
+
+    def flush(self, batch: list) -> list:
+        """:return: the (sensor_type, data) failed to write"""
+        start = time.perf_counter()
+        grouped = defaultdict(list)
+        for sensor_type, data in batch:
+            grouped[sensor_type].append(data)
+        failed = []
+        for sensor_type, docs in grouped.items():
+            try:
+                with WRITE_SECONDS.time(sensor_type=sensor_type):
+                    written = self.write(sensor_type, docs)
+                self.written_count += len(written)
+                self.duplicate_count += len(docs) - len(written)
+                self.observe_lag(written)
+            except Exception as e:
+                logger.exception(
+                    f"flush {len(docs)} readings failed for {sensor_type=} with {e=}"
+                )
+                failed.extend((sensor_type, data) for data in docs)
+                continue
+            if written:
+                self.notify_written(sensor_type, written)
+        latency = time.perf_counter() - start
+        self.last_flush = {"size": len(batch), "latency": latency}
+        counts = {sensor_type: len(docs) for sensor_type, docs in grouped.items()}
+        logger.debug(
+            f"flushed {len(batch)} readings in {latency * 1000:.1f}ms, {counts=}"
+        )
+        return failed
+
+    @staticmethod
+    def observe_lag(docs: list):
+        now = datetime.datetime.now()
+        for data in docs:
+            if create_time := data.get("create_time"):
+                READING_LAG_SECONDS.observe((now - create_time).total_seconds())
+
+    @staticmethod
+    def write(sensor_type: str, docs: list) -> list:
+        """
+        write the readings with the configured storage engine, then upsert the newest
+        reading of every sensor in this batch into the sensor_latest store,
+        and add the readings to the rollups.
+        the sensor_latest is upserted from the whole batch: a batch retried after the
+        readings were inserted has only duplicates, and the upsert never replaces a
+        newer latest reading, so it's safe to repeat.
+        the rollups are added from the new readings, unless some of the batch were
+        written before: it's a retry whose rollups may be partly added, or a
+        redelivery, then their periods are rebuilt from the stored readings.
+        :return: the readings written, without the duplicates
+        """
+        written = sensor_store.write(sensor_type, docs)
+        upsert_sensor_latest(docs)
+        if SENSOR_ROLLUP_CONFIG.get("enabled"):
+            if len(written) == len(docs):
+                upsert_rollups(sensor_type, written)
+            else:
+                rebuild_rollups(sensor_type, docs)
+        return written
+
+
+class SpooledWriter(BufferedWriter):
+    """
+    the readings are appended to a Spool on local disk before they are written.
+    the flusher thread reads them back in order and moves the spool checkpoint only
+    after the batch is written, a failed batch is retried until mongodb recovers,
+    and the readings left in the spool are replayed after a restart.
+    when the spool is full, put() blocks the mqtt network thread as backpressure.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        retry_interval: float = 5.0,
+        **kwargs,
+    ):
+        super().__init__(flush_size, flush_interval, **kwargs)
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.retry_count = 0
+        # create_time of the oldest reading not written yet
+        self.oldest_pending = None
+
+    def stop(self, timeout: float = 10):
+        """the readings not written yet stay in the spool"""
+        super().stop(timeout)
+        self.spool.close()
+
+    def put(self, sensor_type: str, data: dict) -> bool:
+        try:
+            if self.spool.append([{"sensor_type": sensor_type, "data": data}]):
+                return True
+        except Exception as e:
+            logger.exception(f"append reading of {sensor_type=} to spool failed: {e=}")
+        self.dropped_count += 1
+        return False
+
+    def get_stats(self) -> dict:
+        lag_seconds = 0.0
+        if self.oldest_pending is not None:
+            lag_seconds = (datetime.datetime.now() - self.oldest_pending).total_seconds()
+        return {
+            "dropped": self.dropped_count,
+            "written": self.written_count,
+            "duplicates": self.duplicate_count,
+            "retries": self.retry_count,
+            "spool_lag_seconds": round(lag_seconds, 3),
+            **self.spool.get_stats(),
+        }
+
+    def read_batch(self) -> tuple:
+        records, position = self.spool.read(self.flush_size)
+        if len(records) < self.flush_size and not self._stop_event.is_set():
+            # wait a while for a full batch
+            self._stop_event.wait(self.flush_interval)
+            records, position = self.spool.read(self.flush_size)
+        batch = [(record["sensor_type"], record["data"]) for record in records]
+        return batch, position
+
+    def _run(self):
+        batch, position = [], None
+        while True:
+            if not batch:
+                batch, position = self.read_batch()
+                if not batch:
+                    self.oldest_pending = None
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                self.oldest_pending = batch[0][1].get("create_time")
+            # only the readings failed to write are retried
+            batch = self.flush(batch)
+            if batch:
+                if self._stop_event.is_set():
+                    logger.warning(f"{len(batch)} failed readings stay in the spool")
+                    break
+                self.retry_count += 1
+                self._stop_event.wait(self.retry_interval)
+                continue
+            self.spool.commit(position)
+            if self._stop_event.is_set():
+                # the rest stay in the spool for the next start
+                break
+
+
+def create_buffered_writer(config: dict, name: str = "") -> BufferedWriter:
+    """
+    :param config: DATA_LOADER_CONFIG
+    :param name: sub directory of the spool, every process needs its own
+    """
+    config = dict(config)
+    spool_config: Optional[dict] = config.pop("spool", None)
+    if not spool_config or not spool_config.get("directory"):
+        return BufferedWriter(**config)
+    spool_config = dict(spool_config)
+    directory = os.path.join(spool_config.pop("directory"), name)
+    return SpooledWriter(Spool(directory, **spool_config), **config)
@@ -0,0 +1,68 @@
+"""
+duplicate suppression of the readings redelivered by the broker(QoS 1 after
+reconnects, or to another worker of a shared subscription):
+every reading with a device stamp gets a deterministic `reading_key`, the
+DataLoader drops the keys seen recently in memory, and the unique index on
+reading_key of the raw sensor collections(the reading_keys of the buckets) rejects
+the rest, which the writer tolerates.
+the stamp is the acquisition time of the reading the gateway sends in its params:
+    {"id": "123", "version": "1.0", "params": {"TEV": {"amp": 0.8, "acqtime": "xx"}}}
+the message id is not a stamp, the gateways reuse it(the mqtt_publish of this repo
+always sent "123"), neither is the payload, a sensor sends the same values again.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+# param of the acquisition time of the reading in params.<sensor_type>
+DEVICE_STAMP_PARAM = "acqtime"
+
+
+def get_reading_key(
+    client_id: str, sensor_id: str, sensor_type: str, msg_dict: dict
+) -> Optional[str]:
+    """
+    built from the acquisition time of the reading, the AE and TEV readings of one
+    message have their own
+
+    >>> message = {"id": "123", "params": {"TEV": {"amp": 0.8, "acqtime": "t1"}}}
+    >>> key = get_reading_key("GW", "S1", "TEV", message)
+    >>> key == get_reading_key("GW", "S1", "TEV", message)
+    True
+    >>> message["params"]["TEV"]["acqtime"] = "t2"
+    >>> key == get_reading_key("GW", "S1", "TEV", message)
+    False
+
+    :return: None if the message has none, then it isn't deduplicated
+    """
+    values = msg_dict.get("params", {}).get(sensor_type)
+    if not isinstance(values, dict) or values.get(DEVICE_STAMP_PARAM) in (None, ""):
+        return None
+    stamp = values[DEVICE_STAMP_PARAM]
+    key = f"{client_id}/{sensor_id}/{sensor_type}/{stamp}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class RecentKeys(object):
+    """LRU set of the last `max_size` reading keys"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.keys = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        """True if key was added recently"""
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: str):
+        """add the key of a reading accepted by the writer"""
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
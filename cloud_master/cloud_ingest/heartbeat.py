@@ -0,0 +1,220 @@
+"""
+offline detection of the sensors: every reading re-arms the timer of its sensor in
+a TimerWheel, due after `missed_uploads` times the upload_interval of its
+SensorConfig, and a sensor whose timer goes off is offline; the next reading brings
+it back online. the transitions are written into the sensor_status_event collection
+in batches, and the deadlines into the per-site sorted sets of
+common.storage.sensor_online, both by the background thread of the tracker, so
+seen() is O(1) without i/o.
+the state is per process like the alarm engine: a sensor's first reading after a
+start doesn't emit an event, its state before is unknown.
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from bson import ObjectId
+from cloud_ingest.metrics import INGEST_METRICS
+from cloud_ingest.timer_wheel import TimerWheel
+from redis import Redis, RedisError
+
+from common.storage.reading_stream import GatewaySiteMap
+from common.storage.sensor_online import get_sensor_member, update_online_deadlines
+
+logger = logging.getLogger(__name__)
+
+# collection of equipment_management.models.sensor_config.SensorConfig
+SENSOR_CONFIG_COLLECTION = "sensor_config"
+SENSOR_STATUS_EVENT_COLLECTION = "sensor_status_event"
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+SENSOR_STATUS_TOTAL = INGEST_METRICS.counter(
+    "ingest_sensor_status_total", "sensors gone online or offline", ["status"]
+)
+
+
+class UploadIntervals(object):
+    """(client_number, sensor_number) -> upload_interval of the SensorConfig"""
+
+    def __init__(self, database, default_interval: float):
+        self.database = database
+        self.default_interval = default_interval
+        self.intervals = {}
+
+    def refresh(self):
+        intervals = {}
+        for config in self.database[SENSOR_CONFIG_COLLECTION].find(
+            {"upload_interval": {"$gt": 0}},
+            {"client_number": 1, "sensor_number": 1, "upload_interval": 1},
+        ):
+            key = (config.get("client_number"), config.get("sensor_number"))
+            # the AE and TEV configs of one sensor, the shorter one
+            intervals[key] = min(
+                config["upload_interval"], intervals.get(key, float("inf"))
+            )
+        self.intervals = intervals
+
+    def get(self, client_id: str, sensor_id: str) -> float:
+        return self.intervals.get((client_id, sensor_id), self.default_interval)
+
+
+class HeartbeatTracker(object):
+    def __init__(
+        self,
+        redis_cli: Redis,
+        database,
+        missed_uploads: float = 3,
+        default_upload_interval: float = 600,
+        refresh_interval: float = 300,
+        tick_interval: float = 1.0,
+        online_retention: float = 7 * 24 * 3600,
+    ):
+        """
+        :param missed_uploads: a sensor is offline after so many upload intervals
+                               without a reading
+        :param default_upload_interval: second, of the sensors without SensorConfig
+        :param refresh_interval: second, reload the upload intervals and the sites
+        :param online_retention: second, an offline sensor stays so long in the
+                                 online sorted set of its site
+        """
+        self.redis_cli = redis_cli
+        self.database = database
+        self.missed_uploads = missed_uploads
+        self.refresh_interval = refresh_interval
+        self.tick_interval = tick_interval
+        self.online_retention = online_retention
+        self.upload_intervals = UploadIntervals(database, default_upload_interval)
+        self.site_map = GatewaySiteMap(database, refresh_interval)
+        self.wheel = TimerWheel(int(time.time()))
+        # (client_id, sensor_id) -> epoch second of the last reading
+        self.last_seen: Dict[Tuple[str, str], float] = {}
+        self.offline = set()
+        # changed since the last flush
+        self.deadlines: Dict[Tuple[str, str], float] = {}
+        self.events = []
+        self.online_count = 0
+        self.offline_count = 0
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="heartbeat-tracker", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def refresh(self):
+        try:
+            self.upload_intervals.refresh()
+        except Exception as e:
+            logger.error(f"load upload intervals failed with {e=}, keep the old ones")
+        self.last_refresh = time.monotonic()
+
+    def seen(self, client_id: str, sensor_id: str, now: Optional[float] = None):
+        """a reading of the sensor is received, O(1)"""
+        now = now or time.time()
+        key = (client_id, sensor_id)
+        deadline = (
+            now + self.upload_intervals.get(client_id, sensor_id) * self.missed_uploads
+        )
+        with self._lock:
+            self.last_seen[key] = now
+            self.deadlines[key] = deadline
+            self.wheel.schedule(key, int(deadline) + 1)
+            if key in self.offline:
+                self.offline.discard(key)
+                self.add_event(key, ONLINE, now)
+
+    def add_event(self, key: tuple, status: str, now: float):
+        client_id, sensor_id = key
+        self.events.append(
+            {
+                "_id": ObjectId(),
+                "client_id": client_id,
+                "sensor_id": sensor_id,
+                "status": status,
+                "last_seen": self.last_seen.get(key),
+                "upload_interval": self.upload_intervals.get(client_id, sensor_id),
+                "create_time": now,
+            }
+        )
+        SENSOR_STATUS_TOTAL.inc(status=status)
+        if status == ONLINE:
+            self.online_count += 1
+        else:
+            self.offline_count += 1
+
+    def tick(self, now: Optional[float] = None) -> list:
+        """:return: the sensors gone offline"""
+        now = now or time.time()
+        with self._lock:
+            expired = self.wheel.advance(int(now))
+            for key in expired:
+                self.offline.add(key)
+                self.add_event(key, OFFLINE, now)
+        return expired
+
+    def get_stats(self) -> dict:
+        return {
+            "tracked": len(self.last_seen),
+            "offline": len(self.offline),
+            "went_online": self.online_count,
+            "went_offline": self.offline_count,
+        }
+
+    def flush(self):
+        """write the events and the online deadlines, kept for the next flush if failed"""
+        with self._lock:
+            events, self.events = self.events, []
+            deadlines, self.deadlines = self.deadlines, {}
+        if events:
+            for event in events:
+                event["site_id"] = self.site_map.get(event["client_id"])
+                for field in ("last_seen", "create_time"):
+                    if isinstance(event[field], float):
+                        event[field] = datetime.datetime.fromtimestamp(event[field])
+            try:
+                self.database[SENSOR_STATUS_EVENT_COLLECTION].insert_many(
+                    events, ordered=False
+                )
+            except Exception as e:
+                logger.error(f"write {len(events)} sensor status events failed: {e=}")
+                with self._lock:
+                    self.events[:0] = events
+        if deadlines:
+            by_site = defaultdict(dict)
+            for (client_id, sensor_id), deadline in deadlines.items():
+                if (site_id := self.site_map.get(client_id)) is not None:
+                    by_site[site_id][get_sensor_member(client_id, sensor_id)] = deadline
+            try:
+                update_online_deadlines(self.redis_cli, by_site, self.online_retention)
+            except RedisError as e:
+                logger.error(f"update online sensors failed with {e=}")
+                with self._lock:
+                    # the newer deadlines seen meanwhile win
+                    self.deadlines = {**deadlines, **self.deadlines}
+
+    def _run(self):
+        while not self._stop_event.wait(self.tick_interval):
+            self.tick()
+            self.flush()
+            if time.monotonic() - self.last_refresh >= self.refresh_interval:
+                self.refresh()
+        self.flush()
@@ -0,0 +1,256 @@
+"""
+in-process metrics of the ingestion, exposed in the prometheus text format:
+    curl http://127.0.0.1:9464/metrics
+the metrics are created once at module level, like prometheus_client:
+    MESSAGES_TOTAL = INGEST_METRICS.counter("name", "help", ["label"])
+    MESSAGES_TOTAL.inc(label="value")
+    with PARSE_SECONDS.time(): ...
+collectors registered with register_collector() give gauges read at scrape time,
+such as the queue depth of the buffered writer.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(label_names: Iterable[str], label_values: Iterable) -> str:
+    labels = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: List[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def get_label_values(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} needs labels {self.label_names}, {labels=}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """:return: [(name suffix, formatted labels, value)]"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_label_values(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.get_label_values(labels), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = list(self.values.items())
+        return [
+            ("", format_labels(self.label_names, key), value) for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self.get_label_values(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count of every bucket(not cumulative) and +Inf, sum]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = self.get_label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = self.values[key][0]
+            counts[index] += 1
+            self.values[key][1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self.values.items()
+            ]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names + ("le",), key + (format_value(upper_bound),)
+                )
+                samples.append(("_bucket", labels, cumulative))
+            labels = format_labels(self.label_names, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        # callables returning {gauge name: value}, called at scrape time
+        self.collectors: List[Callable[[], dict]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(
+            Histogram(name, documentation, label_names, buckets=buckets)
+        )
+
+    def register_collector(self, collector: Callable[[], dict]):
+        self.collectors.append(collector)
+
+    def unregister_collector(self, collector: Callable[[], dict]):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self) -> str:
+        parts = [metric.render() for metric in list(self.metrics.values())]
+        for collector in list(self.collectors):
+            try:
+                gauges = collector()
+            except Exception as e:
+                logger.exception(f"metrics collector {collector} failed with {e=}")
+                continue
+            for name, value in gauges.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    parts.append(f"# TYPE {name} gauge\n{name} {format_value(value)}")
+        return "\n".join(parts) + "\n"
+
+
+INGEST_METRICS = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # every scrape would be logged to stderr
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        self.registry = registry
+        super().__init__((host, port), MetricsHandler)
+
+
+def start_metrics_server(
+    registry: MetricsRegistry, host: str, port: int
+) -> Optional[MetricsServer]:
+    """serve /metrics in a daemon thread, None if the port can't be bound"""
+    try:
+        server = MetricsServer(registry, host, port)
+    except OSError as e:
+        logger.error(f"start metrics server on {host}:{port} failed with {e=}")
+        return None
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    logger.info(f"metrics are served on http://{host}:{port}/metrics")
+    return server
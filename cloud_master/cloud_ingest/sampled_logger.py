@@ -0,0 +1,52 @@
+"""
+structured logging for the per-message events of the ingestion: every event is one
+json line, and an event is logged at most once per `interval` seconds, the next
+line tells how many were suppressed in between. the events of a `sample_key`(such
+as the client_id of a gateway) are sampled apart from the others, so a noisy gateway
+doesn't hide the errors of the quiet ones.
+    sampled_logger = SampledLogger(logger)
+    sampled_logger.info("message_received", topic=msg.topic)
+    sampled_logger.error("load_failed", sample_key=client_id, client_id=client_id)
+"""
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+
+class SampledLogger(object):
+    def __init__(self, logger: logging.Logger, interval: float = 10.0):
+        self.logger = logger
+        self.interval = interval
+        # (event, sample_key) -> [monotonic time of the last logged line, suppressed]
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def log(self, level: int, event: str, sample_key: Optional[str] = None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self.events.get((event, sample_key))
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return
+            suppressed = state[1] if state is not None else 0
+            self.events[(event, sample_key)] = [now, 0]
+        record = {"event": event, **fields}
+        if suppressed:
+            record["suppressed"] = suppressed
+        self.logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+    def debug(self, event: str, sample_key: Optional[str] = None, **fields):
+        self.log(logging.DEBUG, event, sample_key, **fields)
+
+    def info(self, event: str, sample_key: Optional[str] = None, **fields):
+        self.log(logging.INFO, event, sample_key, **fields)
+
+    def warning(self, event: str, sample_key: Optional[str] = None, **fields):
+        self.log(logging.WARNING, event, sample_key, **fields)
+
+    def error(self, event: str, sample_key: Optional[str] = None, **fields):
+        self.log(logging.ERROR, event, sample_key, **fields)
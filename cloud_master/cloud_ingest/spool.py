@@ -0,0 +1,234 @@
+"""
+append-only spool(write-ahead log) of the accepted sensor readings on local disk.
+files in the spool directory:
+    00000000000000000001.seg  segments, a record is <length:uint32><crc32:uint32><bson>,
+                              a new segment is started when the last one is full
+    checkpoint                "<segment> <offset>" of the first record not consumed
+    lock                      only one process can use a spool directory
+segments before the checkpoint are deleted, and append() blocks while the records
+not consumed take more than `max_bytes`, so the disk usage is bounded by
+max_bytes + segment_bytes.
+"""
+import fcntl
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Tuple
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+
+
+def encode_record(record: dict) -> bytes:
+    payload = bson.encode(record)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class Spool(object):
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int = 2 * 1024 * 1024 * 1024,
+        fsync: bool = False,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.appended_count = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, "lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"spool {directory} is used by another process")
+        self.segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        ) or [1]
+        self.checkpoint = self.load_checkpoint()
+        self.delete_consumed_segments()
+        self.truncate_torn_tail()
+        self.total_bytes = sum(
+            os.path.getsize(self.segment_path(segment))
+            for segment in self.segments
+            if os.path.exists(self.segment_path(segment))
+        )
+        self._writer = open(self.segment_path(self.segments[-1]), "ab")
+        self._reader, self._reader_segment = None, None
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.directory, "checkpoint")
+
+    def load_checkpoint(self) -> Tuple[int, int]:
+        try:
+            with open(self.checkpoint_path) as f:
+                segment, offset = map(int, f.read().split())
+        except (FileNotFoundError, ValueError):
+            return self.segments[0], 0
+        if segment < self.segments[0]:
+            # its segment was consumed and deleted
+            return self.segments[0], 0
+        return segment, offset
+
+    def save_checkpoint(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{self.checkpoint[0]} {self.checkpoint[1]}")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def delete_consumed_segments(self) -> int:
+        """:return: bytes deleted"""
+        deleted_bytes = 0
+        while len(self.segments) > 1 and self.segments[0] < self.checkpoint[0]:
+            path = self.segment_path(self.segments.pop(0))
+            if os.path.exists(path):
+                deleted_bytes += os.path.getsize(path)
+                os.remove(path)
+        return deleted_bytes
+
+    def truncate_torn_tail(self):
+        """drop the incomplete record left by a crash while appending"""
+        path = self.segment_path(self.segments[-1])
+        if not os.path.exists(path):
+            return
+        valid_size = 0
+        with open(path, "rb") as f:
+            while header := f.read(RECORD_HEADER.size):
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid_size = f.tell()
+        if valid_size < os.path.getsize(path):
+            logger.warning(f"truncate the torn tail of {path} at {valid_size}")
+            os.truncate(path, valid_size)
+
+    def append(self, records: list) -> bool:
+        """
+        blocks while the spool is full, until the consumer frees space
+        :return: False if the spool is closed
+        """
+        data = b"".join(encode_record(record) for record in records)
+        with self._space:
+            if self.lag_bytes + len(data) > self.max_bytes:
+                logger.warning(f"spool {self.directory} is full, wait for the writer")
+            while (
+                self.lag_bytes + len(data) > self.max_bytes
+                and self.lag_bytes > 0
+                and not self.closed
+            ):
+                self._space.wait(1.0)
+            if self.closed:
+                return False
+            if self._writer.tell() >= self.segment_bytes:
+                self.rotate()
+            self._writer.write(data)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self.total_bytes += len(data)
+            self.appended_count += len(records)
+        return True
+
+    def rotate(self):
+        self._writer.close()
+        self.segments.append(self.segments[-1] + 1)
+        self._writer = open(self.segment_path(self.segments[-1]), "ab")
+
+    def read(self, max_records: int) -> Tuple[list, Tuple[int, int]]:
+        """
+        read the records after the checkpoint, in order
+        :return: (records, the position after the last one for commit())
+        """
+        with self._lock:
+            last_segment, last_size = self.segments[-1], self._writer.tell()
+        segment, offset = self.checkpoint
+        records = []
+        while len(records) < max_records:
+            if segment == last_segment:
+                size = last_size
+            elif segment > last_segment:
+                break
+            else:
+                size = os.path.getsize(self.segment_path(segment))
+            if offset >= size:
+                if segment >= last_segment:
+                    break
+                segment, offset = segment + 1, 0
+                continue
+            reader = self.get_reader(segment)
+            reader.seek(offset)
+            header = reader.read(RECORD_HEADER.size)
+            length, crc = RECORD_HEADER.unpack(header)
+            payload = reader.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logger.error(
+                    f"corrupted record in {self.segment_path(segment)} at {offset}, "
+                    f"skip the rest of the segment"
+                )
+                offset = size
+                continue
+            records.append(bson.decode(payload))
+            offset += RECORD_HEADER.size + length
+        return records, (segment, offset)
+
+    def get_reader(self, segment: int):
+        if self._reader_segment != segment:
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = open(self.segment_path(segment), "rb")
+            self._reader_segment = segment
+        return self._reader
+
+    def commit(self, position: Tuple[int, int]):
+        """the records before position are consumed"""
+        with self._space:
+            self.checkpoint = position
+            self.save_checkpoint()
+            if self._reader_segment is not None and self._reader_segment < position[0]:
+                self._reader.close()
+                self._reader, self._reader_segment = None, None
+            self.total_bytes -= self.delete_consumed_segments()
+            self._space.notify_all()
+
+    @property
+    def lag_bytes(self) -> int:
+        """bytes of the records not consumed yet"""
+        return self.total_bytes - self.checkpoint[1]
+
+    def get_stats(self) -> dict:
+        return {
+            "spool_segments": len(self.segments),
+            "spool_bytes": self.total_bytes,
+            "spool_lag_bytes": self.lag_bytes,
+        }
+
+    def close(self):
+        with self._space:
+            self.closed = True
+            self._space.notify_all()
+            self._writer.close()
+            if self._reader is not None:
+                self._reader.close()
+        self._lock_file.close()
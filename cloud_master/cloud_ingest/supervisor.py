@@ -0,0 +1,254 @@
+"""
+run several subscribe_message.DataLoader processes, so the ingestion scales with cores:
+    cd cloud_master && python -m cloud_ingest.supervisor [--workers 4] [--share-group g]
+every worker loads a partition of the gateways(client_id hashed by crc32), or all
+messages the broker gives it with MQTT shared subscriptions, which spread the readings
+of a sensor over the workers, so they are refused while an engine keeping per sensor
+state in the workers is enabled(see get_per_sensor_engines). the supervisor restarts
+crashed workers with a backoff, logs the throughput of every worker, and stops them
+with SIGTERM on SIGTERM/SIGINT, the workers flush their buffered readings before exit.
+"""
+import argparse
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from cloud.settings import (
+    ALARM_CONFIG,
+    BASELINE_CONFIG,
+    HEARTBEAT_CONFIG,
+    INGEST_METRICS_CONFIG,
+    INGEST_SUPERVISOR_CONFIG,
+    MQTT_CLIENT_CONFIG,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_per_sensor_engines() -> list:
+    """
+    the enabled engines of the DataLoader which keep the state of a sensor in the
+    process: the n-of-m windows and rates of the alarm rules, the EWMA baselines and
+    the last seen times of the heartbeat are broken if the readings of a sensor are
+    spread over the workers
+    """
+    engines = {
+        "ALARM_CONFIG": ALARM_CONFIG,
+        "BASELINE_CONFIG": BASELINE_CONFIG,
+        "HEARTBEAT_CONFIG": HEARTBEAT_CONFIG,
+    }
+    return [name for name, config in engines.items() if config.get("enabled")]
+
+
+def check_share_group(share_group: str):
+    """:raise ValueError: if the shared subscription would break an engine"""
+    if share_group and (engines := get_per_sensor_engines()):
+        raise ValueError(
+            f"share_group {share_group!r} spreads the readings of a sensor over the "
+            f"workers, disable {', '.join(engines)} or use the client_id partitions"
+        )
+
+
+def run_worker(
+    index: int,
+    worker_count: int,
+    share_group: str,
+    stats_queue: multiprocessing.Queue,
+    stats_interval: float,
+):
+    # imported in the worker, so the supervisor never creates mqtt or mongo clients
+    from subscribe_message import DataLoader
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [worker {index}] %(levelname)s %(name)s: %(message)s",
+    )
+    metrics_port = INGEST_METRICS_CONFIG["port"]
+    data_loader = DataLoader(
+        f"{MQTT_CLIENT_CONFIG['subscribe_client_id']}-{index}",
+        MQTT_CLIENT_CONFIG["host"],
+        MQTT_CLIENT_CONFIG["port"],
+        partition_index=index,
+        partition_count=worker_count,
+        share_group=share_group,
+        # every worker serves its own /metrics
+        metrics_port=metrics_port and metrics_port + index,
+    )
+    # the supervisor stops the workers, ctrl-c in a terminal is sent to all of them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: data_loader.stop())
+    stop_event = threading.Event()
+
+    def report_stats():
+        while not stop_event.wait(stats_interval):
+            stats_queue.put((index, data_loader.get_stats()))
+
+    threading.Thread(target=report_stats, name="worker-stats", daemon=True).start()
+    try:
+        data_loader.run()
+    finally:
+        stop_event.set()
+        stats_queue.put((index, data_loader.get_stats()))
+
+
+class IngestSupervisor(object):
+    def __init__(
+        self,
+        worker_count: int,
+        share_group: str = "",
+        stats_interval: float = 60,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        stop_timeout: float = 30.0,
+    ):
+        check_share_group(share_group)
+        self.worker_count = worker_count
+        self.share_group = share_group
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stop_timeout = stop_timeout
+        # spawn: the workers don't inherit threads or sockets of the supervisor
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue()
+        self.workers = {}
+        self.started_at = {}
+        self.restart_counts = {}
+        self.restart_at = {}
+        # index -> (time, stats) of the last two reports, for the rates
+        self.stats = {}
+        self._stop_event = threading.Event()
+
+    def start_worker(self, index: int):
+        worker = self.context.Process(
+            target=run_worker,
+            args=(
+                index,
+                self.worker_count,
+                self.share_group,
+                self.stats_queue,
+                self.stats_interval,
+            ),
+            name=f"ingest-worker-{index}",
+        )
+        worker.start()
+        self.workers[index] = worker
+        self.started_at[index] = time.monotonic()
+        self.stats.pop(index, None)
+        logger.info(f"ingest worker {index} started, pid={worker.pid}")
+
+    def check_workers(self):
+        now = time.monotonic()
+        for index, worker in self.workers.items():
+            if worker.is_alive():
+                continue
+            if index not in self.restart_at:
+                if now - self.started_at[index] > self.max_restart_delay:
+                    # it ran long enough, not a crash loop
+                    self.restart_counts[index] = 0
+                restart_count = self.restart_counts.get(index, 0)
+                delay = min(
+                    self.restart_delay * 2 ** restart_count, self.max_restart_delay
+                )
+                self.restart_counts[index] = restart_count + 1
+                self.restart_at[index] = now + delay
+                logger.error(
+                    f"ingest worker {index}(pid={worker.pid}) exited with "
+                    f"{worker.exitcode}, restart in {delay:.0f}s"
+                )
+            elif now >= self.restart_at[index]:
+                del self.restart_at[index]
+                self.start_worker(index)
+
+    def collect_stats(self, timeout: float):
+        try:
+            index, stats = self.stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.save_stats(index, stats)
+
+    def save_stats(self, index: int, stats: dict):
+        previous = self.stats.get(index, (None, None))[-1]
+        self.stats[index] = (previous, (time.monotonic(), stats))
+
+    def log_stats(self):
+        for index in sorted(self.stats):
+            previous, (report_time, stats) = self.stats[index]
+            rate = 0.0
+            if previous and report_time > previous[0]:
+                rate = (stats["loaded"] - previous[1]["loaded"]) / (
+                    report_time - previous[0]
+                )
+            logger.info(
+                f"ingest worker {index}: {rate:.1f} readings/s, "
+                + ", ".join(f"{key}={value}" for key, value in stats.items())
+            )
+
+    def handle_signal(self, signum, frame):
+        logger.info(f"received signal {signum}, stopping the ingest workers")
+        self._stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        for index in range(self.worker_count):
+            self.start_worker(index)
+        last_log = time.monotonic()
+        while not self._stop_event.is_set():
+            self.collect_stats(timeout=1.0)
+            self.check_workers()
+            if time.monotonic() - last_log >= self.stats_interval:
+                self.log_stats()
+                last_log = time.monotonic()
+        self.stop()
+
+    def stop(self):
+        for worker in self.workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for index, worker in self.workers.items():
+            worker.join(max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                logger.warning(f"ingest worker {index} didn't stop in time, kill it")
+                worker.kill()
+                worker.join()
+        while True:
+            try:
+                index, stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.save_stats(index, stats)
+        self.log_stats()
+        logger.info("all ingest workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the sensor data ingestion workers")
+    parser.add_argument(
+        "--workers", type=int, default=INGEST_SUPERVISOR_CONFIG["workers"]
+    )
+    parser.add_argument(
+        "--share-group",
+        default=INGEST_SUPERVISOR_CONFIG["share_group"],
+        help="use MQTT shared subscriptions instead of client_id hashing",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=INGEST_SUPERVISOR_CONFIG["stats_interval"],
+    )
+    args = parser.parse_args()
+    try:
+        check_share_group(args.share_group)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=logging.INFO)
+    IngestSupervisor(max(args.workers, 1), args.share_group, args.stats_interval).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+hierarchical timer wheel(Varghese & Lauck): timers of integer ticks are put into
+levels of `slots` buckets each, level l covers slots ** (l + 1) ticks, so adding,
+moving and cancelling a timer is O(1) and advancing one tick only touches one
+bucket, instead of scanning all timers.
+a bucket of level l > 0 is cascaded into the lower levels when the wheel reaches the
+start of its range; timers beyond the last level are parked in it and put back
+when they come up.
+it's not thread-safe, the caller holds a lock.
+"""
+from typing import Dict, Hashable, List, Tuple
+
+
+class TimerWheel(object):
+    def __init__(self, current_tick: int, slots: int = 64, levels: int = 4):
+        self.current_tick = current_tick
+        self.slots = slots
+        self.levels = [[set() for _ in range(slots)] for _ in range(levels)]
+        # key -> (level, slot, expire tick)
+        self.timers: Dict[Hashable, Tuple[int, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.timers
+
+    def schedule(self, key: Hashable, expire_tick: int):
+        """add the timer, or move it if the key is scheduled"""
+        self.cancel(key)
+        # expired ones go off at the next tick
+        self._place(key, expire_tick, self.current_tick + 1)
+
+    def cancel(self, key: Hashable) -> bool:
+        if (position := self.timers.pop(key, None)) is None:
+            return False
+        level, slot, _ = position
+        self.levels[level][slot].discard(key)
+        return True
+
+    def _place(self, key: Hashable, expire_tick: int, earliest_tick: int):
+        tick = max(expire_tick, earliest_tick)
+        delta = tick - self.current_tick
+        last_level = len(self.levels) - 1
+        for level in range(len(self.levels)):
+            if delta < self.slots ** (level + 1) or level == last_level:
+                if delta >= self.slots ** (level + 1):
+                    # parked in the farthest bucket, put back when cascaded
+                    tick = self.current_tick + self.slots ** (level + 1) - 1
+                slot = (tick // self.slots ** level) % self.slots
+                self.levels[level][slot].add(key)
+                self.timers[key] = (level, slot, expire_tick)
+                return
+
+    def advance(self, to_tick: int) -> List[Hashable]:
+        """:return: the keys of the timers expired until to_tick, in order"""
+        expired = []
+        while self.current_tick < to_tick:
+            self.current_tick += 1
+            tick = self.current_tick
+            for level in range(len(self.levels) - 1, 0, -1):
+                if tick % self.slots ** level == 0:
+                    slot = (tick // self.slots ** level) % self.slots
+                    self._cascade(level, slot)
+            bucket = self.levels[0][tick % self.slots]
+            if bucket:
+                for key in bucket:
+                    del self.timers[key]
+                expired.extend(bucket)
+                bucket.clear()
+        return expired
+
+    def _cascade(self, level: int, slot: int):
+        bucket = self.levels[level][slot]
+        keys = list(bucket)
+        bucket.clear()
+        for key in keys:
+            _, _, expire_tick = self.timers.pop(key)
+            # the bucket of the current tick isn't expired yet
+            self._place(key, expire_tick, self.current_tick)
@@ -0,0 +1,175 @@
+"""
+one mqtt connection per host: the bridge process owns the CloudMqtt client, which
+subscribes the topics of mqtt_router, and the web workers publish through it over a
+unix socket(MQTT_BRIDGE_CONFIG["socket_path"]):
+    cd cloud_master && python manage.py run_mqtt_bridge
+a connection per call, one json line each way:
+    {"action": "publish", "topic": ..., "payload": {...}} -> {"ok": true, "id": ...}
+    {"action": "request", "topic": ..., "payload": {...}, "timeout": 5}
+        -> {"ok": true, "reply": {...} or null if it didn't come in time}
+    {"action": "ping"} -> {"ok": true, "connected": true, ...}, see CloudMqtt.health
+    failures -> {"ok": false, "error": "..."}
+publish()/request() fall back to the client of this process when the bridge isn't
+running, so a single process deployment works without it.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+from typing import Optional
+
+from cloud.settings import MQTT_BRIDGE_CONFIG
+from cloud_mqtt.cloud_mqtt_client import get_cloud_mqtt_client, peek_cloud_mqtt_client
+
+logger = logging.getLogger(__name__)
+
+
+class MqttBridgeError(Exception):
+    pass
+
+
+class MqttBridgeUnavailable(MqttBridgeError):
+    pass
+
+
+class MqttBridgeHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            response = {"ok": True, **self.handle_message(message)}
+        except Exception as e:
+            logger.exception(f"mqtt bridge call failed with {e=}")
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    def handle_message(self, message: dict) -> dict:
+        client = self.server.mqtt_client
+        action = message.get("action")
+        if action == "publish":
+            return {"id": client.mqtt_publish(message["topic"], message.get("payload"))}
+        if action == "request":
+            reply = client.request(
+                message["topic"],
+                message.get("payload"),
+                message.get("timeout", MQTT_BRIDGE_CONFIG["request_timeout"]),
+            )
+            return {"reply": reply}
+        if action == "ping":
+            return client.health()
+        raise ValueError(f"unknown {action=}")
+
+
+class MqttBridgeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # a thread per call, the requests wait for the replies in their threads
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, mqtt_client):
+        self.socket_path = socket_path
+        self.mqtt_client = mqtt_client
+        if os.path.exists(socket_path):
+            # left by a bridge which wasn't stopped cleanly
+            os.remove(socket_path)
+        super().__init__(socket_path, MqttBridgeHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def run_bridge(socket_path: str = ""):
+    server = MqttBridgeServer(
+        socket_path or MQTT_BRIDGE_CONFIG["socket_path"], get_cloud_mqtt_client()
+    )
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"mqtt bridge is listening on {server.socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.mqtt_client.client.disconnect()
+        server.mqtt_client.client.loop_stop()
+
+
+def call_bridge(message: dict, timeout: float) -> dict:
+    socket_path = MQTT_BRIDGE_CONFIG["socket_path"]
+    if not socket_path:
+        raise MqttBridgeUnavailable("mqtt bridge is disabled")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        sock.close()
+        raise MqttBridgeUnavailable(f"mqtt bridge {socket_path} isn't running: {e}")
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(message).encode("utf-8") + b"\n")
+        f.flush()
+        line = f.readline()
+    if not line:
+        raise MqttBridgeError("mqtt bridge closed the connection")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise MqttBridgeError(response.get("error", ""))
+    return response
+
+
+def publish(topic: str, payload: Optional[dict] = None) -> str:
+    """:return: id of the message"""
+    message = {"action": "publish", "topic": topic, "payload": payload}
+    try:
+        return call_bridge(message, MQTT_BRIDGE_CONFIG["request_timeout"])["id"]
+    except MqttBridgeUnavailable:
+        return get_cloud_mqtt_client().mqtt_publish(topic, payload)
+
+
+def request(
+    topic: str, payload: Optional[dict] = None, timeout: Optional[float] = None
+) -> Optional[dict]:
+    """
+    publish and wait for the reply of the gateway, see CloudMqtt.request
+    :return: the reply, None if it didn't come in time
+    """
+    timeout = timeout or MQTT_BRIDGE_CONFIG["request_timeout"]
+    message = {
+        "action": "request",
+        "topic": topic,
+        "payload": payload,
+        "timeout": timeout,
+    }
+    try:
+        # the bridge needs a little more time to answer a timed out request
+        return call_bridge(message, timeout + 1.0)["reply"]
+    except MqttBridgeUnavailable:
+        return get_cloud_mqtt_client().request(topic, payload, timeout)
+
+
+def health() -> dict:
+    """
+    state of the mqtt connection used by this process, "healthy" is False if the
+    bridge doesn't answer or the connection is down
+    """
+    try:
+        response = call_bridge(
+            {"action": "ping"}, MQTT_BRIDGE_CONFIG["request_timeout"]
+        )
+    except MqttBridgeUnavailable:
+        client = peek_cloud_mqtt_client()
+        if client is None:
+            # nothing published yet, the client is created on first use
+            return {"mode": "local", "healthy": True, "connected": False}
+        client_health = client.health()
+        return {"mode": "local", "healthy": client_health["connected"], **client_health}
+    except (MqttBridgeError, OSError, ValueError) as e:
+        return {"mode": "bridge", "healthy": False, "error": str(e)}
+    response.pop("ok")
+    return {"mode": "bridge", "healthy": response["connected"], **response}
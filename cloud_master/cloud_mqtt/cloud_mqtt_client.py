@@ -1,50 +1,121 @@
 import json
 import logging
+import os
+import threading
+from datetime import datetime
+from typing import Optional
 
 import paho.mqtt.client as mqtt_client
 from bson import ObjectId
 
 from cloud.settings import MQTT_CLIENT_CONFIG
-from cloud_mqtt.deal_with_publish_message import OnMqttMessage
+from cloud_mqtt.deal_with_publish_message import mqtt_router
 
 logger = logging.getLogger(__name__)
 
 
+class PendingReply(object):
+    __slots__ = ("event", "reply")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.reply = None
+
+
 class CloudMqtt(object):
     def __init__(self, client_id: str):
         self.client_id = client_id
         self.client = mqtt_client.Client(self.client_id, clean_session=False)
+        # the process which created the client, its network thread isn't forked
+        self.pid = os.getpid()
+        self.connected = threading.Event()
+        self.last_connected_at = None
+        self.last_disconnect_rc = None
+        # msg id -> PendingReply of the requests waiting for their replies
+        self.pending_replies = {}
+        self._pending_lock = threading.Lock()
 
     def on_mqtt_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logger.info(f"{self.client_id} success to connected to MQTT Broker!")
+            self.last_connected_at = datetime.now()
+            self.connected.set()
         else:
             logger.info(f"{self.client_id} failed to connect to MQTT Broker!")
-        client.subscribe("#")
+        client.subscribe(mqtt_router.subscriptions())
         # sensors_subscribe_topics()  # 订阅消息
 
-    @staticmethod
-    def on_mqtt_message(client, userdata, msg):
+    def on_mqtt_message(self, client, userdata, msg):
         """The callback for when a PUBLISH message is received from the server."""
-        msg_dict = json.loads(msg.payload.decode("utf-8"))
-        OnMqttMessage.deal_with_msg(msg.topic, msg_dict)
+        mqtt_router.dispatch(msg.topic, msg.payload)
+        if self.pending_replies:
+            self.resolve_reply(msg.payload)
 
     @staticmethod
     def on_mqtt_subscribe(client, userdata, mid, granted_qos):
         logger.info(f"11111111On Subscribed: {mid=}, {userdata=}, {granted_qos=}")
 
-    @staticmethod
-    def on_mqtt_disconnect(client, userdata, rc):
+    def on_mqtt_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        self.last_disconnect_rc = rc
         if rc != 0:
             logger.info(f"Unexpected disconnection {rc=} in cloud app!")
         else:
             logger.info("disconnection !!!")
 
-    def mqtt_publish(self, topic, payload=None):
-        if not payload:
-            payload = {}
-        payload.update({"id": "123", "version": "1.0"})
-        self.client.publish(topic, payload=json.dumps(payload))
+    def mqtt_publish(self, topic, payload=None, msg_id: str = "") -> str:
+        """:return: id of the message, the gateway replies with the same id"""
+        payload = dict(payload or {})
+        msg_id = msg_id or str(ObjectId())
+        payload.update({"id": msg_id, "version": "1.0"})
+        # the first publish waits for the connection started by run()
+        if not self.connected.wait(MQTT_CLIENT_CONFIG["connect_timeout"]):
+            raise ConnectionError(f"{self.client_id} isn't connected to MQTT Broker")
+        info = self.client.publish(topic, payload=json.dumps(payload))
+        if info.rc != mqtt_client.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"publish to {topic=} failed with {info.rc=}")
+        return msg_id
+
+    def request(self, topic, payload=None, timeout: float = 5.0) -> Optional[dict]:
+        """
+        publish and wait for the reply carrying the same id, the reply topic must be
+        registered in mqtt_router to be subscribed
+        :return: the reply, None if it didn't come in time
+        """
+        msg_id = str(ObjectId())
+        pending_reply = PendingReply()
+        with self._pending_lock:
+            self.pending_replies[msg_id] = pending_reply
+        try:
+            self.mqtt_publish(topic, payload, msg_id)
+            pending_reply.event.wait(timeout)
+            return pending_reply.reply
+        finally:
+            with self._pending_lock:
+                self.pending_replies.pop(msg_id, None)
+
+    def resolve_reply(self, payload: bytes):
+        try:
+            reply = json.loads(payload.decode("utf-8"))
+            msg_id = reply.get("id")
+        except (ValueError, AttributeError):
+            return
+        if not isinstance(msg_id, str):
+            return
+        with self._pending_lock:
+            pending_reply = self.pending_replies.pop(msg_id, None)
+        if pending_reply is not None:
+            pending_reply.reply = reply
+            pending_reply.event.set()
+
+    def health(self) -> dict:
+        last_connected_at = self.last_connected_at
+        return {
+            "client_id": self.client_id,
+            "connected": self.client.is_connected(),
+            "last_connected_at": last_connected_at and last_connected_at.isoformat(),
+            "last_disconnect_rc": self.last_disconnect_rc,
+        }
 
     def run(self):
         self.client.username_pw_set(MQTT_CLIENT_CONFIG["user"], MQTT_CLIENT_CONFIG["pw"])
@@ -57,8 +128,42 @@ class CloudMqtt(object):
         return self
 
 
-cloud_mqtt_client = CloudMqtt(str(ObjectId())).run()
+_cloud_mqtt_client = None
+_client_lock = threading.Lock()
+
+
+def get_cloud_mqtt_client() -> CloudMqtt:
+    """
+    the client of this process, it's created and connects on first use, so importing
+    this module doesn't touch the network and the workers boot without the broker
+    """
+    global _cloud_mqtt_client
+    with _client_lock:
+        if _cloud_mqtt_client is None or _cloud_mqtt_client.pid != os.getpid():
+            _cloud_mqtt_client = CloudMqtt(str(ObjectId())).run()
+        return _cloud_mqtt_client
+
+
+def peek_cloud_mqtt_client() -> Optional[CloudMqtt]:
+    """the client of this process if it has been created, for the health check"""
+    client = _cloud_mqtt_client
+    if client is None or client.pid != os.getpid():
+        return None
+    return client
 
 
+def reset_cloud_mqtt_client():
+    """after fork, the worker creates its own client instead of the master's"""
+    global _cloud_mqtt_client, _client_lock
+    _cloud_mqtt_client = None
+    # it may have been held by another thread of the parent while forking
+    _client_lock = threading.Lock()
 
 
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # not running in uwsgi, CloudMqtt.pid still keeps forked processes apart
+    pass
+else:
+    postfork(reset_cloud_mqtt_client)
@@ -1,12 +1,13 @@
+import json
 import logging
-import re
 
-from cloud.settings import CLIENT_IDS
+from cloud_mqtt.topic_router import TopicRouter
 from equipment_management.models.gateway import GateWay
 from equipment_management.services.sensor_config_service import SensorConfigService
 from mongoengine import DoesNotExist
 
 from common.const import MODEL_KEY_TO_SENSOR_TYPE
+from common.storage.client_id_cache import ClientIdCache
 from common.storage.redis import redis
 
 # this file is to add the corresponding subscribe and published topics
@@ -15,25 +16,31 @@ from common.storage.redis import redis
 # 获取网关下传感器列表的主题
 BASE_GATEWAY_SUBSCRIBE_TOPIC = "/serivice_reply/sub_get"
 BASE_GATEWAY_PUBLISH_TOPIC = "/serivice/sub_get"
-# 匹配网关下传感器列表
-SENSORS_IN_GATEWAY_PATTERN = re.compile(
-    rf"/(?P<client_id>[a-zA-Z0-9]+){BASE_GATEWAY_SUBSCRIBE_TOPIC}"
-)
 
 logger = logging.getLogger(__name__)
 
+client_id_cache = ClientIdCache(redis)
+
+# the topics subscribed by the cloud app, and their handlers
+mqtt_router = TopicRouter()
+
 
 class OnMqttMessage(object):
     @classmethod
     def is_gateway_enabled(cls, client_id: str) -> bool:
-        return redis.sismember(CLIENT_IDS, client_id)
+        return client_id in client_id_cache
 
-    @classmethod
-    def deal_with_msg(cls, topic: str, msg_dict: dict):
-        """处理mqtt server PUBLISH 回调总入口"""
-        if ret := SENSORS_IN_GATEWAY_PATTERN.match(topic):
-            client_id = ret.group(1)
-            cls.deal_with_sensors_in_gateway_msg(client_id, msg_dict)
+    @staticmethod
+    def get_sensor_info(msg_dict: dict) -> dict:
+        """sensor ids and types in the sub_get reply of a gateway"""
+        params = msg_dict.get("params", {})
+        model_keys = params.get("modelkey", [])
+        return {
+            "sensor_ids": params.get("sensor", []),
+            "sensor_types": [
+                MODEL_KEY_TO_SENSOR_TYPE[model_key] for model_key in model_keys
+            ],
+        }
 
     @classmethod
     def deal_with_sensors_in_gateway_msg(cls, client_id: str, msg_dict: dict):
@@ -48,11 +55,9 @@ class OnMqttMessage(object):
             logger.error(f"{client_id=} in redis, but not find in mongodb")
             return
         logger.info(f"*****************")
-        params = msg_dict.get("params", {})
-        sensors_ids = params.get("sensor", [])
-        model_keys = params.get("modelkey", [])
-        sensor_types = [MODEL_KEY_TO_SENSOR_TYPE[model_key] for model_key in model_keys]
-        sensor_info = {"sensor_ids": sensors_ids, "sensor_types": sensor_types}
+        sensor_info = cls.get_sensor_info(msg_dict)
+        sensors_ids = sensor_info["sensor_ids"]
+        sensor_types = sensor_info["sensor_types"]
         gateway.update(sensor_info=sensor_info)
 
         current_sensors = set(zip(sensors_ids, sensor_types))
@@ -65,3 +70,10 @@ class OnMqttMessage(object):
         if len(new_sensors) > 0:
             # create sensor_config model
             SensorConfigService(client_id).bulk_insert_sensor_configs(new_sensors)
+
+
+@mqtt_router.register(f"/+{BASE_GATEWAY_SUBSCRIBE_TOPIC}")
+def on_sensors_in_gateway(topic: str, args: list, payload: bytes):
+    OnMqttMessage.deal_with_sensors_in_gateway_msg(
+        args[0], json.loads(payload.decode("utf-8"))
+    )
@@ -0,0 +1,108 @@
+"""
+routing table of the mqtt messages: handlers are registered with MQTT topic filters,
+which are compiled into a trie, so a topic is matched level by level instead of
+trying every pattern, and only the registered filters need to be subscribed.
+a handler is called as handler(topic, args, payload), args are the topic levels
+matched by the wildcards, in order.
+    >>> router = TopicRouter()
+    >>> router.register("/+/subnode/+/data_ctrl/property", print)
+    <built-in function print>
+    >>> router.dispatch("/GW1/subnode/S1/data_ctrl/property", b"{}")
+    /GW1/subnode/S1/data_ctrl/property ['GW1', 'S1'] b'{}'
+    1
+"""
+import logging
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SINGLE_LEVEL_WILDCARD = "+"
+MULTI_LEVEL_WILDCARD = "#"
+
+
+class TopicNode(object):
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+def validate_topic_filter(topic_filter: str):
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if MULTI_LEVEL_WILDCARD in level and (
+            level != MULTI_LEVEL_WILDCARD or index != len(levels) - 1
+        ):
+            raise ValueError(f"'#' must be the last level of {topic_filter}")
+        if SINGLE_LEVEL_WILDCARD in level and level != SINGLE_LEVEL_WILDCARD:
+            raise ValueError(f"'+' must occupy a whole level of {topic_filter}")
+
+
+class TopicRouter(object):
+    def __init__(self):
+        self.root = TopicNode()
+        # topic filter -> qos, in the order of registration
+        self.topic_filters = {}
+
+    def register(self, topic_filter: str, handler: Optional[Callable] = None, qos=0):
+        """can be used as a decorator when handler is not given"""
+        if handler is None:
+            return lambda func: self.register(topic_filter, func, qos)
+        validate_topic_filter(topic_filter)
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, TopicNode())
+        node.handlers.append(handler)
+        self.topic_filters[topic_filter] = max(
+            qos, self.topic_filters.get(topic_filter, 0)
+        )
+        return handler
+
+    def match(self, topic: str) -> List[Tuple[Callable, list]]:
+        """:return: [(handler, args)]"""
+        levels = topic.split("/")
+        matched = []
+        self._match(self.root, levels, 0, [], matched)
+        return matched
+
+    def _match(self, node: TopicNode, levels: list, index: int, args: list, matched):
+        # wildcards at the first level don't match topics starting with "$"
+        wildcard_allowed = index > 0 or not levels[0].startswith("$")
+        if wildcard_allowed and (child := node.children.get(MULTI_LEVEL_WILDCARD)):
+            # "#" also matches the parent level
+            rest = "/".join(levels[index:])
+            matched.extend((handler, args + [rest]) for handler in child.handlers)
+        if index == len(levels):
+            matched.extend((handler, args) for handler in node.handlers)
+            return
+        level = levels[index]
+        if child := node.children.get(level):
+            self._match(child, levels, index + 1, args, matched)
+        if wildcard_allowed and (child := node.children.get(SINGLE_LEVEL_WILDCARD)):
+            self._match(child, levels, index + 1, args + [level], matched)
+
+    def dispatch(self, topic: str, payload: bytes) -> int:
+        """
+        call the handlers of the topic, an exception of a handler is logged
+        and doesn't stop the others
+        :return: number of handlers called
+        """
+        matched = self.match(topic)
+        for handler, args in matched:
+            try:
+                handler(topic, args, payload)
+            except Exception as e:
+                logger.exception(f"handle mqtt message of {topic=} failed with {e=}")
+        return len(matched)
+
+    def subscriptions(self, share_group: str = "") -> list:
+        """
+        [(topic filter, qos)] for mqtt_client.Client.subscribe
+        :param share_group: subscribe with `$share/<share_group>/<topic filter>`
+        """
+        prefix = f"$share/{share_group}/" if share_group else ""
+        return [
+            (f"{prefix}{topic_filter}", qos)
+            for topic_filter, qos in self.topic_filters.items()
+        ]
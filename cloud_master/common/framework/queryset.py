@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.conf import settings
 from mongoengine.base import TopLevelDocumentMetaclass
 from mongoengine.queryset import QuerySetManager
@@ -5,6 +7,28 @@ from mongoengine.queryset.queryset import QuerySet
 
 from common.framework.db_operate_counter import increase_db_operate_count
 
+# document class -> callbacks called after its documents are written
+document_change_listeners = defaultdict(list)
+
+
+def on_document_changed(*document_classes):
+    """
+    register a callback called with the document class after documents of
+    these classes are saved, updated, inserted or deleted
+    """
+
+    def decorator(listener):
+        for document_cls in document_classes:
+            document_change_listeners[document_cls].append(listener)
+        return listener
+
+    return decorator
+
+
+def notify_document_changed(document_cls):
+    for listener in document_change_listeners.get(document_cls, []):
+        listener(document_cls)
+
 
 class CloudQuerySet(QuerySet):
     def __init__(self, document, collection):
@@ -16,6 +40,21 @@ class CloudQuerySet(QuerySet):
             increase_db_operate_count()
         return qs
 
+    def update(self, *args, **kwargs):
+        result = super().update(*args, **kwargs)
+        notify_document_changed(self._document)
+        return result
+
+    def insert(self, *args, **kwargs):
+        result = super().insert(*args, **kwargs)
+        notify_document_changed(self._document)
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        notify_document_changed(self._document)
+        return result
+
     def circular_slice_update(self, limit=100, **kwargs) -> None:
         for i in range(0, self.count(), limit):
             update_query_set = self[i : i + limit]
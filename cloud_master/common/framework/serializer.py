@@ -7,9 +7,11 @@ from typing import Callable, List, Union
 
 from bson import ObjectId
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import CharField, IntegerField
+from rest_framework.fields import BooleanField, CharField, IntegerField
 from rest_framework.serializers import Serializer
 
+from common.utils import decode_page_token
+
 
 class BaseSerializer(Serializer):
     """
@@ -59,7 +61,18 @@ class AdministrativeDivisionSerializer(BaseSerializer):
 
 class PageLimitSerializer(BaseSerializer):
     page = IntegerField(required=False, default=1)
-    limit = IntegerField(required=False, default=10)
+    limit = IntegerField(required=False, default=10, min_value=1)
+    # keyset pagination: "" for the first page, then the `next` of the last page
+    after = CharField(required=False, allow_blank=True)
+    with_total = BooleanField(required=False, default=True)
+
+    def validate_after(self, after: str) -> str:
+        if after:
+            try:
+                decode_page_token(after)
+            except ValueError as e:
+                raise ValidationError(str(e))
+        return after
 
 
 def validate_and_save_data_list(data_list, get_validated_serializer):
@@ -2,11 +2,20 @@ import logging
 from collections import defaultdict
 
 from cloud.models import bson_to_dict
-from cloud.settings import CLIENT_IDS, MONGO_CLIENT
 from equipment_management.models.gateway import GateWay
 
 from common.const import SensorType
+from common.storage.array_codec import decode_reading
+from common.storage.client_id_cache import remove_client_id
 from common.storage.redis import redis
+from common.storage.sensor_latest import (
+    delete_sensor_latest,
+    get_sensor_latest,
+    get_sensor_latests,
+)
+from common.storage.sensor_prpd import delete_prpd_histograms
+from common.storage.sensor_rollup import delete_rollups
+from common.storage.sensor_store import delete_sensor_readings
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +40,14 @@ class BaseService(object):
         # todo clear client_ids in redis when delete customer or sites
         for sensor_type, sensor_ids in sensor_dict.items():
             try:
-                mongo_col = MONGO_CLIENT[sensor_type]
-                mongo_col.delete_many({"sensor_id": {"$in": sensor_ids}})
+                delete_sensor_readings(sensor_type, {"sensor_id": {"$in": sensor_ids}})
+                delete_rollups(sensor_type, {"sensor_id": {"$in": sensor_ids}})
+                delete_sensor_latest(
+                    {"sensor_id": {"$in": sensor_ids}, "sensor_type": sensor_type}
+                )
+                delete_prpd_histograms(
+                    {"sensor_id": {"$in": sensor_ids}, "sensor_type": sensor_type}
+                )
             except Exception as e:
                 logger.error(
                     f"delete sensor data failed with {sensor_type=}- sensor_ids: {sensor_ids} - {e=}"
@@ -44,8 +59,14 @@ class BaseService(object):
         if clear_resource:
             for sensor_type in SensorType.values():
                 try:
-                    mongo_col = MONGO_CLIENT[sensor_type]
-                    mongo_col.delete_many({"client_id": client_id})
+                    delete_sensor_readings(sensor_type, {"client_id": client_id})
+                    delete_rollups(sensor_type, {"client_id": client_id})
+                    delete_sensor_latest(
+                        {"client_id": client_id, "sensor_type": sensor_type}
+                    )
+                    delete_prpd_histograms(
+                        {"client_id": client_id, "sensor_type": sensor_type}
+                    )
                 except Exception as e:
                     logger.error(
                         f"delete sensor data failed with {sensor_type=}- client_id: {client_id} - {e=}"
@@ -55,10 +76,28 @@ class BaseService(object):
 
     @classmethod
     def remove_client_id_from_redis(cls, client_id: str):
-        redis.srem(CLIENT_IDS, client_id)
+        remove_client_id(redis, client_id)
 
     @classmethod
     def get_latest_sensor_info(cls, sensor_number: str, sensor_type: str) -> dict:
-        mongo_col = MONGO_CLIENT[sensor_type]
-        sensor_data = mongo_col.find_one({"sensor_id": sensor_number, "is_new": True},)
-        return bson_to_dict(sensor_data) if sensor_data else {}
+        """
+        the latest reading with its "zscore", and the "baseline" of the sensor:
+        {param: {"mean", "std", "count", "low", "high"}}, low-high is the normal range
+        """
+        sensor_data = get_sensor_latest(sensor_number, sensor_type)
+        return bson_to_dict(decode_reading(sensor_data)) if sensor_data else {}
+
+    @classmethod
+    def get_latest_sensor_infos(cls, sensors: list) -> dict:
+        """
+        batched get_latest_sensor_info for a page of sensors
+        :param sensors: [(sensor_number, sensor_type), ...]
+        :return: {(sensor_number, sensor_type): sensor_info}
+        """
+        latests = get_sensor_latests(sensors)
+        return {
+            sensor: bson_to_dict(decode_reading(latests[sensor]))
+            if sensor in latests
+            else {}
+            for sensor in sensors
+        }
@@ -0,0 +1,146 @@
+"""
+numeric arrays of the sensor params(such as the PRPD/phase bins of UHF and AE) are
+stored as packed binary instead of BSON lists:
+    Binary(subtype=ARRAY_BINARY_SUBTYPE) = <version:uint8><dtype:uint8><ndim:uint8>
+                                           <shape:uint32 * ndim><little-endian data>
+int arrays use the smallest of int16/int32 which holds all values, float arrays
+use float32 if every value is read back as it was sent from the shortest repr of
+its float32(at most 7 significant digits, such as the 0.1 resolution of the
+sensors), else float64.
+"""
+import struct
+import warnings
+from typing import Optional
+
+import numpy as np
+from bson.binary import Binary
+
+ARRAY_BINARY_SUBTYPE = 0x80
+ARRAY_CODEC_VERSION = 1
+# shorter lists are not worth packing
+MIN_ARRAY_SIZE = 16
+
+DTYPE_CODES = {
+    1: np.dtype("<i2"),
+    2: np.dtype("<i4"),
+    3: np.dtype("<f4"),
+    4: np.dtype("<f8"),
+    5: np.dtype("<i8"),
+}
+CODE_OF_DTYPE = {dtype: code for code, dtype in DTYPE_CODES.items()}
+
+ARRAY_HEADER = struct.Struct("<BBB")
+
+
+def get_packed_dtype(array: np.ndarray) -> Optional[np.dtype]:
+    if array.dtype.kind in "iu":
+        for dtype in (DTYPE_CODES[1], DTYPE_CODES[2]):
+            info = np.iinfo(dtype)
+            if info.min <= array.min() and array.max() <= info.max:
+                return dtype
+        return None
+    if array.dtype.kind == "f":
+        if np.isfinite(array).all() and np.array_equal(to_float64(array), array):
+            return DTYPE_CODES[3]
+        return DTYPE_CODES[4]
+    return None
+
+
+def to_float64(array: np.ndarray) -> np.ndarray:
+    """
+    float32 values as their shortest repr, so 0.1 is 0.1 rather than 0.10000000149
+
+    >>> to_float64(np.array([0.1, 23.17])).tolist()
+    [0.1, 23.17]
+    """
+    return array.astype(DTYPE_CODES[3]).astype(str).astype(DTYPE_CODES[4])
+
+
+def encode_array(values: list) -> Optional[Binary]:
+    """
+    >>> decode_array(encode_array(list(range(20)))).dtype
+    dtype('int16')
+
+    :return: None if values is not a rectangular list of numbers,
+             or has less than MIN_ARRAY_SIZE numbers
+    """
+    try:
+        with warnings.catch_warnings():
+            # ragged nested lists give an object array with a warning in old numpy,
+            # and raise ValueError in new ones
+            warnings.simplefilter("ignore")
+            array = np.asarray(values)
+    except ValueError:
+        return None
+    if array.size < MIN_ARRAY_SIZE:
+        return None
+    dtype = get_packed_dtype(array)
+    if dtype is None:
+        return None
+    return pack_array(array, dtype)
+
+
+def pack_array(array: np.ndarray, dtype: np.dtype) -> Binary:
+    """pack the array as dtype whatever its size, dtype is one of DTYPE_CODES"""
+    header = ARRAY_HEADER.pack(ARRAY_CODEC_VERSION, CODE_OF_DTYPE[dtype], array.ndim)
+    shape = struct.pack(f"<{array.ndim}I", *array.shape)
+    return Binary(
+        header + shape + array.astype(dtype).tobytes(), subtype=ARRAY_BINARY_SUBTYPE
+    )
+
+
+def is_encoded_array(value) -> bool:
+    return isinstance(value, Binary) and value.subtype == ARRAY_BINARY_SUBTYPE
+
+
+def decode_array(binary: bytes) -> np.ndarray:
+    version, dtype_code, ndim = ARRAY_HEADER.unpack_from(binary)
+    if version != ARRAY_CODEC_VERSION:
+        raise ValueError(f"unknown array codec {version=}")
+    shape = struct.unpack_from(f"<{ndim}I", binary, ARRAY_HEADER.size)
+    offset = ARRAY_HEADER.size + 4 * ndim
+    return np.frombuffer(binary, dtype=DTYPE_CODES[dtype_code], offset=offset).reshape(
+        shape
+    )
+
+
+def encode_params(params: dict) -> dict:
+    """
+    pack the numeric lists of the params, such as {"UHF": {"prpd": [...]}}
+    :return: new params, the given one is not changed
+    """
+    encoded = {}
+    for key, values in params.items():
+        if isinstance(values, dict):
+            encoded[key] = encode_params(values)
+        elif isinstance(values, list) and values:
+            encoded[key] = encode_array(values) or values
+        else:
+            encoded[key] = values
+    return encoded
+
+
+def decode_params(params: dict, to_list: bool = True) -> dict:
+    """
+    :param to_list: return lists which can be serialized to json, else ndarray
+    :return: new params, the given one is not changed
+    """
+    decoded = {}
+    for key, values in params.items():
+        if isinstance(values, dict):
+            decoded[key] = decode_params(values, to_list)
+        elif is_encoded_array(values):
+            array = decode_array(values)
+            if to_list and array.dtype == DTYPE_CODES[3]:
+                array = to_float64(array)
+            decoded[key] = array.tolist() if to_list else array
+        else:
+            decoded[key] = values
+    return decoded
+
+
+def decode_reading(reading: dict) -> dict:
+    """a reading or sensor_latest document with its params decoded to lists"""
+    if "params" not in reading:
+        return reading
+    return {**reading, "params": decode_params(reading["params"])}
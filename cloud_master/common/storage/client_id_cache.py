@@ -0,0 +1,115 @@
+"""
+process-local copy of the enabled gateway client ids(the redis set CLIENT_IDS),
+so the mqtt message handlers don't need a redis round-trip per message.
+the writers change the set with add_client_id/remove_client_id, which publish the
+change on CLIENT_IDS_CHANNEL, and every cache applies it; the cache also reloads
+the whole set periodically and after reconnecting, in case messages were missed.
+it doesn't depend on django, the redis client is given by the caller.
+"""
+import json
+import logging
+import threading
+import time
+
+from cloud.settings import CLIENT_IDS, CLIENT_IDS_CHANNEL
+from redis import Redis, RedisError
+
+logger = logging.getLogger(__name__)
+
+
+def publish_client_id_change(redis_cli: Redis, action: str, client_id: str):
+    pipeline = redis_cli.pipeline()
+    if action == "add":
+        pipeline.sadd(CLIENT_IDS, client_id)
+    else:
+        pipeline.srem(CLIENT_IDS, client_id)
+    pipeline.publish(
+        CLIENT_IDS_CHANNEL, json.dumps({"action": action, "client_id": client_id})
+    )
+    pipeline.execute()
+
+
+def add_client_id(redis_cli: Redis, client_id: str):
+    publish_client_id_change(redis_cli, "add", client_id)
+
+
+def remove_client_id(redis_cli: Redis, client_id: str):
+    publish_client_id_change(redis_cli, "remove", client_id)
+
+
+class ClientIdCache(object):
+    def __init__(self, redis_cli: Redis, resync_interval: float = 60.0):
+        self.redis_cli = redis_cli
+        self.resync_interval = resync_interval
+        self.client_ids = None
+        self.last_resync = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def __contains__(self, client_id: str) -> bool:
+        if self._thread is None:
+            self.start()
+        if self.client_ids is None:
+            # not loaded yet, as redis wasn't available
+            return bool(self.redis_cli.sismember(CLIENT_IDS, client_id))
+        return client_id in self.client_ids
+
+    def start(self):
+        """load the client ids and keep them current in a daemon thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            try:
+                self.resync()
+            except RedisError as e:
+                logger.error(f"load client ids failed with {e=}")
+            self._thread = threading.Thread(
+                target=self._run, name="client-id-cache", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def resync(self):
+        # replace the whole set, readers never see a partially loaded one
+        self.client_ids = set(self.redis_cli.smembers(CLIENT_IDS))
+        self.last_resync = time.monotonic()
+
+    def apply_change(self, message: dict):
+        if self.client_ids is None:
+            return
+        try:
+            change = json.loads(message["data"])
+            client_ids = set(self.client_ids)
+            if change["action"] == "add":
+                client_ids.add(change["client_id"])
+            else:
+                client_ids.discard(change["client_id"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"invalid client id change {message=}, {e=}")
+            return
+        self.client_ids = client_ids
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            pubsub = self.redis_cli.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CLIENT_IDS_CHANNEL)
+                # changes before the subscription may be missed
+                self.resync()
+                while not self._stop_event.is_set():
+                    if message := pubsub.get_message(timeout=1.0):
+                        self.apply_change(message)
+                    if time.monotonic() - self.last_resync >= self.resync_interval:
+                        self.resync()
+            except RedisError as e:
+                logger.error(f"client ids subscription failed with {e=}, retry later")
+                self._stop_event.wait(5)
+            finally:
+                pubsub.close()
@@ -0,0 +1,180 @@
+"""
+live readings for the dashboards: the ingestion appends every written reading to
+the redis stream of its site, capped at about READING_STREAM_CONFIG["maxlen"]
+entries, and the web tier reads the entries after the last id it returned:
+    readings:site:<site_id> -> {"client_id", "sensor_id", "sensor_type",
+                                "create_time", "params": json}
+only the scalar params are kept in the stream, the arrays(PRPS, PRPD...) stay in
+mongodb. the site of a reading comes from its gateway, the client_id -> site_id map
+is loaded from the gateway collection and reloaded periodically.
+it doesn't depend on django, the redis client and database are given by the caller.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from redis import Redis, RedisError
+
+logger = logging.getLogger(__name__)
+
+READING_STREAM_PREFIX = "readings:site:"
+# collection of equipment_management.models.gateway.GateWay
+GATEWAY_COLLECTION = "gateway"
+
+
+def get_stream_key(site_id) -> str:
+    return f"{READING_STREAM_PREFIX}{site_id}"
+
+
+def get_next_stream_id(stream_id: str) -> str:
+    """the smallest id after stream_id, XRANGE has no exclusive start in redis < 6.2"""
+    milliseconds, sequence = stream_id.split("-")
+    return f"{milliseconds}-{int(sequence) + 1}"
+
+
+def get_scalar_params(params: dict) -> dict:
+    """drop the arrays and packed binaries, keep numbers and strings"""
+    scalars = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            if nested := get_scalar_params(value):
+                scalars[key] = nested
+        elif isinstance(value, (int, float, str)):
+            scalars[key] = value
+    return scalars
+
+
+def build_stream_entry(data: dict) -> dict:
+    return {
+        "client_id": data["client_id"],
+        "sensor_id": data["sensor_id"],
+        "sensor_type": data["sensor_type"],
+        "create_time": data["create_time"].isoformat(),
+        "params": json.dumps(get_scalar_params(data.get("params", {}))),
+    }
+
+
+def parse_stream_entry(stream_id: str, fields: dict) -> dict:
+    return {
+        "id": stream_id,
+        "client_id": fields.get("client_id", ""),
+        "sensor_id": fields.get("sensor_id", ""),
+        "sensor_type": fields.get("sensor_type", ""),
+        "create_time": fields.get("create_time", ""),
+        "params": json.loads(fields.get("params") or "{}"),
+    }
+
+
+class GatewaySiteMap(object):
+    """client_id of the gateways -> their site_id, reloaded every refresh_interval"""
+
+    def __init__(self, database, refresh_interval: float = 60.0):
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.site_ids = {}
+        self.last_refresh = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        site_ids = {
+            gateway["client_number"]: str(gateway["site_id"])
+            for gateway in self.database[GATEWAY_COLLECTION].find(
+                {"site_id": {"$ne": None}}, {"client_number": 1, "site_id": 1}
+            )
+            if gateway.get("client_number")
+        }
+        # replace the whole map, readers never see a partially loaded one
+        self.site_ids = site_ids
+        self.last_refresh = time.monotonic()
+
+    def get(self, client_id: str) -> Optional[str]:
+        if (
+            self.last_refresh is None
+            or time.monotonic() - self.last_refresh >= self.refresh_interval
+        ):
+            with self._lock:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"load gateway sites failed with {e=}")
+                    # keep the old map, retry after the interval
+                    self.last_refresh = time.monotonic()
+        return self.site_ids.get(client_id)
+
+
+class ReadingStreamPublisher(object):
+    """append the readings written by the BufferedWriter to the site streams"""
+
+    def __init__(self, redis_cli: Redis, site_map: GatewaySiteMap, maxlen: int):
+        self.redis_cli = redis_cli
+        self.site_map = site_map
+        self.maxlen = maxlen
+        self.published_count = 0
+        self.unknown_gateway_count = 0
+
+    def __call__(self, sensor_type: str, docs: list):
+        self.publish(docs)
+
+    def publish(self, docs: list) -> int:
+        """:return: number of the entries appended, one round-trip per batch"""
+        by_site = defaultdict(list)
+        for data in docs:
+            site_id = self.site_map.get(data["client_id"])
+            if site_id is None:
+                self.unknown_gateway_count += 1
+                continue
+            by_site[site_id].append(build_stream_entry(data))
+        if not by_site:
+            return 0
+        pipeline = self.redis_cli.pipeline(transaction=False)
+        for site_id, entries in by_site.items():
+            for entry in entries:
+                # approximate trimming only removes whole macro nodes, it's cheap
+                pipeline.xadd(
+                    get_stream_key(site_id),
+                    entry,
+                    maxlen=self.maxlen,
+                    approximate=True,
+                )
+        try:
+            pipeline.execute()
+        except RedisError as e:
+            # the dashboards miss these readings, they are in mongodb anyway
+            logger.error(f"append readings to site streams failed with {e=}")
+            return 0
+        count = sum(len(entries) for entries in by_site.values())
+        self.published_count += count
+        return count
+
+
+def read_stream(
+    redis_cli: Redis,
+    site_id,
+    after: str = "",
+    count: int = 100,
+    client_ids: Optional[set] = None,
+    sensor_ids: Optional[set] = None,
+) -> tuple:
+    """
+    :param after: stream id returned by the last call, the newest `count` readings
+                  are returned without it
+    :param client_ids/sensor_ids: only the readings of these gateways/sensors
+    :return: (readings in stream order, id to pass as `after` next time),
+             the id moves past the filtered out entries too
+    """
+    key = get_stream_key(site_id)
+    if after:
+        entries = redis_cli.xrange(key, min=get_next_stream_id(after), count=count)
+    else:
+        entries = redis_cli.xrevrange(key, count=count)[::-1]
+    last_id = entries[-1][0] if entries else after
+    readings = [
+        parse_stream_entry(stream_id, fields)
+        for stream_id, fields in entries
+        if (client_ids is None or fields.get("client_id") in client_ids)
+        and (sensor_ids is None or fields.get("sensor_id") in sensor_ids)
+    ]
+    return readings, last_id
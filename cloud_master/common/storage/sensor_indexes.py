@@ -0,0 +1,25 @@
+"""
+indexes of the sensor collections written through cloud.settings.MONGO_CLIENT,
+these collections are not mongoengine models, so they are declared by their stores.
+"""
+from common.storage.sensor_latest import (
+    SENSOR_LATEST_COLLECTION,
+    ensure_sensor_latest_indexes,
+)
+from common.storage.sensor_prpd import PRPD_DAILY_COLLECTION, ensure_prpd_indexes
+from common.storage.sensor_rollup import ensure_rollup_indexes
+from common.storage.sensor_store import SENSOR_STORES
+
+
+def ensure_sensor_indexes() -> dict:
+    """
+    create the indexes of every sensor collection, it's idempotent.
+    :return: {collection_name: [index_name, ...]}
+    """
+    created = {}
+    for store in SENSOR_STORES.values():
+        created.update(store.ensure_indexes())
+    created[SENSOR_LATEST_COLLECTION] = ensure_sensor_latest_indexes()
+    created.update(ensure_rollup_indexes())
+    created[PRPD_DAILY_COLLECTION] = ensure_prpd_indexes()
+    return created
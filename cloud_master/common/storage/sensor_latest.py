@@ -0,0 +1,146 @@
+"""
+compact store of the latest reading of every sensor,
+there is only one upserted document per (sensor_id, sensor_type), which is only
+replaced by a newer reading: the batches of the shared subscription workers and the
+spool replays may come out of order.
+the ingestion also keeps the rolling baseline of the params(see cloud_ingest.baseline)
+in the `baseline` field, so it comes with the latest reading.
+"""
+from collections import defaultdict
+from typing import Optional
+
+import pymongo
+from cloud.settings import MONGO_CLIENT
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from common.storage.sensor_store import DUPLICATE_KEY_ERROR
+
+SENSOR_LATEST_COLLECTION = "sensor_latest"
+
+sensor_latest_col = MONGO_CLIENT[SENSOR_LATEST_COLLECTION]
+
+
+def ensure_sensor_latest_indexes() -> list:
+    return [
+        sensor_latest_col.create_index(
+            [("sensor_id", pymongo.ASCENDING), ("sensor_type", pymongo.ASCENDING)],
+            unique=True,
+            background=True,
+        ),
+        sensor_latest_col.create_index(
+            [("client_id", pymongo.ASCENDING)], background=True
+        ),
+    ]
+
+
+def build_sensor_latest_upserts(docs: list) -> list:
+    """
+    :param docs: inserted readings
+    :return: one UpdateOne per sensor with its newest reading, it doesn't match a
+             newer latest reading, and then fails with a duplicate key error
+    """
+    newest = {}
+    for data in docs:
+        key = (data["sensor_id"], data["sensor_type"])
+        if key not in newest or newest[key]["create_time"] <= data["create_time"]:
+            newest[key] = data
+    return [
+        UpdateOne(
+            {
+                "sensor_id": sensor_id,
+                "sensor_type": sensor_type,
+                "create_time": {"$lt": data["create_time"]},
+            },
+            {
+                "$set": {
+                    "reading_id": data.get("_id"),
+                    "client_id": data["client_id"],
+                    "version": data.get("version", ""),
+                    "params": data["params"],
+                    "zscore": data.get("zscore", {}),
+                    "create_time": data["create_time"],
+                    "update_time": data["update_time"],
+                }
+            },
+            upsert=True,
+        )
+        for (sensor_id, sensor_type), data in newest.items()
+    ]
+
+
+def upsert_sensor_latest(docs: list):
+    if not (upserts := build_sensor_latest_upserts(docs)):
+        return
+    try:
+        sensor_latest_col.bulk_write(upserts, ordered=False)
+    except BulkWriteError as e:
+        # the sensors whose latest reading is newer
+        if e.details.get("writeConcernErrors") or any(
+            error["code"] != DUPLICATE_KEY_ERROR
+            for error in e.details.get("writeErrors", [])
+        ):
+            raise
+
+
+def update_sensor_baselines(baselines: dict):
+    """
+    :param baselines: {(sensor_id, sensor_type): {param: baseline}}, the sensors
+                      without latest reading yet get it with the next update
+    """
+    updates = [
+        UpdateOne(
+            {"sensor_id": sensor_id, "sensor_type": sensor_type},
+            {"$set": {"baseline": baseline}},
+        )
+        for (sensor_id, sensor_type), baseline in baselines.items()
+    ]
+    if updates:
+        sensor_latest_col.bulk_write(updates, ordered=False)
+
+
+def get_sensor_baselines(sensor_types: list) -> dict:
+    """:return: {(sensor_id, sensor_type): {param: baseline}}"""
+    return {
+        (latest["sensor_id"], latest["sensor_type"]): latest["baseline"]
+        for latest in sensor_latest_col.find(
+            {"sensor_type": {"$in": sensor_types}, "baseline": {"$exists": True}},
+            {"sensor_id": 1, "sensor_type": 1, "baseline": 1, "_id": 0},
+        )
+    }
+
+
+def get_sensor_latest(sensor_id: str, sensor_type: str) -> Optional[dict]:
+    """return the latest reading in the same shape as the raw sensor document"""
+    latest = sensor_latest_col.find_one(
+        {"sensor_id": sensor_id, "sensor_type": sensor_type}
+    )
+    return format_sensor_latest(latest) if latest else None
+
+
+def get_sensor_latests(sensors: list) -> dict:
+    """
+    one query per sensor type instead of one per sensor.
+    :param sensors: [(sensor_id, sensor_type), ...]
+    :return: {(sensor_id, sensor_type): latest reading}, missing sensors are absent
+    """
+    type_to_ids = defaultdict(set)
+    for sensor_id, sensor_type in sensors:
+        type_to_ids[sensor_type].add(sensor_id)
+    latests = {}
+    for sensor_type, sensor_ids in type_to_ids.items():
+        for latest in sensor_latest_col.find(
+            {"sensor_id": {"$in": list(sensor_ids)}, "sensor_type": sensor_type}
+        ):
+            latests[(latest["sensor_id"], sensor_type)] = format_sensor_latest(latest)
+    return latests
+
+
+def format_sensor_latest(latest: dict) -> dict:
+    latest.pop("_id", None)
+    latest["_id"] = latest.pop("reading_id", None)
+    return latest
+
+
+def delete_sensor_latest(query: dict):
+    sensor_latest_col.delete_many(query)
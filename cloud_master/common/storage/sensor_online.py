@@ -0,0 +1,52 @@
+"""
+online sensors of every site for the navigation: a redis sorted set per site of
+"<client_id>/<sensor_id>" scored with the time(epoch second) until which the sensor
+is considered online, i.e. its last reading + missed uploads * upload_interval.
+the heartbeat tracker of the ingestion(see cloud_ingest.heartbeat) updates the
+scores, and the count of a site is one ZCOUNT from now, so it stays right across
+restarts of the ingestion and without it the sensors just age out.
+"""
+import time
+from typing import Dict, List
+
+from redis import Redis
+
+SENSOR_ONLINE_PREFIX = "sensor_online:site:"
+
+
+def get_sensor_online_key(site_id) -> str:
+    return f"{SENSOR_ONLINE_PREFIX}{site_id}"
+
+
+def get_sensor_member(client_id: str, sensor_id: str) -> str:
+    return f"{client_id}/{sensor_id}"
+
+
+def update_online_deadlines(
+    redis_cli: Redis, deadlines: Dict[str, Dict[str, float]], retention: float
+):
+    """
+    :param deadlines: site_id -> {sensor member: online until}
+    :param retention: second, the sensors offline longer are removed
+    """
+    pipeline = redis_cli.pipeline(transaction=False)
+    now = time.time()
+    for site_id, members in deadlines.items():
+        key = get_sensor_online_key(site_id)
+        pipeline.zadd(key, members)
+        pipeline.zremrangebyscore(key, "-inf", now - retention)
+    pipeline.execute()
+
+
+def get_site_online_counts(redis_cli: Redis, site_ids: List[str]) -> Dict[str, int]:
+    """one round-trip for all sites"""
+    pipeline = redis_cli.pipeline(transaction=False)
+    now = time.time()
+    for site_id in site_ids:
+        pipeline.zcount(get_sensor_online_key(site_id), now, "+inf")
+    return dict(zip(site_ids, pipeline.execute()))
+
+
+def get_online_sensors(redis_cli: Redis, site_id) -> List[str]:
+    """:return: the online sensor members of the site"""
+    return redis_cli.zrangebyscore(get_sensor_online_key(site_id), time.time(), "+inf")
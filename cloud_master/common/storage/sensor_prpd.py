@@ -0,0 +1,234 @@
+"""
+phase resolved partial discharge(PRPD) histograms of the UHF and AE sensors: the
+pulses of the phase resolved pulse sequences(PRPS, cycles x phases amplitudes) of
+the readings are counted into a fixed phase bin x amplitude bin matrix:
+    phase bin = phase * phase_bins // phases of the PRPS,
+    amplitude bin = (amplitude - low) * amplitude_bins // (high - low),
+the readings are stacked in batches of `batch_size` and counted by one
+np.bincount on the flattened bin indices.
+the histograms are additive, the one of a day is kept in the prpd_daily collection
+once the day is over(plus `cache_delay` for the late readings):
+    {
+        "sensor_id": "xx", "sensor_type": "UHF", "client_id": "xx",
+        "day": datetime, "readings": 1440, "phase_bins": 64, "amplitude_bins": 64,
+        "amplitude_range": [0, 80], "counts": Binary(phase_bins x amplitude_bins),
+    }
+so the histogram of a time range is the sum of the cached days, and only the
+partial days at both ends and the current day are read from the readings.
+a cached day of other bins than the configured ones is computed again.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import pymongo
+from cloud.settings import MONGO_CLIENT, PRPD_CONFIG
+
+from common.storage.array_codec import (
+    DTYPE_CODES,
+    decode_array,
+    is_encoded_array,
+    pack_array,
+)
+from common.storage.sensor_store import sensor_store
+
+PRPD_DAILY_COLLECTION = "prpd_daily"
+
+prpd_daily_col = MONGO_CLIENT[PRPD_DAILY_COLLECTION]
+
+
+def ensure_prpd_indexes() -> list:
+    return [
+        prpd_daily_col.create_index(
+            [
+                ("sensor_id", pymongo.ASCENDING),
+                ("sensor_type", pymongo.ASCENDING),
+                ("day", pymongo.ASCENDING),
+            ],
+            unique=True,
+            background=True,
+        ),
+        prpd_daily_col.create_index(
+            [("client_id", pymongo.ASCENDING)], background=True
+        ),
+    ]
+
+
+def delete_prpd_histograms(query: dict):
+    """:param query: filter on sensor_id or client_id, with sensor_type"""
+    prpd_daily_col.delete_many(query)
+
+
+class PrpdHistogram(object):
+    def __init__(
+        self,
+        sensor_type: str,
+        phase_bins: Optional[int] = None,
+        amplitude_bins: Optional[int] = None,
+        amplitude_range: Optional[list] = None,
+    ):
+        """the bins of the sensor type in PRPD_CONFIG if not given"""
+        self.sensor_type = sensor_type
+        self.field = PRPD_CONFIG["fields"][sensor_type]
+        self.phase_bins = phase_bins or PRPD_CONFIG["phase_bins"]
+        self.amplitude_bins = amplitude_bins or PRPD_CONFIG["amplitude_bins"]
+        low, high = amplitude_range or PRPD_CONFIG["amplitude_range"][sensor_type]
+        self.amplitude_range = [low, high]
+        self.counts = np.zeros((self.phase_bins, self.amplitude_bins), dtype=np.int64)
+        self.readings = 0
+
+    def get_prps(self, reading: dict) -> Optional[np.ndarray]:
+        """:return: cycles x phases amplitudes of the reading, None if not given"""
+        value = reading.get("params", {}).get(self.sensor_type, {}).get(self.field)
+        if value is None:
+            return None
+        prps = decode_array(value) if is_encoded_array(value) else np.asarray(value)
+        if prps.dtype.kind not in "iuf" or not prps.size:
+            return None
+        # a single cycle is sent as a flat list
+        return prps.reshape(-1, prps.shape[-1]) if prps.ndim > 1 else prps[None]
+
+    def add_batch(self, batch: list):
+        """count the pulses of PRPS of the same shape"""
+        prps = np.stack(batch)
+        low, high = self.amplitude_range
+        phases = np.broadcast_to(np.arange(prps.shape[-1]), prps.shape)
+        # zero amplitudes are the phases without a pulse
+        pulses = prps > low
+        phase_bins = phases[pulses] * self.phase_bins // prps.shape[-1]
+        amplitude_bins = (
+            (prps[pulses] - low) * self.amplitude_bins / (high - low)
+        ).astype(np.int64)
+        np.clip(amplitude_bins, 0, self.amplitude_bins - 1, out=amplitude_bins)
+        self.counts += np.bincount(
+            phase_bins * self.amplitude_bins + amplitude_bins,
+            minlength=self.phase_bins * self.amplitude_bins,
+        ).reshape(self.phase_bins, self.amplitude_bins)
+        self.readings += len(batch)
+
+    def add_readings(self, readings: list, batch_size: Optional[int] = None):
+        batch_size = batch_size or PRPD_CONFIG["batch_size"]
+        batch = []
+        for reading in readings:
+            if (prps := self.get_prps(reading)) is None:
+                continue
+            if batch and (prps.shape != batch[0].shape or len(batch) >= batch_size):
+                self.add_batch(batch)
+                batch = []
+            batch.append(prps)
+        if batch:
+            self.add_batch(batch)
+
+    def add_histogram(self, counts: np.ndarray, readings: int):
+        self.counts += counts
+        self.readings += readings
+
+    def is_same_bins(self, document: dict) -> bool:
+        return (
+            document.get("phase_bins") == self.phase_bins
+            and document.get("amplitude_bins") == self.amplitude_bins
+            and document.get("amplitude_range") == self.amplitude_range
+        )
+
+    def to_document(self, sensor_id: str, client_id: Optional[str], day: datetime):
+        return {
+            "sensor_id": sensor_id,
+            "sensor_type": self.sensor_type,
+            "client_id": client_id,
+            "day": day,
+            "readings": self.readings,
+            "phase_bins": self.phase_bins,
+            "amplitude_bins": self.amplitude_bins,
+            "amplitude_range": self.amplitude_range,
+            # int64 whatever the bins and the counts are
+            "counts": pack_array(self.counts, DTYPE_CODES[5]),
+        }
+
+
+def compute_prpd(
+    sensor_type: str,
+    sensor_id: str,
+    start_date: datetime,
+    end_date: datetime,
+    histogram: Optional[PrpdHistogram] = None,
+) -> tuple:
+    """
+    count the readings in [start_date, end_date) into the histogram
+    :return: (histogram, client_id of the readings)
+    """
+    histogram = histogram or PrpdHistogram(sensor_type)
+    readings = sensor_store.find_readings(
+        sensor_type,
+        sensor_id,
+        start_date,
+        end_date,
+        include_end=False,
+        fields=[f"params.{sensor_type}.{histogram.field}"],
+    )
+    histogram.add_readings(readings)
+    return histogram, readings[0].get("client_id") if readings else None
+
+
+def get_prpd(
+    sensor_type: str,
+    sensor_id: str,
+    start_date: datetime,
+    end_date: datetime,
+    now: Optional[datetime] = None,
+) -> PrpdHistogram:
+    """
+    the histogram of the readings in [start_date, end_date), the whole days in it are
+    read from the prpd_daily cache, and cached if they are over but missing
+    """
+    now = now or datetime.now()
+    histogram = PrpdHistogram(sensor_type)
+    first_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day < start_date:
+        first_day += timedelta(days=1)
+    days = []
+    day = first_day
+    while day + timedelta(days=1) <= end_date:
+        days.append(day)
+        day += timedelta(days=1)
+    if not days:
+        return compute_prpd(sensor_type, sensor_id, start_date, end_date, histogram)[0]
+    if start_date < days[0]:
+        compute_prpd(sensor_type, sensor_id, start_date, days[0], histogram)
+    cached = {
+        document["day"]: document
+        for document in prpd_daily_col.find(
+            {
+                "sensor_id": sensor_id,
+                "sensor_type": sensor_type,
+                "day": {"$gte": days[0], "$lte": days[-1]},
+            }
+        )
+    }
+    cache_delay = timedelta(seconds=PRPD_CONFIG["cache_delay"])
+    upserts = []
+    for day in days:
+        document = cached.get(day)
+        if document is not None and histogram.is_same_bins(document):
+            histogram.add_histogram(
+                decode_array(document["counts"]), document["readings"]
+            )
+            continue
+        day_histogram, client_id = compute_prpd(
+            sensor_type, sensor_id, day, day + timedelta(days=1)
+        )
+        histogram.add_histogram(day_histogram.counts, day_histogram.readings)
+        if day + timedelta(days=1) + cache_delay <= now:
+            upserts.append(
+                pymongo.ReplaceOne(
+                    {"sensor_id": sensor_id, "sensor_type": sensor_type, "day": day},
+                    day_histogram.to_document(sensor_id, client_id, day),
+                    upsert=True,
+                )
+            )
+    if upserts:
+        prpd_daily_col.bulk_write(upserts, ordered=False)
+    if days[-1] + timedelta(days=1) < end_date:
+        compute_prpd(
+            sensor_type, sensor_id, days[-1] + timedelta(days=1), end_date, histogram
+        )
+    return histogram
@@ -0,0 +1,244 @@
+"""
+rollup aggregates of the numeric sensor params per sensor per minute, hour and day,
+they are kept in `<sensor_type>_rollup_<resolution>` collections:
+    {
+        "sensor_id": "xx", "sensor_type": "UHF", "client_id": "xx",
+        "period_start": datetime, "count": 3,
+        "fields": {"ampmax": {"min": 1, "max": 3, "sum": 6, "count": 3}, ...},
+    }
+they are maintained incrementally by the ingest writer, and rebuilt by the
+backfill_sensor_rollups command for historical data. the $inc of the incremental
+updates can't be repeated, so the periods of a batch which was written before
+(a retry after a partial write) are rebuilt from the stored readings instead.
+"""
+from datetime import datetime, timedelta
+
+import pymongo
+from cloud.settings import MONGO_CLIENT
+from pymongo import ReplaceOne, UpdateOne
+
+from common.const import SensorType
+from common.storage.sensor_store import floor_datetime, sensor_store
+
+# ordered from the finest to the coarsest
+ROLLUP_RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# params to roll up for every sensor type, all numeric params if not given
+ROLLUP_FIELDS = {SensorType.uhf.value: ["ampmax", "ampmean"]}
+
+
+def rollup_collection(sensor_type: str, resolution: str):
+    return MONGO_CLIENT[f"{sensor_type}_rollup_{resolution}"]
+
+
+def ensure_rollup_indexes() -> dict:
+    created = {}
+    for sensor_type in SensorType.values():
+        for resolution in ROLLUP_RESOLUTIONS:
+            mongo_col = rollup_collection(sensor_type, resolution)
+            created[mongo_col.name] = [
+                mongo_col.create_index(
+                    [
+                        ("sensor_id", pymongo.ASCENDING),
+                        ("period_start", pymongo.ASCENDING),
+                    ],
+                    unique=True,
+                    background=True,
+                ),
+                mongo_col.create_index(
+                    [("client_id", pymongo.ASCENDING)], background=True
+                ),
+            ]
+    return created
+
+
+def get_numeric_params(sensor_type: str, params: dict) -> dict:
+    values = params.get(sensor_type) or {}
+    fields = ROLLUP_FIELDS.get(sensor_type) or values.keys()
+    return {
+        field: values[field]
+        for field in fields
+        if isinstance(values.get(field), (int, float))
+        and not isinstance(values.get(field), bool)
+    }
+
+
+def aggregate_rollups(sensor_type: str, docs: list, resolution: str) -> dict:
+    """
+    :return: {(sensor_id, period_start): {"client_id": "xx", "count": 1, "fields": {}}}
+    """
+    seconds = ROLLUP_RESOLUTIONS[resolution]
+    rollups = {}
+    for data in docs:
+        key = (data["sensor_id"], floor_datetime(data["create_time"], seconds))
+        rollup = rollups.setdefault(
+            key, {"client_id": data["client_id"], "count": 0, "fields": {}}
+        )
+        rollup["count"] += 1
+        for field, value in get_numeric_params(sensor_type, data["params"]).items():
+            stats = rollup["fields"].get(field)
+            if stats is None:
+                rollup["fields"][field] = {
+                    "min": value,
+                    "max": value,
+                    "sum": value,
+                    "count": 1,
+                }
+            else:
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+                stats["sum"] += value
+                stats["count"] += 1
+    return rollups
+
+
+def build_rollup_upserts(sensor_type: str, docs: list, resolution: str) -> list:
+    """incremental updates for new readings"""
+    upserts = []
+    for (sensor_id, period_start), rollup in aggregate_rollups(
+        sensor_type, docs, resolution
+    ).items():
+        update = {
+            "$setOnInsert": {
+                "sensor_type": sensor_type,
+                "client_id": rollup["client_id"],
+            },
+            "$inc": {"count": rollup["count"]},
+        }
+        for field, stats in rollup["fields"].items():
+            update.setdefault("$min", {})[f"fields.{field}.min"] = stats["min"]
+            update.setdefault("$max", {})[f"fields.{field}.max"] = stats["max"]
+            update["$inc"][f"fields.{field}.sum"] = stats["sum"]
+            update["$inc"][f"fields.{field}.count"] = stats["count"]
+        upserts.append(
+            UpdateOne(
+                {"sensor_id": sensor_id, "period_start": period_start},
+                update,
+                upsert=True,
+            )
+        )
+    return upserts
+
+
+def build_rollup_replaces(sensor_type: str, docs: list, resolution: str) -> list:
+    """
+    replace the whole periods, docs must cover all readings of these periods,
+    so it's idempotent and used by the backfill.
+    """
+    return [
+        ReplaceOne(
+            {"sensor_id": sensor_id, "period_start": period_start},
+            {
+                "sensor_id": sensor_id,
+                "sensor_type": sensor_type,
+                "period_start": period_start,
+                **rollup,
+            },
+            upsert=True,
+        )
+        for (sensor_id, period_start), rollup in aggregate_rollups(
+            sensor_type, docs, resolution
+        ).items()
+    ]
+
+
+def upsert_rollups(sensor_type: str, docs: list):
+    for resolution in ROLLUP_RESOLUTIONS:
+        if upserts := build_rollup_upserts(sensor_type, docs, resolution):
+            rollup_collection(sensor_type, resolution).bulk_write(
+                upserts, ordered=False
+            )
+
+
+def replace_rollups(sensor_type: str, docs: list):
+    for resolution in ROLLUP_RESOLUTIONS:
+        if replaces := build_rollup_replaces(sensor_type, docs, resolution):
+            rollup_collection(sensor_type, resolution).bulk_write(
+                replaces, ordered=False
+            )
+
+
+def rebuild_rollups(sensor_type: str, docs: list):
+    """
+    replace the rollups of the coarsest periods of the docs by the ones of all the
+    stored readings of these periods, it's idempotent
+    """
+    period_seconds = max(ROLLUP_RESOLUTIONS.values())
+    periods = {
+        (data["sensor_id"], floor_datetime(data["create_time"], period_seconds))
+        for data in docs
+    }
+    for sensor_id, period_start in sorted(periods):
+        readings = sensor_store.find_readings(
+            sensor_type,
+            sensor_id,
+            period_start,
+            period_start + timedelta(seconds=period_seconds),
+            include_end=False,
+        )
+        if readings:
+            replace_rollups(sensor_type, readings)
+
+
+def find_rollups(
+    sensor_type: str,
+    sensor_id: str,
+    resolution: str,
+    start_date: datetime,
+    end_date: datetime,
+) -> list:
+    """
+    :return: readings in the shape of the raw document, the mean of every field
+             is under the field name, with `<field>_min` and `<field>_max`
+    """
+    rollups = (
+        rollup_collection(sensor_type, resolution)
+        .find(
+            {
+                "sensor_id": sensor_id,
+                "period_start": {
+                    "$gte": floor_datetime(start_date, ROLLUP_RESOLUTIONS[resolution]),
+                    "$lte": end_date,
+                },
+            },
+        )
+        .sort([("period_start", pymongo.ASCENDING)])
+    )
+    readings = []
+    for rollup in rollups:
+        values = {}
+        for field, stats in rollup.get("fields", {}).items():
+            values[field] = stats["sum"] / stats["count"]
+            values[f"{field}_min"] = stats["min"]
+            values[f"{field}_max"] = stats["max"]
+        readings.append(
+            {
+                "sensor_id": rollup["sensor_id"],
+                "sensor_type": rollup["sensor_type"],
+                "client_id": rollup["client_id"],
+                "create_time": rollup["period_start"],
+                "count": rollup["count"],
+                "params": {sensor_type: values},
+            }
+        )
+    return readings
+
+
+def get_rollup_resolution(
+    start_date: datetime, end_date: datetime, min_points: int
+) -> str:
+    """
+    the coarsest resolution which still gives `min_points` periods in the range,
+    "" means even the finest rollup is too coarse and raw readings should be used.
+    """
+    range_seconds = (end_date - start_date).total_seconds()
+    for resolution, seconds in reversed(ROLLUP_RESOLUTIONS.items()):
+        if range_seconds / seconds >= min_points:
+            return resolution
+    return ""
+
+
+def delete_rollups(sensor_type: str, query: dict):
+    """:param query: filter on sensor_id or client_id"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        rollup_collection(sensor_type, resolution).delete_many(query)
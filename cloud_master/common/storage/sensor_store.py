@@ -0,0 +1,353 @@
+"""
+storage engines of the sensor readings, selected by SENSOR_STORAGE_CONFIG["mode"]:
+    raw: one document per reading in the `<sensor_type>` collection;
+    bucket: the readings of one sensor in one time bucket are packed into one document
+            of the `<sensor_type>_bucket` collection with parallel arrays:
+            {
+                "sensor_id": "xx", "sensor_type": "UHF", "client_id": "xx",
+                "bucket_start": datetime, "count": 2,
+                "first_time": datetime, "last_time": datetime,
+                "create_time": [datetime, datetime],
+                "params": [{...}, {...}],
+                "version": ["1.0", "1.0"],
+                "reading_ids": [ObjectId, ObjectId],  # _id of the readings
+                "zscore": [{...}, {...}],
+                "reading_keys": ["xx", ObjectId],  # reading_key, or _id without it
+            }
+both engines return readings in the shape of the raw document, with their _id and
+zscore, so the readers don't need to know which one is used.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pymongo
+from cloud.settings import MONGO_CLIENT, SENSOR_STORAGE_CONFIG
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from common.const import SensorType
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def floor_datetime(date_time: datetime, seconds: int) -> datetime:
+    """floor date_time to a multiple of `seconds` since epoch"""
+    epoch = datetime(1970, 1, 1, tzinfo=date_time.tzinfo)
+    offset = (date_time - epoch).total_seconds() % seconds
+    return date_time - timedelta(seconds=offset)
+
+
+class RawSensorStore(object):
+    mode = "raw"
+    time_field = "create_time"
+    indexes = [
+        # PointsTrendService range scans and BaseService.delete_sensor_data
+        ([("sensor_id", pymongo.ASCENDING), ("create_time", pymongo.ASCENDING)], {}),
+        # BaseService.delete_sensor_data_from_gateway
+        ([("client_id", pymongo.ASCENDING)], {}),
+        # duplicate suppression of the ingestion, see cloud_ingest.dedup
+        (
+            [("reading_key", pymongo.ASCENDING)],
+            {
+                "unique": True,
+                "partialFilterExpression": {"reading_key": {"$type": "string"}},
+            },
+        ),
+    ]
+
+    @staticmethod
+    def collection_name(sensor_type: str) -> str:
+        return sensor_type
+
+    @classmethod
+    def collection(cls, sensor_type: str):
+        return MONGO_CLIENT[cls.collection_name(sensor_type)]
+
+    @classmethod
+    def ensure_indexes(cls) -> dict:
+        return {
+            cls.collection_name(sensor_type): [
+                cls.collection(sensor_type).create_index(
+                    keys, background=True, **options
+                )
+                for keys, options in cls.indexes
+            ]
+            for sensor_type in SensorType.values()
+        }
+
+    @classmethod
+    def write(cls, sensor_type: str, docs: list) -> list:
+        """:return: the docs inserted, without the duplicates rejected"""
+        try:
+            cls.collection(sensor_type).insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # readings retried or replayed from the spool may be inserted already,
+            # and readings redelivered by the broker have the same reading_key
+            write_errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != DUPLICATE_KEY_ERROR for error in write_errors
+            ):
+                raise
+            duplicates = {error["index"] for error in write_errors}
+            return [data for index, data in enumerate(docs) if index not in duplicates]
+        return docs
+
+    @classmethod
+    def get_time_range_query(
+        cls,
+        sensor_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        include_end: bool = True,
+    ) -> dict:
+        end_operator = "$lte" if include_end else "$lt"
+        return {
+            "sensor_id": sensor_id,
+            "create_time": {"$gte": start_date, end_operator: end_date},
+        }
+
+    @staticmethod
+    def get_display_fields(fields: Optional[list] = None) -> dict:
+        display_fields = {
+            "sensor_id": 1,
+            "sensor_type": 1,
+            "client_id": 1,
+            "create_time": 1,
+            "zscore": 1,
+        }
+        display_fields.update({field: 1 for field in fields or ["params"]})
+        return display_fields
+
+    @classmethod
+    def find_readings(
+        cls,
+        sensor_type: str,
+        sensor_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        include_end: bool = True,
+        fields: Optional[list] = None,
+        limit: int = 0,
+    ) -> list:
+        """
+        :param fields: params fields to return, such as ["params.UHF.ampmax"],
+                       all params are returned if not given
+        :param limit: 0 means no limit
+        :return: readings sorted by create_time
+        """
+        display_fields = cls.get_display_fields(fields)
+        readings = (
+            cls.collection(sensor_type)
+            .find(
+                cls.get_time_range_query(sensor_id, start_date, end_date, include_end),
+                display_fields,
+            )
+            .sort([(cls.time_field, pymongo.ASCENDING)])
+            .limit(limit)
+        )
+        return list(readings)
+
+    @classmethod
+    def delete_readings(cls, sensor_type: str, query: dict):
+        """:param query: filter on sensor_id or client_id"""
+        cls.collection(sensor_type).delete_many(query)
+
+
+class BucketSensorStore(RawSensorStore):
+    mode = "bucket"
+    time_field = "bucket_start"
+    indexes = [
+        (
+            [("sensor_id", pymongo.ASCENDING), ("bucket_start", pymongo.ASCENDING)],
+            {"unique": True},
+        ),
+        ([("client_id", pymongo.ASCENDING)], {}),
+    ]
+    bucket_seconds = SENSOR_STORAGE_CONFIG.get("bucket_seconds", 3600)
+
+    @staticmethod
+    def collection_name(sensor_type: str) -> str:
+        return f"{sensor_type}_bucket"
+
+    @classmethod
+    def get_bucket_start(cls, create_time: datetime) -> datetime:
+        return floor_datetime(create_time, cls.bucket_seconds)
+
+    @staticmethod
+    def get_reading_key(data: dict):
+        """the reading_key of the broker redeliveries, else the _id of the retries"""
+        if (reading_key := data.get("reading_key")) is not None:
+            return reading_key
+        return data.get("_id")
+
+    @classmethod
+    def build_bucket_upserts(cls, docs: list, group: bool = True) -> list:
+        """
+        :param group: one upsert for the readings of a bucket, else one per reading
+        :return: [(upsert, its readings)], an upsert doesn't match a bucket which
+                 has one of its readings, and fails with a duplicate key error
+        """
+        buckets = defaultdict(list)
+        for index, data in enumerate(docs):
+            bucket_start = cls.get_bucket_start(data["create_time"])
+            bucket = (data["sensor_id"], bucket_start)
+            buckets[bucket if group else (*bucket, index)].append(data)
+        upserts = []
+        for (sensor_id, bucket_start, *_), readings in buckets.items():
+            create_times = [data["create_time"] for data in readings]
+            reading_keys = [
+                key for key in map(cls.get_reading_key, readings) if key is not None
+            ]
+            bucket_filter = {"sensor_id": sensor_id, "bucket_start": bucket_start}
+            if reading_keys:
+                bucket_filter["reading_keys"] = {"$nin": reading_keys}
+            update = {
+                "$setOnInsert": {
+                    "sensor_type": readings[0]["sensor_type"],
+                    "client_id": readings[0]["client_id"],
+                },
+                "$push": {
+                    "create_time": {"$each": create_times},
+                    "params": {"$each": [data["params"] for data in readings]},
+                    "version": {
+                        "$each": [data.get("version", "") for data in readings]
+                    },
+                    "reading_ids": {"$each": [data.get("_id") for data in readings]},
+                    "zscore": {"$each": [data.get("zscore", {}) for data in readings]},
+                    "reading_keys": {"$each": reading_keys},
+                },
+                "$inc": {"count": len(readings)},
+                "$min": {"first_time": min(create_times)},
+                "$max": {"last_time": max(create_times)},
+            }
+            upserts.append((UpdateOne(bucket_filter, update, upsert=True), readings))
+        return upserts
+
+    @classmethod
+    def write_upserts(cls, sensor_type: str, upserts: list) -> list:
+        """:return: the readings of the upserts failed with a duplicate key error"""
+        try:
+            cls.collection(sensor_type).bulk_write(
+                [upsert for upsert, _ in upserts], ordered=False
+            )
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != DUPLICATE_KEY_ERROR for error in write_errors
+            ):
+                raise
+            return [
+                data for error in write_errors for data in upserts[error["index"]][1]
+            ]
+        return []
+
+    @classmethod
+    def write(cls, sensor_type: str, docs: list) -> list:
+        """
+        the readings of a bucket are pushed by one upsert; if it fails as the bucket
+        has one of them already(retried or replayed from the spool, or redelivered
+        by the broker), or was created meanwhile by another worker, they are
+        upserted one by one, and the ones failing again are the duplicates
+        :return: the docs written, without the duplicates
+        """
+        conflicts = cls.write_upserts(sensor_type, cls.build_bucket_upserts(docs))
+        if not conflicts:
+            return docs
+        duplicates = cls.write_upserts(
+            sensor_type, cls.build_bucket_upserts(conflicts, group=False)
+        )
+        duplicate_ids = {id(data) for data in duplicates}
+        return [data for data in docs if id(data) not in duplicate_ids]
+
+    @classmethod
+    def get_time_range_query(
+        cls,
+        sensor_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        include_end: bool = True,
+    ) -> dict:
+        end_operator = "$lte" if include_end else "$lt"
+        return {
+            "sensor_id": sensor_id,
+            "bucket_start": {
+                "$gt": start_date - timedelta(seconds=cls.bucket_seconds),
+                end_operator: end_date,
+            },
+        }
+
+    @staticmethod
+    def align_entries(entries: list, create_times: list) -> list:
+        """
+        the readings pushed into a bucket before it kept reading_ids and zscore
+        come first and have none
+        """
+        return [None] * (len(create_times) - len(entries)) + entries
+
+    @classmethod
+    def find_readings(
+        cls,
+        sensor_type: str,
+        sensor_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        include_end: bool = True,
+        fields: Optional[list] = None,
+        limit: int = 0,
+    ) -> list:
+        display_fields = {
+            **cls.get_display_fields(fields),
+            "reading_ids": 1,
+            "_id": 0,
+        }
+        buckets = (
+            cls.collection(sensor_type)
+            .find(
+                cls.get_time_range_query(sensor_id, start_date, end_date, include_end),
+                display_fields,
+            )
+            .sort([(cls.time_field, pymongo.ASCENDING)])
+        )
+        readings = []
+        for bucket in buckets:
+            create_times = bucket["create_time"]
+            bucket_readings = sorted(
+                zip(
+                    create_times,
+                    bucket.get("params", []),
+                    cls.align_entries(bucket.get("reading_ids", []), create_times),
+                    cls.align_entries(bucket.get("zscore", []), create_times),
+                ),
+                key=lambda reading: reading[0],
+            )
+            for create_time, params, reading_id, zscore in bucket_readings:
+                if create_time < start_date or create_time > end_date:
+                    continue
+                if not include_end and create_time == end_date:
+                    continue
+                readings.append(
+                    {
+                        "sensor_id": bucket["sensor_id"],
+                        "sensor_type": bucket["sensor_type"],
+                        "client_id": bucket["client_id"],
+                        "create_time": create_time,
+                        "params": params,
+                        "_id": reading_id,
+                        "zscore": zscore or {},
+                    }
+                )
+                if limit and len(readings) >= limit:
+                    return readings
+        return readings
+
+
+SENSOR_STORES = {store.mode: store for store in (RawSensorStore, BucketSensorStore)}
+
+sensor_store = SENSOR_STORES[SENSOR_STORAGE_CONFIG.get("mode", RawSensorStore.mode)]
+
+
+def delete_sensor_readings(sensor_type: str, query: dict):
+    """delete from every engine, collections of a former mode may still have data"""
+    for store in SENSOR_STORES.values():
+        store.delete_readings(sensor_type, query)
@@ -1,3 +1,5 @@
+import base64
+import binascii
 import cProfile
 import datetime
 import hashlib
@@ -21,6 +23,8 @@ from xml.etree.ElementTree import fromstring
 import pytz
 import requests
 from babel.dates import format_datetime
+from bson import ObjectId
+from bson.errors import InvalidId
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from dicttoxml import default_item_func
@@ -386,6 +390,49 @@ def get_objects_pagination(page: int, limit: int, model_objects: QuerySet) -> Qu
     return model_objects[start:stop]
 
 
+def encode_page_token(last_id: ObjectId) -> str:
+    """opaque token of the last object of a page, the next page starts after it"""
+    return base64.urlsafe_b64encode(last_id.binary).decode()
+
+
+def decode_page_token(token: str) -> ObjectId:
+    """:raise ValueError: invalid token"""
+    try:
+        return ObjectId(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, InvalidId) as e:
+        raise ValueError(f"invalid page token: {token}") from e
+
+
+def paginate_objects(
+    model_objects: QuerySet,
+    page: int,
+    limit: int,
+    after: Optional[str] = None,
+    with_total: bool = True,
+) -> Tuple[list, Optional[int], Optional[str]]:
+    """
+    :param after: None for the page mode which skips (page - 1) * limit objects,
+                  otherwise the keyset mode: "" for the first page and the `next`
+                  token of the previous page for the followings, the objects are
+                  ordered by _id and the page is a range query over the _id index
+    :param with_total: count all objects or not, the total is None if not
+    :return: (objects of the page, total, next token), the next token is None
+             for the last page and in the page mode
+    """
+    total = model_objects.count() if with_total else None
+    if after is None:
+        return list(get_objects_pagination(page, limit, model_objects)), total, None
+    if after:
+        model_objects = model_objects.filter(id__gt=decode_page_token(after))
+    # one more object to know whether there is a next page
+    objects = list(model_objects.order_by("id")[: limit + 1])
+    next_token = None
+    if len(objects) > limit:
+        objects = objects[:limit]
+        next_token = encode_page_token(objects[-1].pk)
+    return objects, total, next_token
+
+
 def string_to_utc_time(time_string: str) -> datetime.datetime:
     datetime_struct = parser.parse(time_string, default=datetime.datetime(2020, 1, 1))
     date_time = datetime_struct.astimezone(pytz.utc)
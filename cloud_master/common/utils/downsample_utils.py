@@ -0,0 +1,71 @@
+"""
+Largest-Triangle-Three-Buckets downsampling, see:
+Sveinn Steinarsson, Downsampling Time Series for Visual Representation, 2013
+"""
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    >>> lttb_indices(np.arange(5), np.array([0, 1, 9, 1, 0]), 3).tolist()
+    [0, 2, 4]
+
+    select `threshold` points which keep the shape of the series,
+    the first and the last points are always kept.
+    :param x: sorted x values
+    :param y: y values
+    :param threshold: max number of points to keep
+    :return: sorted indices of the kept points
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # the points except the first and the last are split into threshold-2 buckets,
+    # bucket i is [edges[i], edges[i+1])
+    edges = (np.arange(threshold - 1) * (length - 2) / (threshold - 2)).astype(
+        np.int64
+    ) + 1
+    edges[-1] = length - 1
+    # the average point of every bucket, the last point stands for the bucket after
+    # the last one, all computed at once from the cumulative sums
+    x_sums = np.concatenate(([0.0], np.cumsum(x)))
+    y_sums = np.concatenate(([0.0], np.cumsum(y)))
+    counts = edges[1:] - edges[:-1]
+    avg_x = np.append((x_sums[edges[1:]] - x_sums[edges[:-1]]) / counts, x[-1])
+    avg_y = np.append((y_sums[edges[1:]] - y_sums[edges[:-1]]) / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, length - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # twice the area of the triangles (prev point, candidate, next bucket average)
+        areas = np.abs(
+            (x[prev] - avg_x[i + 1]) * (y[start:stop] - y[prev])
+            - (x[prev] - x[start:stop]) * (avg_y[i + 1] - y[prev])
+        )
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+    return selected
+
+
+def lttb_multi_indices(x: np.ndarray, ys: list, max_points: int) -> np.ndarray:
+    """
+    downsample several series sharing the same x, the points kept by every
+    series are merged, so the peaks of all series survive.
+    the values of a series can be nan, which are ignored by that series.
+    :return: sorted indices, no more than max(max_points, 3)
+    """
+    length = len(x)
+    if length <= max_points or not ys:
+        return np.arange(length)
+    if max_points // len(ys) < 3:
+        ys = ys[:1]
+    budget = max(max_points // len(ys), 3)
+    kept = []
+    for y in ys:
+        valid = np.flatnonzero(~np.isnan(y))
+        kept.append(valid[lttb_indices(x[valid], y[valid], budget)])
+    return np.unique(np.concatenate(kept))
@@ -1,8 +1,10 @@
 import logging
 
-from cloud.settings import CLIENT_IDS
-from cloud_mqtt.cloud_mqtt_client import cloud_mqtt_client
-from cloud_mqtt.deal_with_publish_message import BASE_GATEWAY_PUBLISH_TOPIC
+from cloud_mqtt import bridge
+from cloud_mqtt.deal_with_publish_message import (
+    BASE_GATEWAY_PUBLISH_TOPIC,
+    OnMqttMessage,
+)
 from customer.models.customer import Customer
 from equipment_management.models.gateway import GateWay
 from equipment_management.services.gateway_services import GatewayService
@@ -17,6 +19,8 @@ from rest_framework.status import (
     HTTP_201_CREATED,
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_503_SERVICE_UNAVAILABLE,
+    HTTP_504_GATEWAY_TIMEOUT,
 )
 from sites.models.site import Site
 
@@ -24,6 +28,7 @@ from common.const import RoleLevel
 from common.framework.permissions import PermissionFactory
 from common.framework.response import BaseResponse
 from common.framework.view import BaseView
+from common.storage.client_id_cache import add_client_id, remove_client_id
 from common.storage.redis import redis
 
 logger = logging.getLogger(__name__)
@@ -55,7 +60,7 @@ class GatewaysView(BaseView):
         logger.info(f"{user.username} create a gateway with data: {data}")
         gateway = GatewayService(data["site_id"]).create_gateway(data)
         # add this client_number to redis
-        redis.sadd(CLIENT_IDS, gateway.client_number)
+        add_client_id(redis, gateway.client_number)
         return BaseResponse(data=gateway.to_dict(), status_code=HTTP_201_CREATED)
 
 
@@ -92,8 +97,8 @@ class GatewayView(BaseView):
         if update_fields:
             gateway.update(**update_fields)
         if data["changed_client_id"]:
-            redis.srem(CLIENT_IDS, old_client_id)
-            redis.sadd(CLIENT_IDS, client_number)
+            remove_client_id(redis, old_client_id)
+            add_client_id(redis, client_number)
         return BaseResponse(data=update_fields)
 
     def delete(self, request, gateway_id):
@@ -119,15 +124,19 @@ class GatewaySensorsView(BaseView):
         sensor_id = data.get("sensor_id")
         sensor_name = data.get("sensor_name")
         sensor_type = data.get("sensor_type")
-        total, data = GatewayService.get_sensor_info_in_gateway(
+        total, data, next_token = GatewayService.get_sensor_info_in_gateway(
             page,
             limit,
             gateway.client_number,
             sensor_name=sensor_name,
             sensor_id=sensor_id,
             sensor_type=sensor_type,
+            after=data.get("after"),
+            with_total=data["with_total"],
+        )
+        return BaseResponse(
+            data={"total": total, "sensor_info": data, "next": next_token}
         )
-        return BaseResponse(data={"total": total, "sensor_info": data})
 
 
 class SensorsByPublishView(BaseView):
@@ -139,10 +148,33 @@ class SensorsByPublishView(BaseView):
             f"{request.user.username} request list sensors in {client_number=} by mqtt publish client"
         )
         try:
-            cloud_mqtt_client.mqtt_publish(
-                f"/{client_number}{BASE_GATEWAY_PUBLISH_TOPIC}"
-            )
+            # the reply is also saved by OnMqttMessage.deal_with_sensors_in_gateway_msg
+            reply = bridge.request(f"/{client_number}{BASE_GATEWAY_PUBLISH_TOPIC}")
         except Exception as e:
             logger.exception(f"get list sensors failed in mqtt with {e=}")
             return BaseResponse(status_code=HTTP_400_BAD_REQUEST)
-        return BaseResponse()
+        if reply is None:
+            return BaseResponse(
+                msg=f"gateway {client_number} didn't reply in time",
+                code=HTTP_504_GATEWAY_TIMEOUT,
+                status_code=HTTP_504_GATEWAY_TIMEOUT,
+            )
+        return BaseResponse(data=OnMqttMessage.get_sensor_info(reply))
+
+
+class MqttHealthView(BaseView):
+    """mqtt连接状态, 给负载均衡做健康检查"""
+
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get(self, request):
+        health = bridge.health()
+        if not health["healthy"]:
+            return BaseResponse(
+                msg="mqtt connection is down",
+                code=HTTP_503_SERVICE_UNAVAILABLE,
+                data=health,
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return BaseResponse(data=health)
@@ -6,7 +6,7 @@ from equipment_management.models.sensor_config import SensorConfig
 from mongoengine import Q
 
 from common.framework.service import BaseService
-from common.utils import get_objects_pagination
+from common.utils import paginate_objects
 
 
 class GatewayService(BaseService):
@@ -47,6 +47,8 @@ class GatewayService(BaseService):
         sensor_name: Optional[str],
         sensor_id: Optional[str],
         sensor_type: Optional[str],
+        after: Optional[str] = None,
+        with_total: bool = True,
     ) -> tuple:
         sensor_query = Q(client_number=client_number)
         if sensor_id:
@@ -58,8 +60,15 @@ class GatewayService(BaseService):
         sensors = SensorConfig.objects.only(
             "name", "sensor_number", "sensor_type"
         ).filter(sensor_query)
-        total = sensors.count()
-        sensor_by_page = get_objects_pagination(page, limit, sensors)
+        sensor_by_page, total, next_token = paginate_objects(
+            sensors, page, limit, after, with_total
+        )
+        sensor_infos = cls.get_latest_sensor_infos(
+            [
+                (sensor_config.sensor_number, sensor_config.sensor_type)
+                for sensor_config in sensor_by_page
+            ]
+        )
         data = []
         for sensor_config in sensor_by_page:
             data.append(
@@ -67,9 +76,9 @@ class GatewayService(BaseService):
                     "name": sensor_config.name,
                     "sensor_id": sensor_config.sensor_number,
                     "sensor_type": sensor_config.sensor_type,
-                    "sensor_info": cls.get_latest_sensor_info(
-                        sensor_config.sensor_number, sensor_config.sensor_type
-                    ),
+                    "sensor_info": sensor_infos[
+                        (sensor_config.sensor_number, sensor_config.sensor_type)
+                    ],
                 }
             )
-        return total, data
+        return total, data, next_token
@@ -2,6 +2,7 @@ from django.urls import path, re_path
 from equipment_management.apis.gateway_apis import (
     GatewaysView,
     GatewayView,
+    MqttHealthView,
     SiteGatewaysView,
 )
 
@@ -17,4 +18,5 @@ urlpatterns = [
         GatewayView.as_view(),
         name="gateway_actions",
     ),
+    re_path(r"^mqtt/health/$", MqttHealthView.as_view(), name="mqtt_health"),
 ]
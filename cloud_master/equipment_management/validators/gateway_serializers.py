@@ -7,7 +7,7 @@ from sites.models.site import Site
 from common.const import MAX_LENGTH_NAME, MAX_MESSAGE_LENGTH, SensorType
 from common.error_code import StatusCode
 from common.framework.exception import APIException, InvalidException
-from common.framework.serializer import BaseSerializer
+from common.framework.serializer import BaseSerializer, PageLimitSerializer
 
 
 def validate_site_id(site_id: str):
@@ -129,9 +129,7 @@ class DeleteGatewaySerializer(BaseSerializer):
         return data
 
 
-class SensorConfigSerializer(BaseSerializer):
-    page = IntegerField(required=False)
-    limit = IntegerField(required=False)
+class SensorConfigSerializer(PageLimitSerializer):
     sensor_name = CharField(required=False)
     sensor_id = CharField(required=False)
     sensor_type = CharField(required=False)
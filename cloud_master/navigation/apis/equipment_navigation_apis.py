@@ -1,8 +1,8 @@
 import logging
 
-from customer.models.customer import Customer
 from file_management.models.electrical_equipment import ElectricalEquipment
 from mongoengine import DoesNotExist
+from navigation.services.customer_tree_service import CustomerTreeService
 from navigation.services.equipment_navigation_service import SiteNavigationService
 from rest_framework.status import HTTP_404_NOT_FOUND
 from sites.models.site import Site
@@ -29,18 +29,14 @@ class CustomerTreesView(BaseView):
         )
         if user.is_cloud_or_client_super_admin():
             # get all customer tree infos
-            data = SiteNavigationService.get_customers_tree_infos(
-                customer_id, add_point
-            )
+            data = CustomerTreeService.get_customers_tree_infos(customer_id, add_point)
         else:
             # get corresponding customer's tree info
-            customer = Customer.objects.only("name").get(pk=customer_id)
             query_sites = user.sites if user.is_normal_admin() else None
-            data = [
-                SiteNavigationService.get_one_customer_tree_infos(
-                    customer, add_point, site_ids=query_sites
-                )
-            ]
+            customer_tree = CustomerTreeService.get_one_customer_tree_infos(
+                customer_id, add_point, site_ids=query_sites
+            )
+            data = [customer_tree] if customer_tree else []
         return BaseResponse(data=data)
 
 
@@ -60,10 +56,18 @@ class SiteSensorsView(BaseView):
         except DoesNotExist:
             logger.info(f"invalid {site_id=}")
             return BaseResponse(status_code=HTTP_404_NOT_FOUND)
-        site_sensors, total = SiteNavigationService.get_all_sensors_in_site(
-            page, limit, site
+        site_sensors, total, next_token = SiteNavigationService.get_all_sensors_in_site(
+            page, limit, site, data.get("after"), data["with_total"]
+        )
+        online_count = SiteNavigationService.get_site_online_count(site)
+        return BaseResponse(
+            data={
+                "sensor_list": site_sensors,
+                "total": total,
+                "next": next_token,
+                "online_count": online_count,
+            }
         )
-        return BaseResponse(data={"sensor_list": site_sensors, "total": total})
 
 
 class EquipmentSensorsView(BaseView):
@@ -82,10 +86,13 @@ class EquipmentSensorsView(BaseView):
         except DoesNotExist:
             logger.info(f"invalid {equipment_id=}")
             return BaseResponse(status_code=HTTP_404_NOT_FOUND)
-        equipment_sensors, total = SiteNavigationService.get_all_sensors_in_equipment(
-            page, limit, equipment
+        get_sensors = SiteNavigationService.get_all_sensors_in_equipment
+        equipment_sensors, total, next_token = get_sensors(
+            page, limit, equipment, data.get("after"), data["with_total"]
+        )
+        return BaseResponse(
+            data={"sensor_list": equipment_sensors, "total": total, "next": next_token}
         )
-        return BaseResponse(data={"sensor_list": equipment_sensors, "total": total})
 
 
 class CustomerSensorsView(BaseView):
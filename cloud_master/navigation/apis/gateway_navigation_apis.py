@@ -2,8 +2,7 @@ import logging
 
 from common.framework.response import BaseResponse
 from common.framework.view import BaseView
-from customer.models.customer import Customer
-from navigation.services.equipment_navigation_service import SiteNavigationService
+from navigation.services.customer_tree_service import CustomerTreeService
 
 logger = logging.getLogger(__name__)
 
@@ -20,16 +19,14 @@ class GatewayTreesView(BaseView):
         logger.info(f"{user.username} request GatewayTrees with for {customer_id=}")
         if user.is_cloud_or_client_super_admin():
             # get all customer tree infos
-            data = SiteNavigationService.get_customers_tree_infos(
+            data = CustomerTreeService.get_customers_tree_infos(
                 customer_id, is_gateway_tree=True
             )
         else:
             # get corresponding customer's tree info
-            customer = Customer.objects.only("name").get(pk=customer_id)
             query_sites = user.sites if user.is_normal_admin() else None
-            data = list(
-                SiteNavigationService.get_one_customer_tree_infos(
-                    customer, is_gateway_tree=True, site_ids=query_sites
-                )
+            customer_tree = CustomerTreeService.get_one_customer_tree_infos(
+                customer_id, is_gateway_tree=True, site_ids=query_sites
             )
+            data = [customer_tree] if customer_tree else []
         return BaseResponse(data=data)
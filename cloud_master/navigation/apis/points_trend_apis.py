@@ -3,6 +3,7 @@ import logging
 from navigation.services.points_trend_service import PointsTrendService
 from navigation.validators.point_trend_sereializers import (
     BasePointSerializer,
+    PointPrpdSerializer,
     PointTrendSerializer,
 )
 
@@ -19,7 +20,8 @@ class PointsTrendView(BaseView):
         :param : {
                     "point_ids": ["61939faab767c4804ca0a25f", "6193a4bfb767c4804ca0a260"],
                     "start_date": "2021-11-13 00:00:00",
-                    "end_date": "2021-11-29 23:59:59"
+                    "end_date": "2021-11-29 23:59:59",
+                    "max_points": 500  # optional
         }
         :return:
         """
@@ -27,9 +29,10 @@ class PointsTrendView(BaseView):
         point_ids = data["point_ids"]
         start_date = data["start_date"]
         end_date = data["end_date"]
+        max_points = data.get("max_points")
         logger.info(f"{request.user.username} request points trend with {data=}")
         sensor_trend_data = PointsTrendService.get_points_trend_data(
-            point_ids, start_date, end_date
+            point_ids, start_date, end_date, max_points
         )
         return BaseResponse(data=sensor_trend_data)
 
@@ -47,3 +50,24 @@ class PointsGraphView(BaseView):
             point_ids, start_date
         )
         return BaseResponse(data=data)
+
+
+class PointsPrpdView(BaseView):
+    def post(self, request):
+        """
+        PRPD histograms(phase bin x amplitude bin pulse counts) of the UHF and AE points
+        :param : {
+                    "point_ids": ["61939faab767c4804ca0a25f"],
+                    "start_date": "2021-11-13 00:00:00",
+                    "end_date": "2021-11-20 00:00:00"  # optional, one day if not given
+        }
+        :return: [{"measure_id", "measure_name", "sensor_type", "sensor_number",
+                   "readings", "phase_bins", "amplitude_bins", "amplitude_range",
+                   "max_count", "counts": [[int] * amplitude_bins] * phase_bins}]
+        """
+        data, _ = self.get_validated_data(PointPrpdSerializer)
+        logger.info(f"{request.user.username} request points prpd with {data=}")
+        prpd_data = PointsTrendService.get_points_prpd(
+            data["point_ids"], data["start_date"], data.get("end_date")
+        )
+        return BaseResponse(data=prpd_data)
@@ -0,0 +1,73 @@
+import logging
+
+from equipment_management.models.gateway import GateWay
+from file_management.models.electrical_equipment import ElectricalEquipment
+from mongoengine import DoesNotExist
+from navigation.services.reading_stream_service import ReadingStreamService
+from navigation.validators.reading_stream_serializers import ReadingStreamSerializer
+from rest_framework.status import HTTP_404_NOT_FOUND
+from sites.models.site import Site
+
+from common.framework.response import BaseResponse
+from common.framework.view import BaseView
+
+logger = logging.getLogger(__name__)
+
+
+class SiteReadingStreamView(BaseView):
+    def get(self, request, site_id):
+        """
+        live readings of the site for the dashboards, poll with the returned
+        last_id as `after` to get the readings since then
+        :param site_id:
+        :return: {"readings": [{"id", "client_id", "sensor_id", "sensor_type",
+                                "create_time", "params"}], "last_id": "..."}
+        """
+        data, _ = self.get_validated_data(ReadingStreamSerializer)
+        try:
+            site = Site.objects.get(id=site_id)
+        except DoesNotExist:
+            logger.info(f"invalid {site_id=}")
+            return BaseResponse(status_code=HTTP_404_NOT_FOUND)
+        readings, last_id = ReadingStreamService.get_site_readings(
+            site, data.get("after", ""), data["count"]
+        )
+        return BaseResponse(data={"readings": readings, "last_id": last_id})
+
+
+class EquipmentReadingStreamView(BaseView):
+    def get(self, request, equipment_id):
+        """
+        live readings of the points in the equipment, see SiteReadingStreamView
+        :param equipment_id:
+        :return:
+        """
+        data, _ = self.get_validated_data(ReadingStreamSerializer)
+        try:
+            equipment = ElectricalEquipment.objects.get(id=equipment_id)
+        except DoesNotExist:
+            logger.info(f"invalid {equipment_id=}")
+            return BaseResponse(status_code=HTTP_404_NOT_FOUND)
+        readings, last_id = ReadingStreamService.get_equipment_readings(
+            equipment, data.get("after", ""), data["count"]
+        )
+        return BaseResponse(data={"readings": readings, "last_id": last_id})
+
+
+class GatewayReadingStreamView(BaseView):
+    def get(self, request, gateway_id):
+        """
+        live readings received from the gateway, see SiteReadingStreamView
+        :param gateway_id:
+        :return:
+        """
+        data, _ = self.get_validated_data(ReadingStreamSerializer)
+        try:
+            gateway = GateWay.objects.get(id=gateway_id)
+        except DoesNotExist:
+            logger.info(f"invalid {gateway_id=}")
+            return BaseResponse(status_code=HTTP_404_NOT_FOUND)
+        readings, last_id = ReadingStreamService.get_gateway_readings(
+            gateway, data.get("after", ""), data["count"]
+        )
+        return BaseResponse(data={"readings": readings, "last_id": last_id})
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class NavigationConfig(AppConfig):
+    name = "navigation"
+
+    def ready(self):
+        # register the cache invalidation of the customer trees
+        import navigation.services.customer_tree_service  # noqa: F401
@@ -0,0 +1,220 @@
+"""
+customer trees(customer -> site -> equipment -> point, or customer -> site -> gateway)
+built with one query per level, and cached in redis per customer and tree type.
+the cache keys carry a generation which is increased whenever a document of the
+tree is written, so all cached trees are invalidated at once.
+"""
+
+import json
+import logging
+from typing import Optional
+
+from customer.models.customer import Customer
+from equipment_management.models.gateway import GateWay
+from file_management.models.electrical_equipment import ElectricalEquipment
+from file_management.models.measure_point import MeasurePoint
+from redis import RedisError
+from sites.models.site import Site
+
+from common.framework.queryset import on_document_changed
+from common.framework.service import BaseService
+from common.storage.redis import redis
+
+logger = logging.getLogger(__name__)
+
+TREE_GENERATION = "customer_tree:generation"
+TREE_CACHE_TTL = 24 * 60 * 60
+
+
+@on_document_changed(Customer, Site, ElectricalEquipment, MeasurePoint, GateWay)
+def invalidate_customer_trees(document_cls):
+    # the document is written already, a stale tree until TREE_CACHE_TTL is better
+    # than a failed write
+    try:
+        redis.incr(TREE_GENERATION)
+    except RedisError as e:
+        logger.error(
+            f"invalidate customer trees of {document_cls.__name__} failed: {e=}"
+        )
+
+
+class CustomerTreeService(BaseService):
+    @staticmethod
+    def get_tree_type(add_point: bool, is_gateway_tree: bool) -> str:
+        if is_gateway_tree:
+            return "gateway"
+        return "point" if add_point else "equipment"
+
+    @classmethod
+    def get_customer_trees(
+        cls,
+        customer_ids: list,
+        add_point: bool = False,
+        is_gateway_tree: bool = False,
+    ) -> dict:
+        """
+        :return: {customer_id(str): tree}, missing customers are not in the result
+        """
+        customer_ids = [str(customer_id) for customer_id in customer_ids]
+        if not customer_ids:
+            return {}
+        tree_type = cls.get_tree_type(add_point, is_gateway_tree)
+        try:
+            generation = redis.get(TREE_GENERATION) or 0
+            cache_keys = [
+                f"customer_tree:{generation}:{tree_type}:{customer_id}"
+                for customer_id in customer_ids
+            ]
+            trees = {
+                customer_id: json.loads(cached)
+                for customer_id, cached in zip(customer_ids, redis.mget(cache_keys))
+                if cached
+            }
+        except RedisError as e:
+            # the trees are built from mongodb without the cache
+            logger.error(f"read customer trees cache failed with {e=}")
+            return cls.build_customer_trees(customer_ids, add_point, is_gateway_tree)
+        missing_ids = [
+            customer_id for customer_id in customer_ids if customer_id not in trees
+        ]
+        if missing_ids:
+            built_trees = cls.build_customer_trees(
+                missing_ids, add_point, is_gateway_tree
+            )
+            logger.info(f"build {tree_type} trees for {len(built_trees)} customers")
+            trees.update(built_trees)
+            try:
+                pipeline = redis.pipeline(transaction=False)
+                for customer_id, tree in built_trees.items():
+                    pipeline.set(
+                        f"customer_tree:{generation}:{tree_type}:{customer_id}",
+                        json.dumps(tree),
+                        ex=TREE_CACHE_TTL,
+                    )
+                pipeline.execute()
+            except RedisError as e:
+                logger.error(f"cache customer trees failed with {e=}")
+        return trees
+
+    @classmethod
+    def build_customer_trees(
+        cls,
+        customer_ids: list,
+        add_point: bool = False,
+        is_gateway_tree: bool = False,
+    ) -> dict:
+        customer_trees = {
+            str(customer_id): {
+                "id": str(customer_id),
+                "label": name,
+                "type": "customer",
+                "children": [],
+            }
+            for customer_id, name in Customer.objects.filter(
+                id__in=customer_ids
+            ).values_list("id", "name")
+        }
+        site_trees = {}
+        for site_id, customer_id, name in Site.objects.filter(
+            customer__in=customer_ids
+        ).values_list("id", "customer", "name"):
+            site_tree = {
+                "parent_id": str(customer_id),
+                "label": name,
+                "id": str(site_id),
+                "type": "site",
+                "children": [],
+            }
+            site_trees[site_id] = site_tree
+            if str(customer_id) in customer_trees:
+                customer_trees[str(customer_id)]["children"].append(site_tree)
+        if is_gateway_tree:
+            cls.add_gateway_nodes(site_trees)
+        else:
+            cls.add_equipment_nodes(site_trees, add_point)
+        return customer_trees
+
+    @staticmethod
+    def add_gateway_nodes(site_trees: dict):
+        for gateway_id, site_id, name in GateWay.objects.filter(
+            site_id__in=site_trees.keys()
+        ).values_list("id", "site_id", "name"):
+            site_trees[site_id]["children"].append(
+                {
+                    "parent_id": str(site_id),
+                    "label": name,
+                    "id": str(gateway_id),
+                    "type": "gateway",
+                    # todo add sensor infos to children
+                    "children": [],
+                }
+            )
+
+    @staticmethod
+    def add_equipment_nodes(site_trees: dict, add_point: bool):
+        equipment_trees = {}
+        for equipment_id, site_id, device_name in ElectricalEquipment.objects.filter(
+            site_id__in=site_trees.keys()
+        ).values_list("id", "site_id", "device_name"):
+            equipment_tree = {
+                "parent_id": str(site_id),
+                "label": device_name,
+                "id": str(equipment_id),
+                "type": "equipment",
+                "children": [],
+            }
+            equipment_trees[equipment_id] = equipment_tree
+            site_trees[site_id]["children"].append(equipment_tree)
+        if not add_point:
+            return
+        for point_id, equipment_id, measure_name in MeasurePoint.objects.filter(
+            equipment_id__in=equipment_trees.keys()
+        ).values_list("id", "equipment_id", "measure_name"):
+            equipment_trees[equipment_id]["children"].append(
+                {
+                    "label": measure_name,
+                    "id": str(point_id),
+                    "type": "point",
+                    "parent_id": str(equipment_id),
+                }
+            )
+
+    @classmethod
+    def get_customers_tree_infos(
+        cls,
+        named_all_customer: str,
+        add_point: bool = False,
+        is_gateway_tree: bool = False,
+    ) -> list:
+        customer_ids = list(
+            Customer.objects.filter(id__ne=named_all_customer).values_list("id")
+        )
+        trees = cls.get_customer_trees(customer_ids, add_point, is_gateway_tree)
+        return [
+            trees[str(customer_id)]
+            for customer_id in customer_ids
+            if str(customer_id) in trees
+        ]
+
+    @classmethod
+    def get_one_customer_tree_infos(
+        cls,
+        customer_id: str,
+        add_point: bool = False,
+        is_gateway_tree: bool = False,
+        site_ids: Optional[list] = None,
+    ) -> Optional[dict]:
+        """
+        :param site_ids: normal user should only can see its belonging sites
+        """
+        tree = cls.get_customer_trees([customer_id], add_point, is_gateway_tree).get(
+            str(customer_id)
+        )
+        if tree and site_ids:
+            site_ids = {str(site_id) for site_id in site_ids}
+            tree["children"] = [
+                site_tree
+                for site_tree in tree["children"]
+                if site_tree["id"] in site_ids
+            ]
+        return tree
@@ -1,26 +1,35 @@
 from typing import Optional
 
-from customer.models.customer import Customer
-from equipment_management.models.gateway import GateWay
 from file_management.models.electrical_equipment import ElectricalEquipment
 from file_management.models.measure_point import MeasurePoint
 from sites.models.site import Site
 
 from common.framework.service import BaseService
-from common.utils import get_objects_pagination
+from common.storage.redis import redis
+from common.storage.sensor_online import get_site_online_counts
+from common.utils import paginate_objects
 
 
 class SiteNavigationService(BaseService):
     @classmethod
     def get_all_sensors_in_equipment(
-        cls, page: int, limit: int, equipment: ElectricalEquipment
+        cls,
+        page: int,
+        limit: int,
+        equipment: ElectricalEquipment,
+        after: Optional[str] = None,
+        with_total: bool = True,
     ) -> tuple:
         equipment_sensors = []
         points = MeasurePoint.objects.only(
             "measure_name", "measure_type", "sensor_number"
         ).filter(equipment_id=equipment.pk)
-        total = points.count()
-        points_by_page = get_objects_pagination(page, limit, points)
+        points_by_page, total, next_token = paginate_objects(
+            points, page, limit, after, with_total
+        )
+        sensor_infos = cls.get_latest_sensor_infos(
+            [(point.sensor_number, point.measure_type) for point in points_by_page]
+        )
         for point in points_by_page:
             sensor_number = point.sensor_number
             sensor_type = point.measure_type
@@ -31,23 +40,32 @@ class SiteNavigationService(BaseService):
                     "point_id": str(point.pk),
                     "type": sensor_type,
                     "sensor_id": point.sensor_number,
-                    "sensor_info": cls.get_latest_sensor_info(
-                        sensor_number, sensor_type
-                    ),
+                    "sensor_info": sensor_infos[(sensor_number, sensor_type)],
                 }
             )
-        return equipment_sensors, total
+        return equipment_sensors, total, next_token
 
     @classmethod
-    def get_all_sensors_in_site(cls, page: int, limit: int, site: Site) -> tuple:
+    def get_all_sensors_in_site(
+        cls,
+        page: int,
+        limit: int,
+        site: Site,
+        after: Optional[str] = None,
+        with_total: bool = True,
+    ) -> tuple:
         site_sensors = []
         equipments = ElectricalEquipment.objects.filter(site_id=site.pk)
         equipment_id_name = dict(equipments.values_list("id", "device_name"))
         points = MeasurePoint.objects.only(
             "measure_name", "measure_type", "sensor_number", "equipment_id"
         ).filter(equipment_id__in=equipment_id_name.keys())
-        total = points.count()
-        points_by_page = get_objects_pagination(page, limit, points)
+        points_by_page, total, next_token = paginate_objects(
+            points, page, limit, after, with_total
+        )
+        sensor_infos = cls.get_latest_sensor_infos(
+            [(point.sensor_number, point.measure_type) for point in points_by_page]
+        )
         for point in points_by_page:
             sensor_number = point.sensor_number
             sensor_type = point.measure_type
@@ -58,12 +76,10 @@ class SiteNavigationService(BaseService):
                     "point_id": str(point.pk),
                     "type": sensor_type,
                     "sensor_id": point.sensor_number,
-                    "sensor_info": cls.get_latest_sensor_info(
-                        sensor_number, sensor_type
-                    ),
+                    "sensor_info": sensor_infos[(sensor_number, sensor_type)],
                 }
             )
-        return site_sensors, total
+        return site_sensors, total, next_token
 
     # @classmethod
     # def get_all_sensors_in_customer(cls, customer: Customer) -> list:
@@ -74,105 +90,6 @@ class SiteNavigationService(BaseService):
     #     return customer_sensors
 
     @classmethod
-    def get_one_customer_tree_infos(
-        cls,
-        customer: Customer,
-        add_point: bool = False,
-        is_gateway_tree: bool = False,
-        site_ids: Optional[list] = None,
-    ) -> dict:
-        customer_tree_info = {
-            "id": str(customer.pk),
-            "label": customer.name,
-            "type": "customer",
-            "children": [],
-        }
-        if site_ids:
-            # normal user should only can see its belonging sites
-            sites = Site.objects.only("customer", "name").filter(id__in=site_ids)
-        else:
-            sites = Site.objects.only("customer", "name").filter(customer=customer.pk)
-        customer_tree_info["children"] = [
-            cls.get_one_site_tree_infos(site, add_point, is_gateway_tree)
-            for site in sites
-        ]
-        return customer_tree_info
-
-    @classmethod
-    def get_one_site_tree_infos(
-        cls, site: Site, add_point: bool = False, is_gateway_tree: bool = False
-    ) -> dict:
-        site_tree_info = {
-            "parent_id": str(site.customer),
-            "label": site.name,
-            "id": str(site.pk),
-            "type": "site",
-            "children": [],
-        }
-        if not is_gateway_tree:
-            equipments = ElectricalEquipment.objects.only(
-                "device_name", "site_id"
-            ).filter(site_id=site.pk)
-            site_tree_info["children"] = [
-                cls.get_one_equipment_tree_infos(equipment, add_point)
-                for equipment in equipments
-            ]
-        else:
-            gateways = GateWay.objects.only("name", "client_number", "site_id").filter(
-                site_id=site.pk
-            )
-            site_tree_info["children"] = [
-                cls.get_one_gateway_tree_infos(gateway) for gateway in gateways
-            ]
-        return site_tree_info
-
-    @classmethod
-    def get_one_equipment_tree_infos(
-        cls, equipment: ElectricalEquipment, add_point: bool = False
-    ) -> dict:
-        equipment_tree_info = {
-            "parent_id": str(equipment.site_id),
-            "label": equipment.device_name,
-            "id": str(equipment.pk),
-            "type": "equipment",
-            "children": [],
-        }
-        if add_point:
-            points = MeasurePoint.objects.only("measure_name", "equipment_id").filter(
-                equipment_id=equipment.pk
-            )
-            equipment_tree_info["children"] = [
-                {
-                    "label": point.measure_name,
-                    "id": str(point.pk),
-                    "type": "point",
-                    "parent_id": str(point.equipment_id),
-                }
-                for point in points
-            ]
-        return equipment_tree_info
-
-    @classmethod
-    def get_one_gateway_tree_infos(cls, gateway: GateWay) -> dict:
-        gateway_tree_info = {
-            "parent_id": str(gateway.site_id),
-            "label": gateway.name,
-            "id": str(gateway.pk),
-            "type": "gateway",
-            "children": [],
-        }
-        # todo add sensor infos to children
-        return gateway_tree_info
-
-    @classmethod
-    def get_customers_tree_infos(
-        cls,
-        named_all_customer: str,
-        add_point: bool = False,
-        is_gateway_tree: bool = False,
-    ) -> list:
-        customers = Customer.objects.filter(id__ne=named_all_customer)
-        return [
-            cls.get_one_customer_tree_infos(customer, add_point, is_gateway_tree)
-            for customer in customers
-        ]
+    def get_site_online_count(cls, site: Site) -> int:
+        """sensors of the site which reported in time, kept by the ingestion"""
+        return get_site_online_counts(redis, [str(site.pk)])[str(site.pk)]
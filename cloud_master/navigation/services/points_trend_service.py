@@ -1,18 +1,39 @@
 from datetime import datetime, timedelta
+from typing import Optional
 
+import numpy as np
 from cloud.models import bson_to_dict
-from cloud.settings import MONGO_CLIENT
+from cloud.settings import PRPD_CONFIG, SENSOR_ROLLUP_CONFIG
 from file_management.models.measure_point import MeasurePoint
 
 from common.const import SensorType
 from common.framework.service import BaseService
+from common.storage.array_codec import decode_params
+from common.storage.sensor_prpd import get_prpd
+from common.storage.sensor_rollup import (
+    ROLLUP_RESOLUTIONS,
+    find_rollups,
+    get_numeric_params,
+    get_rollup_resolution,
+)
+from common.storage.sensor_store import floor_datetime, sensor_store
+from common.utils.downsample_utils import lttb_multi_indices
 
 
 class PointsTrendService(BaseService):
     @classmethod
     def get_points_trend_data(
-        cls, point_ids: list, start_date: str, end_date: str
+        cls,
+        point_ids: list,
+        start_date: str,
+        end_date: str,
+        max_points: Optional[int] = None,
     ) -> list:
+        """
+        :param max_points: if given, every series is read from the rollups which still
+                           give so many points, and downsampled to no more than
+                           max_points points by LTTB; else the raw readings
+        """
         start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
         end_date = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
         points = MeasurePoint.objects.only(
@@ -22,45 +43,134 @@ class PointsTrendService(BaseService):
             str(point.pk): (point.sensor_number, point.measure_type, point.measure_name)
             for point in points
         }
+        if max_points:
+            resolution = cls.get_trend_resolution(start_date, end_date, max_points)
+        else:
+            resolution = ""
         data = []
         for (
             point_id,
             (sensor_number, sensor_type, measure_name),
         ) in point_to_sensor.items():
-            mongo_col = MONGO_CLIENT[sensor_type]
-            if sensor_type == SensorType.uhf.value:
-                display_fields = {
-                    "sensor_id": 1,
-                    "sensor_type": 1,
-                    "create_time": 1,
-                    f"params.{sensor_type.upper()}.ampmax": 1,
-                    f"params.{sensor_type.upper()}.ampmean": 1,
-                }
-            else:
-                display_fields = {
-                    "sensor_id": 1,
-                    "sensor_type": 1,
-                    "create_time": 1,
-                    "params": 1,
-                }
-            sensors = mongo_col.find(
-                {
-                    "sensor_id": sensor_number,
-                    "create_time": {"$gte": start_date, "$lte": end_date},
-                },
-                display_fields,
-            )
+            point_resolution = resolution
+            sensors = []
+            if resolution:
+                sensors = cls.get_rollup_trend_readings(
+                    sensor_type, sensor_number, resolution, start_date, end_date
+                )
+            if not sensors:
+                point_resolution = ""
+                sensors = cls.get_raw_trend_readings(
+                    sensor_type, sensor_number, start_date, end_date
+                )
+            if max_points:
+                sensors = cls.downsample_readings(sensor_type, sensors, max_points)
             sensor_list = cls.assemble_sensor_data(sensors)
             data.append(
                 {
                     "point_id": point_id,
                     "measure_type": sensor_type,
                     "measure_name": measure_name,
+                    "resolution": point_resolution or "raw",
                     "point_data": sensor_list,
                 }
             )
         return data
 
+    @classmethod
+    def get_rollup_trend_readings(
+        cls,
+        sensor_type: str,
+        sensor_number: str,
+        resolution: str,
+        start_date: datetime,
+        end_date: datetime,
+    ) -> list:
+        """
+        the rollups of the range, the readings before the first rollup(ingested
+        before the rollups, or before backfill_sensor_rollups has run) are read raw
+        and given in the shape of a rollup of one reading
+        """
+        rollups = find_rollups(
+            sensor_type, sensor_number, resolution, start_date, end_date
+        )
+        gap_end = rollups[0]["create_time"] if rollups else end_date
+        if gap_end <= floor_datetime(start_date, ROLLUP_RESOLUTIONS[resolution]):
+            return rollups
+        readings = cls.get_raw_trend_readings(
+            sensor_type, sensor_number, start_date, gap_end, include_end=not rollups
+        )
+        for reading in readings:
+            values = {}
+            for field, value in get_numeric_params(
+                sensor_type, decode_params(reading["params"])
+            ).items():
+                values.update(
+                    {field: value, f"{field}_min": value, f"{field}_max": value}
+                )
+            reading["params"] = {sensor_type: values}
+            reading["count"] = 1
+        return readings + rollups
+
+    @classmethod
+    def get_trend_resolution(
+        cls, start_date: datetime, end_date: datetime, min_points: Optional[int] = None
+    ) -> str:
+        """rollup resolution for the range, "" means raw readings"""
+        if not SENSOR_ROLLUP_CONFIG.get("enabled"):
+            return ""
+        return get_rollup_resolution(
+            start_date, end_date, min_points or SENSOR_ROLLUP_CONFIG["min_points"]
+        )
+
+    @classmethod
+    def downsample_readings(
+        cls, sensor_type: str, readings: list, max_points: int
+    ) -> list:
+        """keep the readings selected by LTTB on every numeric param"""
+        if len(readings) <= max_points:
+            return readings
+        values = [reading["params"].get(sensor_type) or {} for reading in readings]
+        fields = {
+            field
+            for value in values
+            for field, v in value.items()
+            if isinstance(v, (int, float)) and not isinstance(v, bool)
+        }
+        x = np.array([reading["create_time"].timestamp() for reading in readings])
+        ys = [
+            np.array([value.get(field, np.nan) for value in values], dtype=np.float64)
+            for field in sorted(fields)
+        ]
+        if not ys:
+            ys = [np.zeros(len(readings))]
+        return [readings[i] for i in lttb_multi_indices(x, ys, max_points)]
+
+    @classmethod
+    def get_raw_trend_readings(
+        cls,
+        sensor_type: str,
+        sensor_number: str,
+        start_date: datetime,
+        end_date: datetime,
+        include_end: bool = True,
+    ) -> list:
+        if sensor_type == SensorType.uhf.value:
+            fields = [
+                f"params.{sensor_type.upper()}.ampmax",
+                f"params.{sensor_type.upper()}.ampmean",
+            ]
+        else:
+            fields = None
+        return sensor_store.find_readings(
+            sensor_type,
+            sensor_number,
+            start_date,
+            end_date,
+            include_end=include_end,
+            fields=fields,
+        )
+
     @classmethod
     def assemble_sensor_data(cls, sensors):
         sensor_list = []
@@ -75,7 +185,7 @@ class PointsTrendService(BaseService):
                 "sensor_type": sensor_type,
                 "create_time": bson_to_dict(sensor["create_time"]),
             }
-            sensor_dict.update(sensor["params"][parm_key])
+            sensor_dict.update(decode_params(sensor["params"])[parm_key])
             sensor_list.append(sensor_dict)
         return sensor_list
 
@@ -92,26 +202,59 @@ class PointsTrendService(BaseService):
         for point in points:
             sensor_id = point.sensor_number
             sensor_type = point.measure_type
-            mongo_col = MONGO_CLIENT[sensor_type]
-            sensor = (
-                mongo_col.find(
-                    {
-                        "sensor_id": sensor_id,
-                        "create_time": {"$gte": start_date, "$lt": end_date},
-                    },
-                    {"create_time": 1, "params": 1, "_id": 0},
-                )
-                .sort([("create_time", 1)])
-                .limit(1)
+            sensors = sensor_store.find_readings(
+                sensor_type, sensor_id, start_date, end_date, include_end=False, limit=1
             )
-            if sensor:
+            if sensors:
                 data.append(
                     {
                         "measure_id": str(point.id),
                         "measure_name": point.measure_name,
                         "sensor_type": sensor_type,
                         "sensor_number": point.sensor_number,
-                        "sensor_info": bson_to_dict(sensor[0]),
+                        "sensor_info": bson_to_dict(
+                            {
+                                "create_time": sensors[0]["create_time"],
+                                "params": decode_params(sensors[0]["params"]),
+                            }
+                        ),
                     }
                 )
         return data
+
+    @classmethod
+    def get_points_prpd(
+        cls, point_ids: list, start_date: str, end_date: Optional[str] = None
+    ) -> list:
+        """
+        the PRPD histograms of the UHF and AE points in [start_date, end_date),
+        "counts" is a phase_bins x amplitude_bins matrix of the pulse counts
+        """
+        start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
+        if end_date:
+            end_date = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
+        else:
+            end_date = start_date + timedelta(days=1)
+        points = MeasurePoint.objects.only(
+            "sensor_number", "measure_type", "measure_name"
+        ).filter(pk__in=point_ids, measure_type__in=list(PRPD_CONFIG["fields"]))
+        data = []
+        for point in points:
+            histogram = get_prpd(
+                point.measure_type, point.sensor_number, start_date, end_date
+            )
+            data.append(
+                {
+                    "measure_id": str(point.id),
+                    "measure_name": point.measure_name,
+                    "sensor_type": point.measure_type,
+                    "sensor_number": point.sensor_number,
+                    "readings": histogram.readings,
+                    "phase_bins": histogram.phase_bins,
+                    "amplitude_bins": histogram.amplitude_bins,
+                    "amplitude_range": histogram.amplitude_range,
+                    "max_count": int(histogram.counts.max()),
+                    "counts": histogram.counts.tolist(),
+                }
+            )
+        return data
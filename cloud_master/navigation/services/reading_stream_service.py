@@ -0,0 +1,35 @@
+from equipment_management.models.gateway import GateWay
+from file_management.models.electrical_equipment import ElectricalEquipment
+from file_management.models.measure_point import MeasurePoint
+from sites.models.site import Site
+
+from common.framework.service import BaseService
+from common.storage.reading_stream import read_stream
+from common.storage.redis import redis
+
+
+class ReadingStreamService(BaseService):
+    """live readings from the site streams, see common.storage.reading_stream"""
+
+    @classmethod
+    def get_site_readings(cls, site: Site, after: str, count: int) -> tuple:
+        return read_stream(redis, site.pk, after, count)
+
+    @classmethod
+    def get_equipment_readings(
+        cls, equipment: ElectricalEquipment, after: str, count: int
+    ) -> tuple:
+        sensor_ids = set(
+            MeasurePoint.objects.filter(equipment_id=equipment.pk).values_list(
+                "sensor_number"
+            )
+        )
+        return read_stream(
+            redis, equipment.site_id, after, count, sensor_ids=sensor_ids
+        )
+
+    @classmethod
+    def get_gateway_readings(cls, gateway: GateWay, after: str, count: int) -> tuple:
+        return read_stream(
+            redis, gateway.site_id, after, count, client_ids={gateway.client_number}
+        )
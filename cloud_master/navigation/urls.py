@@ -6,7 +6,16 @@ from navigation.apis.equipment_navigation_apis import (
     SiteSensorsView,
 )
 from navigation.apis.gateway_navigation_apis import GatewayTreesView
-from navigation.apis.points_trend_apis import PointsTrendView, PointsGraphView
+from navigation.apis.points_trend_apis import (
+    PointsGraphView,
+    PointsPrpdView,
+    PointsTrendView,
+)
+from navigation.apis.reading_stream_apis import (
+    EquipmentReadingStreamView,
+    GatewayReadingStreamView,
+    SiteReadingStreamView,
+)
 
 urlpatterns = [
     re_path(
@@ -32,4 +41,20 @@ urlpatterns = [
         PointsGraphView.as_view(),
         name="points_graph",
     ),
+    re_path(r"^points-prpd/$", PointsPrpdView.as_view(), name="points_prpd"),
+    re_path(
+        r"^sites/(?P<site_id>[a-zA-Z0-9]+)/readings/stream/$",
+        SiteReadingStreamView.as_view(),
+        name="site_reading_stream",
+    ),
+    re_path(
+        r"^equipments/(?P<equipment_id>[a-zA-Z0-9]+)/readings/stream/$",
+        EquipmentReadingStreamView.as_view(),
+        name="equipment_reading_stream",
+    ),
+    re_path(
+        r"^gateways/(?P<gateway_id>[a-zA-Z0-9]+)/readings/stream/$",
+        GatewayReadingStreamView.as_view(),
+        name="gateway_reading_stream",
+    ),
 ]
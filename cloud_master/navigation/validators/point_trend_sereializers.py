@@ -1,4 +1,4 @@
-from rest_framework.fields import CharField, ListField, RegexField
+from rest_framework.fields import CharField, IntegerField, ListField, RegexField
 
 from common.framework.serializer import BaseSerializer
 
@@ -10,3 +10,10 @@ class BasePointSerializer(BaseSerializer):
 
 class PointTrendSerializer(BasePointSerializer):
     end_date = CharField(required=True)
+    # downsample every series to no more than max_points points
+    max_points = IntegerField(required=False, min_value=3, max_value=10000)
+
+
+class PointPrpdSerializer(BasePointSerializer):
+    # one day from start_date if not given
+    end_date = CharField(required=False)
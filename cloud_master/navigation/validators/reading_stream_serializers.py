@@ -0,0 +1,9 @@
+from rest_framework.fields import IntegerField, RegexField
+
+from common.framework.serializer import BaseSerializer
+
+
+class ReadingStreamSerializer(BaseSerializer):
+    # stream id of the last returned reading, the newest readings without it
+    after = RegexField(r"^\d+-\d+$", required=False)
+    count = IntegerField(required=False, min_value=1, max_value=1000, default=100)
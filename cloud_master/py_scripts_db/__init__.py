@@ -4,15 +4,24 @@ from customer.models.customer import Customer
 
 from common.framework.script import BaseHybridCloudScript
 from common.utils import get_the_range
+from py_scripts_db.encode_sensor_arrays import EncodeSensorArrays
+from py_scripts_db.init_sensor_latest import InitSensorLatest
+from py_scripts_db.migrate_sensor_buckets import MigrateSensorBuckets
 from py_scripts_db.models import ScriptEvidence
 from py_scripts_db.modify_tev_data import ModifyTEVData
 
 logger = logging.getLogger(__name__)
 
 # for every script added please add the class in the list, and be sure they are in order
-SCRIPT_LIST = [ModifyTEVData(),]
+SCRIPT_LIST = [
+    ModifyTEVData(),
+    InitSensorLatest(),
+    MigrateSensorBuckets(),
+    EncodeSensorArrays(),
+]
 
-NOT_LIMIT_SCRIPT_NAME = {}
+# scripts in this set are run every time
+NOT_LIMIT_SCRIPT_NAME = {"MigrateSensorBuckets"}
 
 
 class RunScripts:
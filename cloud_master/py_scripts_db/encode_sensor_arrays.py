@@ -0,0 +1,61 @@
+import logging
+
+import pymongo
+from pymongo import UpdateOne
+
+from common.const import SensorType
+from common.storage.array_codec import encode_params
+from common.storage.sensor_latest import sensor_latest_col
+from common.storage.sensor_store import SENSOR_STORES
+
+logger = logging.getLogger(__name__)
+
+
+class EncodeSensorArrays:
+    """
+    pack the numeric lists in the params of the existing readings, buckets and
+    sensor_latest documents into binary, see common.storage.array_codec.
+    encoding an encoded document changes nothing, so it can be rerun.
+    """
+
+    batch_size = 2000
+
+    @classmethod
+    def run_script(cls):
+        for store in SENSOR_STORES.values():
+            for sensor_type in SensorType.values():
+                cls.encode_collection(store.collection(sensor_type))
+        cls.encode_collection(sensor_latest_col)
+
+    @classmethod
+    def encode_params_field(cls, params):
+        # the params of a bucket is a list of the params of its readings
+        if isinstance(params, list):
+            return [encode_params(p) if isinstance(p, dict) else p for p in params]
+        return encode_params(params) if isinstance(params, dict) else params
+
+    @classmethod
+    def encode_collection(cls, mongo_col):
+        last_id, updated = None, 0
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            docs = list(
+                mongo_col.find(query, {"params": 1})
+                .sort([("_id", pymongo.ASCENDING)])
+                .limit(cls.batch_size)
+            )
+            if not docs:
+                break
+            last_id = docs[-1]["_id"]
+            updates = []
+            for doc in docs:
+                params = doc.get("params")
+                encoded = cls.encode_params_field(params)
+                if encoded != params:
+                    updates.append(
+                        UpdateOne({"_id": doc["_id"]}, {"$set": {"params": encoded}})
+                    )
+            if updates:
+                mongo_col.bulk_write(updates, ordered=False)
+                updated += len(updates)
+        logger.info(f"encoded the arrays of {updated} documents in {mongo_col.name}")
@@ -0,0 +1,24 @@
+from cloud.settings import MONGO_CLIENT
+
+from common.const import SensorType
+from common.storage.sensor_latest import (
+    ensure_sensor_latest_indexes,
+    upsert_sensor_latest,
+)
+
+
+class InitSensorLatest:
+    """seed sensor_latest store with the readings flagged by is_new"""
+
+    @classmethod
+    def run_script(cls):
+        ensure_sensor_latest_indexes()
+        for sensor_type in SensorType.values():
+            mongo_col = MONGO_CLIENT[sensor_type]
+            docs = list(mongo_col.find({"is_new": True}).sort([("create_time", 1)]))
+            for doc in docs:
+                doc.setdefault("update_time", doc["create_time"])
+            upsert_sensor_latest(docs)
+            mongo_col.update_many(
+                {"is_new": {"$exists": True}}, {"$unset": {"is_new": ""}}
+            )
@@ -0,0 +1,46 @@
+import logging
+
+import pymongo
+
+from common.const import SensorType
+from common.storage.sensor_store import (
+    BucketSensorStore,
+    RawSensorStore,
+    sensor_store,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MigrateSensorBuckets:
+    """
+    move the readings of the raw sensor collections into the bucket collections,
+    it only works when SENSOR_STORAGE_CONFIG["mode"] is "bucket".
+    the converted raw documents are deleted batch by batch, so it can be rerun
+    to continue after an interruption.
+    """
+
+    batch_size = 5000
+
+    @classmethod
+    def run_script(cls):
+        if sensor_store is not BucketSensorStore:
+            logger.info("sensor storage mode is not bucket, skip the migration")
+            return
+        BucketSensorStore.ensure_indexes()
+        for sensor_type in SensorType.values():
+            raw_col = RawSensorStore.collection(sensor_type)
+            migrated = 0
+            while True:
+                docs = list(
+                    raw_col.find()
+                    .sort([("_id", pymongo.ASCENDING)])
+                    .limit(cls.batch_size)
+                )
+                if not docs:
+                    break
+                docs.sort(key=lambda doc: doc["create_time"])
+                BucketSensorStore.write(sensor_type, docs)
+                raw_col.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+                migrated += len(docs)
+                logger.info(f"migrated {migrated} {sensor_type} readings into buckets")
@@ -1,19 +1,60 @@
 import datetime
 import json
-import re
+import logging
+import zlib
 from copy import deepcopy
+from typing import Optional
 
 import dateutil.parser
 import redis
 from cloud.settings import (
+    ALARM_CONFIG,
+    BASELINE_CONFIG,
+    DATA_LOADER_CONFIG,
+    HEARTBEAT_CONFIG,
+    INGEST_DEDUP_CONFIG,
+    INGEST_METRICS_CONFIG,
+    MONGO_CLIENT,
     MQTT_CLIENT_CONFIG,
+    READING_STREAM_CONFIG,
     REDIS_HOST,
     REDIS_PORT,
-    MONGO_CLIENT,
 )
+from bson import ObjectId
+from cloud_alarm.services.alarm_algorithm import AlarmEngine
+from cloud_ingest.baseline import BaselineTracker
+from cloud_ingest.buffered_writer import BufferedWriter, create_buffered_writer
+from cloud_ingest.dedup import RecentKeys, get_reading_key
+from cloud_ingest.heartbeat import HeartbeatTracker
+from cloud_ingest.metrics import INGEST_METRICS, start_metrics_server
+from cloud_ingest.sampled_logger import SampledLogger
+from cloud_ingest.supervisor import check_share_group
+from cloud_mqtt.topic_router import TopicRouter
 from paho.mqtt import client as mqtt_client
 
 from common.const import SensorType
+from common.storage.array_codec import encode_params
+from common.storage.client_id_cache import ClientIdCache
+from common.storage.reading_stream import GatewaySiteMap, ReadingStreamPublisher
+
+logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, INGEST_METRICS_CONFIG["log_sample_interval"])
+
+MESSAGES_TOTAL = INGEST_METRICS.counter(
+    "ingest_messages_total", "mqtt messages received", ["topic"]
+)
+READINGS_TOTAL = INGEST_METRICS.counter(
+    "ingest_readings_total", "readings buffered to write", ["sensor_type", "client_id"]
+)
+SKIPPED_TOTAL = INGEST_METRICS.counter(
+    "ingest_skipped_total", "messages or readings not loaded", ["reason"]
+)
+PARSE_SECONDS = INGEST_METRICS.histogram(
+    "ingest_parse_seconds", "json decoding of a message"
+)
+ALLOW_LIST_SECONDS = INGEST_METRICS.histogram(
+    "ingest_allow_list_seconds", "check of the enabled gateway client ids"
+)
 
 uhf_loading_data, ae_tev_loading_data = {}, {}
 
@@ -24,6 +65,11 @@ sensor_redis_cli = redis.Redis(
 )
 
 
+def get_partition(client_id: str, partition_count: int) -> int:
+    """stable in all processes, unlike hash() of str"""
+    return zlib.crc32(client_id.encode()) % partition_count
+
+
 class DataLoader:
     """
     just load data into mongodb
@@ -31,20 +77,86 @@ class DataLoader:
 
     collection_mapping = {"二合一传感器": "ae_tev", "特高频传感器": "uhf", "温度传感器": "temperature"}
 
-    pattern = re.compile(
-        r"/(?P<client_id>[a-zA-Z0-9]+)/subnode/(?P<sensor_id>[a-zA-Z0-9]+)/data_ctrl/property"
-    )
+    sensor_data_topic = "/+/subnode/+/data_ctrl/property"
 
-    def __init__(self, client_id, host, port):
+    def __init__(
+        self,
+        client_id,
+        host,
+        port,
+        partition_index: int = 0,
+        partition_count: int = 1,
+        share_group: str = "",
+        metrics_port: Optional[int] = None,
+        buffered_writer: Optional[BufferedWriter] = None,
+    ):
+        """
+        :param partition_index: only the gateways whose client_id hashes to it
+                                are loaded when partition_count > 1
+        :param share_group: subscribe with the MQTT shared subscription
+                            `$share/<share_group>/...`, then the broker partitions
+                            the messages and all of them are loaded; refused while
+                            the alarm, baseline or heartbeat engine is enabled
+        :param metrics_port: port of the /metrics endpoint, 0 to disable,
+                             default INGEST_METRICS_CONFIG["port"]
+        :param buffered_writer: default created from DATA_LOADER_CONFIG
+        """
+        check_share_group(share_group)
         self.client_id = client_id
         self.host = host
         self.port = port
+        self.partition_index = partition_index
+        self.partition_count = partition_count
+        self.share_group = share_group
+        self.metrics_port = (
+            INGEST_METRICS_CONFIG["port"] if metrics_port is None else metrics_port
+        )
+        self.metrics_server = None
         self.client = mqtt_client.Client(self.client_id)
+        self.client_id_cache = ClientIdCache(sensor_redis_cli)
+        self.buffered_writer = buffered_writer or create_buffered_writer(
+            DATA_LOADER_CONFIG, f"worker-{partition_index}"
+        )
+        self.reading_stream = None
+        if READING_STREAM_CONFIG["enabled"]:
+            # the written readings are appended to the live streams of their sites
+            self.reading_stream = ReadingStreamPublisher(
+                sensor_redis_cli,
+                GatewaySiteMap(
+                    MONGO_CLIENT, READING_STREAM_CONFIG["gateway_refresh_interval"]
+                ),
+                READING_STREAM_CONFIG["maxlen"],
+            )
+            self.buffered_writer.add_written_listener(self.reading_stream)
+        self.alarm_engine = None
+        if ALARM_CONFIG["enabled"]:
+            alarm_config = dict(ALARM_CONFIG)
+            alarm_config.pop("enabled")
+            self.alarm_engine = AlarmEngine(MONGO_CLIENT, **alarm_config)
+        self.baseline = None
+        if BASELINE_CONFIG["enabled"]:
+            baseline_config = dict(BASELINE_CONFIG)
+            baseline_config.pop("enabled")
+            self.baseline = BaselineTracker(**baseline_config)
+        self.heartbeat = None
+        if HEARTBEAT_CONFIG["enabled"]:
+            heartbeat_config = dict(HEARTBEAT_CONFIG)
+            heartbeat_config.pop("enabled")
+            self.heartbeat = HeartbeatTracker(
+                sensor_redis_cli, MONGO_CLIENT, **heartbeat_config
+            )
+        # message counters, see get_stats
+        self.received_count = 0
+        self.skipped_count = 0
+        self.loaded_count = 0
+        self.duplicate_count = 0
+        self.recent_keys = RecentKeys(INGEST_DEDUP_CONFIG["recent_keys"])
+        self.router = TopicRouter()
+        self.router.register(DataLoader.sensor_data_topic, self.on_sensor_data)
 
-    @staticmethod
-    def on_connect(client, userdata, flags, rc):
-        print(f"{datetime.datetime.now()} Connected with result code " + str(rc))
-        client.subscribe("#")  # 订阅消息
+    def on_connect(self, client, userdata, flags, rc):
+        sampled_logger.info("connected", rc=rc, client_id=self.client_id)
+        client.subscribe(self.router.subscriptions(self.share_group))  # 订阅消息
         # client.subscribe("8E001302000001A5")  # 订阅消息
 
     @staticmethod
@@ -59,92 +171,209 @@ class DataLoader:
         else:
             return ""
 
-    @staticmethod
-    def insert(client_id, sensor_id, sensor_type, msg_dict):
+    def insert(self, client_id, sensor_id, sensor_type, msg_dict):
+        """put the reading into the buffered writer, it is written in batches"""
         cur_time = dateutil.parser.parse(datetime.datetime.now().isoformat())
-        my_col = MONGO_CLIENT[sensor_type]
-        my_query = {"is_new": True, "sensor_id": sensor_id}
-        new_values = {"$set": {"is_new": False, "update_time": cur_time}}
-        my_col.update_many(my_query, new_values)
+        reading_key = get_reading_key(client_id, sensor_id, sensor_type, msg_dict)
+        if reading_key is not None and reading_key in self.recent_keys:
+            # redelivered by the broker
+            self.duplicate_count += 1
+            SKIPPED_TOTAL.inc(reason="duplicate")
+            return
         params = msg_dict.get("params", {})
         if sensor_type == SensorType.ae.value:
             params.pop("TEV")
         if sensor_type == SensorType.tev.value:
             params.pop("AE")
+        reading_id = ObjectId()
+        zscore = {}
+        if self.baseline is not None:
+            zscore = self.baseline.score(sensor_id, sensor_type, params)
         data = {
+            # given here, so the readings replayed from the spool are not duplicated
+            "_id": reading_id,
+            # the unique index on it rejects the redeliveries not caught in memory
+            "reading_key": reading_key,
             "client_id": client_id,
             "sensor_id": sensor_id,
             "version": msg_dict.get("version", ""),
             "sensor_type": sensor_type,
-            "params": params,
+            "params": encode_params(params),
+            # against the baseline of the sensor before this reading
+            "zscore": zscore,
             "create_time": cur_time,
             "update_time": cur_time,
-            "is_new": True,
         }
-        insert_res = my_col.insert_one(data)
-        if insert_res.acknowledged:
-            print(f"inset data succeed for {sensor_type}, {sensor_id=}, {client_id=}!")
-        else:
-            print(f"inset data failed with {msg_dict=}!")
+        if not self.buffered_writer.put(sensor_type, data):
+            SKIPPED_TOTAL.inc(reason="buffer_full")
+            sampled_logger.warning(
+                "buffer_full",
+                sample_key=client_id,
+                client_id=client_id,
+                sensor_id=sensor_id,
+            )
+            return
+        # a dropped reading isn't remembered, its redelivery is loaded
+        if reading_key is not None:
+            self.recent_keys.add(reading_key)
+        self.loaded_count += 1
+        READINGS_TOTAL.inc(sensor_type=sensor_type, client_id=client_id)
+        # only the readings accepted by the writer count in the baselines and the
+        # n-of-m windows of the rules, an alarm event never points to a dropped one
+        if self.baseline is not None:
+            self.baseline.update(sensor_id, sensor_type, params)
+        if self.alarm_engine is not None:
+            # in memory, the events are written by the engine's thread
+            self.alarm_engine.evaluate(
+                client_id, sensor_id, sensor_type, params, reading_id, cur_time
+            )
 
-    @staticmethod
-    def on_message(client, userdata, msg):
-        print(f"time: {datetime.datetime.now()} msg.topic:{msg.topic}")
-        ret = DataLoader.pattern.match(msg.topic)
-        if ret is not None:
-            client_id, sensor_id = ret.groups()[0], ret.groups()[1]
-            print(f"matched for {client_id=}, {sensor_id=}")
-            try:
-                if sensor_redis_cli.sismember("client_ids", client_id):
-
-                    msg_dict = json.loads(msg.payload.decode("utf-8"))
-                    sensor_type = DataLoader.get_sensor_type(msg_dict)
-                    if sensor_type:
-                        if sensor_type == SensorType.ae_tev():
-                            for sensor_type in SensorType.ae_tev():
-                                DataLoader.insert(
-                                    client_id,
-                                    sensor_id,
-                                    sensor_type,
-                                    deepcopy(msg_dict),
-                                )
-                        else:
-                            DataLoader.insert(
-                                client_id, sensor_id, sensor_type, msg_dict
-                            )
-            except Exception as e:
-                print(e)
+    def is_own_gateway(self, client_id: str) -> bool:
+        if self.partition_count <= 1 or self.share_group:
+            return True
+        return get_partition(client_id, self.partition_count) == self.partition_index
+
+    def on_message(self, client, userdata, msg):
+        self.received_count += 1
+        sampled_logger.debug("message_received", topic=msg.topic)
+        if not self.router.dispatch(msg.topic, msg.payload):
+            MESSAGES_TOTAL.inc(topic="unrouted")
+
+    def on_sensor_data(self, topic: str, args: list, payload: bytes):
+        MESSAGES_TOTAL.inc(topic=DataLoader.sensor_data_topic)
+        client_id, sensor_id = args
+        if not self.is_own_gateway(client_id):
+            self.skipped_count += 1
+            SKIPPED_TOTAL.inc(reason="other_partition")
+            return
+        try:
+            with ALLOW_LIST_SECONDS.time():
+                enabled = client_id in self.client_id_cache
+            if not enabled:
+                SKIPPED_TOTAL.inc(reason="gateway_disabled")
+                return
+            with PARSE_SECONDS.time():
+                msg_dict = json.loads(payload.decode("utf-8"))
+            sensor_type = DataLoader.get_sensor_type(msg_dict)
+            if not sensor_type:
+                SKIPPED_TOTAL.inc(reason="unknown_sensor_type")
+                return
+            if self.heartbeat is not None:
+                self.heartbeat.seen(client_id, sensor_id)
+            if sensor_type == SensorType.ae_tev():
+                for sensor_type in SensorType.ae_tev():
+                    self.insert(client_id, sensor_id, sensor_type, deepcopy(msg_dict))
+            else:
+                self.insert(client_id, sensor_id, sensor_type, msg_dict)
+        except Exception as e:
+            SKIPPED_TOTAL.inc(reason="error")
+            sampled_logger.error(
+                "load_failed",
+                sample_key=client_id,
+                client_id=client_id,
+                sensor_id=sensor_id,
+                error=repr(e),
+            )
 
     @staticmethod
     def on_subscribe(client, userdata, mid, granted_qos):
-        print("On Subscribed: qos = %d" % granted_qos)
+        sampled_logger.info("subscribed", granted_qos=granted_qos)
 
     @staticmethod
     def on_disconnect(client, userdata, rc):
         if rc != 0:
-            print("Unexpected disconnection %s" % rc)
+            sampled_logger.warning("unexpected_disconnection", rc=rc)
         else:
-            print("disconnection !!!")
+            sampled_logger.info("disconnected")
+
+    def get_stats(self) -> dict:
+        return {
+            "received": self.received_count,
+            "skipped": self.skipped_count,
+            "loaded": self.loaded_count,
+            "duplicates": self.duplicate_count,
+            **self.buffered_writer.get_stats(),
+            **self.get_engine_stats(),
+        }
+
+    def get_engine_stats(self) -> dict:
+        stats = {}
+        if self.alarm_engine is not None:
+            for key, value in self.alarm_engine.get_stats().items():
+                stats[f"alarm_{key}"] = value
+        if self.baseline is not None:
+            for key, value in self.baseline.get_stats().items():
+                stats[f"baseline_{key}"] = value
+        if self.heartbeat is not None:
+            for key, value in self.heartbeat.get_stats().items():
+                stats[f"sensors_{key}"] = value
+        return stats
+
+    def collect_metrics(self) -> dict:
+        """
+        gauges of the buffered writer, such as the queue depth and spool lag, and of
+        the alarm engine, baseline and heartbeat trackers
+        """
+        return {
+            **{
+                f"ingest_writer_{key}": value
+                for key, value in self.buffered_writer.get_stats().items()
+            },
+            **{
+                f"ingest_{key}": value for key, value in self.get_engine_stats().items()
+            },
+        }
+
+    def stop(self):
+        """make run() return after the buffered readings have been written"""
+        self.client.disconnect()
 
     def run(self):
         self.client.username_pw_set(
             MQTT_CLIENT_CONFIG["user"], MQTT_CLIENT_CONFIG["pw"]
         )
-        self.client.on_connect = DataLoader.on_connect
-        self.client.on_message = DataLoader.on_message
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
         self.client.on_subscribe = DataLoader.on_subscribe
         self.client.on_disconnect = DataLoader.on_disconnect
-        self.client.connect(self.host, self.port, 60)
-        self.client.loop_forever()
+        self.client_id_cache.start()
+        self.buffered_writer.start()
+        if self.alarm_engine is not None:
+            self.alarm_engine.start()
+        if self.baseline is not None:
+            self.baseline.start()
+        if self.heartbeat is not None:
+            self.heartbeat.start()
+        if self.metrics_port:
+            INGEST_METRICS.register_collector(self.collect_metrics)
+            self.metrics_server = start_metrics_server(
+                INGEST_METRICS, INGEST_METRICS_CONFIG["host"], self.metrics_port
+            )
+        try:
+            self.client.connect(self.host, self.port, 60)
+            self.client.loop_forever()
+        finally:
+            self.buffered_writer.stop()
+            if self.alarm_engine is not None:
+                self.alarm_engine.stop()
+            if self.baseline is not None:
+                self.baseline.stop()
+            if self.heartbeat is not None:
+                self.heartbeat.stop()
+            self.client_id_cache.stop()
+            if self.metrics_server is not None:
+                self.metrics_server.shutdown()
+                self.metrics_server.server_close()
+            INGEST_METRICS.unregister_collector(self.collect_metrics)
 
 
 subscribe_client_id = MQTT_CLIENT_CONFIG.get("subscribe_client_id", "")
 host = MQTT_CLIENT_CONFIG.get("host", "")
 port = MQTT_CLIENT_CONFIG.get("port", "")
-data_loader = DataLoader(subscribe_client_id, host, port)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     try:
-        data_loader.run()
+        DataLoader(subscribe_client_id, host, port).run()
     except Exception as e:
-        print(e)
+        logger.exception(f"data loader exited with {e=}")
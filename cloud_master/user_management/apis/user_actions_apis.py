@@ -47,10 +47,18 @@ class UsersView(BaseView):
         sites = data.get("sites")
         page = data.get("page", 1)
         limit = data.get("limit", 20)
-        total, user_info = UserService(user).get_users(
-            page, limit, username, customer, sites
+        total, user_info, next_token = UserService(user).get_users(
+            page,
+            limit,
+            username,
+            customer,
+            sites,
+            after=data.get("after"),
+            with_total=data["with_total"],
+        )
+        return BaseResponse(
+            data={"total": total, "users": user_info, "next": next_token}
         )
-        return BaseResponse(data={"total": total, "users": user_info})
 
     def post(self, request):
         """
@@ -7,7 +7,7 @@ from user_management.models.user import CloudUser
 
 from common.const import RoleLevel
 from common.framework.service import BaseService
-from common.utils import get_objects_pagination
+from common.utils import paginate_objects
 
 
 class UserService(BaseService):
@@ -41,7 +41,9 @@ class UserService(BaseService):
         username: Optional[str] = None,
         customer: Optional[str] = None,
         sites: Optional[list] = None,
-    ) -> Tuple[int, list]:
+        after: Optional[str] = None,
+        with_total: bool = True,
+    ) -> Tuple[Optional[int], list, Optional[str]]:
         query = Q(role_level__gte=self.user.role_level)
         if username:
             query &= Q(username__icontains=username)
@@ -55,9 +57,10 @@ class UserService(BaseService):
                 sites.append(SiteService.named_all_site_id())
             query &= Q(sites__in=sites)
         users = CloudUser.objects.filter(query)
-        total = users.count()
-        users_by_page = get_objects_pagination(page, limit, users)
-        customer_ids = set(users_by_page.values_list("customer"))
+        users_by_page, total, next_token = paginate_objects(
+            users, page, limit, after, with_total
+        )
+        customer_ids = {user.customer for user in users_by_page}
         customer_dict = CustomerService.get_customer_id_name_dict(customer_ids)
         user_info = [
             {
@@ -74,7 +77,7 @@ class UserService(BaseService):
             }
             for user in users_by_page
         ]
-        return total, user_info
+        return total, user_info, next_token
 
     @classmethod
     def update_user(
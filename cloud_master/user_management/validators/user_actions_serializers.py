@@ -6,7 +6,6 @@ from rest_framework.fields import (
     CharField,
     ChoiceField,
     EmailField,
-    IntegerField,
     ListField,
 )
 from sites.models.site import Site
@@ -14,12 +13,10 @@ from user_management.models.user import CloudUser
 
 from common.const import MAX_LENGTH_NAME, RoleLevel
 from common.framework.exception import APIException, ForbiddenException
-from common.framework.serializer import BaseSerializer
+from common.framework.serializer import BaseSerializer, PageLimitSerializer
 
 
-class UserListSerializer(BaseSerializer):
-    page = IntegerField(required=False, default=1)
-    limit = IntegerField(required=False, default=10)
+class UserListSerializer(PageLimitSerializer):
     username = CharField(required=False)
     customer = CharField(required=False)
     sites = ListField(child=CharField(), required=False)